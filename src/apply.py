@@ -0,0 +1,74 @@
+from typing import Any, Dict
+from github_utils import IssueMutation
+from async_github_utils import find_latest_comment_with_marker, get_login, has_write_access
+from responses import RewriteResponse, REWRITE_STATE_MARKER, without_rewrite_state
+from sections import replace_sections
+import tracing
+
+
+def update_issue_body_with_rewrite(original_body: str, new_description: str, new_acceptance_criteria: list[str]) -> str:
+    """Replace the Description and Acceptance Criteria sections, appending those the body lacks."""
+    contents = {}
+    if new_description:
+        contents["description"] = new_description
+    if new_acceptance_criteria:
+        contents["acceptance_criteria"] = "\n".join(f"- {item}" for item in new_acceptance_criteria)
+    return replace_sections(original_body, contents) if contents else original_body
+
+
+async def find_rewrite_comment(
+    token: str, repo_full_name: str, issue_number: int, comment: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Return the comment holding the rewrite to apply.
+
+    A plain "apply changes" reply carries no rewrite, so the bot's latest rewrite comment is used instead.
+    A reply that pastes an edited rewrite is applied as written when its author can push to the repository.
+    The embedded rewrite state is only trusted in the bot's own comments; a pasted one is dropped, since
+    it need not match the text around it.
+    """
+    body = comment["body"] or ""
+    if REWRITE_STATE_MARKER in body or "**title**:" in body.lower():
+        if comment["user"] == await get_login(token):
+            return comment
+        if await has_write_access(token, repo_full_name, comment["user"]):
+            print(f"✍️ Applying the rewrite pasted in comment {comment['id']}")
+            return {**comment, "body": without_rewrite_state(body)}
+        print(f"🟡 Ignoring the rewrite pasted by {comment['user']}, who cannot push to {repo_full_name}")
+    rewrite_comment = await find_latest_comment_with_marker(token, repo_full_name, issue_number, REWRITE_STATE_MARKER)
+    if rewrite_comment is None:
+        # Nothing trusted to apply; an empty rewrite leaves the issue as it is.
+        print(f"🟡 No rewrite comment by the bot on issue #{issue_number}")
+        return {**comment, "body": ""}
+    print(f"🔎 Applying the rewrite from comment {rewrite_comment['id']}")
+    return rewrite_comment
+
+
+def build_apply_mutation(repo_full_name: str, issue: Dict[str, Any], comment: Dict[str, Any]) -> IssueMutation:
+    """Turn the rewrite in an "apply changes" comment into a single pending update of the issue."""
+    with tracing.span("apply.build_mutation", issue=issue["number"], body_chars=len(issue["body"] or "")):
+        # Parse rewrite from comment body
+        rewrite = RewriteResponse.from_comment(comment["body"])
+
+        # Normalize title check helper
+        def normalize_text(text: str) -> str:
+            return text.lower().strip(" _*")
+
+        mutation = IssueMutation(repo_full_name, issue["number"], expected_updated_at=issue["updated_at"])
+
+        # Prepare updated title if valid
+        if rewrite.title and normalize_text(rewrite.title) != "no update provided.":
+            mutation.set_title(rewrite.title)
+            print(f"✅ Will update title to: {rewrite.title}")
+        else:
+            print("🟡 Skipping title update")
+
+        # Update issue body with description and acceptance criteria
+        new_body = update_issue_body_with_rewrite(
+            original_body=issue["body"] or "",
+            new_description=rewrite.description if rewrite.description and normalize_text(rewrite.description) != "no update provided." else None,
+            new_acceptance_criteria=rewrite.acceptance_criteria,
+        )
+        mutation.set_body(new_body)
+        print("✅ Issue body updated with new description and acceptance criteria")
+
+        return mutation
@@ -0,0 +1,96 @@
+# Async counterparts of the github_utils helpers. PyGithub is blocking, so each
+# call runs in a worker thread on the shared session; awaiting them lets GitHub
+# round trips overlap with LLM calls on a single event loop.
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+import github_graphql
+import github_utils
+import tracing
+from github_utils import IssueMutation
+
+
+async def get_github_issue(token: str, repo_full_name: str, issue_id: int) -> Optional[Dict[str, Any]]:
+    with tracing.span("github.get_issue", issue=issue_id):
+        return await asyncio.to_thread(github_utils.get_github_issue, token, repo_full_name, issue_id)
+
+
+async def _iterate(issues: Iterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    while True:
+        issue = await asyncio.to_thread(next, issues, None)
+        if issue is None:
+            return
+        yield issue
+
+
+def list_open_issues(token: str, repo_full_name: str) -> AsyncIterator[Dict[str, Any]]:
+    return _iterate(github_utils.list_open_issues(token, repo_full_name))
+
+
+def list_org_open_issues(token: str, org: str) -> AsyncIterator[Dict[str, Any]]:
+    return _iterate(github_graphql.list_org_open_issues(token, org))
+
+
+async def create_github_issue_comment(token: str, repo_full_name: str, issue_id: int, comment: str) -> None:
+    with tracing.span("github.create_comment", issue=issue_id, chars=len(comment)):
+        await asyncio.to_thread(github_utils.create_github_issue_comment, token, repo_full_name, issue_id, comment)
+
+
+async def upsert_github_issue_comment(
+    token: str, repo_full_name: str, issue_number: int, marker: str, comment: str
+) -> str:
+    with tracing.span("github.upsert_comment", issue=issue_number, chars=len(comment)) as span:
+        result = await asyncio.to_thread(
+            github_utils.upsert_github_issue_comment, token, repo_full_name, issue_number, marker, comment
+        )
+        span.set("result", result)
+        return result
+
+
+async def get_github_comment(token: str, repo_full_name: str, issue_number: int, comment_id: int) -> Dict[str, Any]:
+    with tracing.span("github.get_comment", issue=issue_number):
+        return await asyncio.to_thread(github_utils.get_github_comment, token, repo_full_name, issue_number, comment_id)
+
+
+async def get_login(token: str) -> str:
+    return await asyncio.to_thread(github_utils.get_session(token).login)
+
+
+async def has_write_access(token: str, repo_full_name: str, login: Optional[str]) -> bool:
+    with tracing.span("github.get_permission"):
+        return await asyncio.to_thread(github_utils.has_write_access, token, repo_full_name, login)
+
+
+async def find_latest_comment_with_marker(
+    token: str, repo_full_name: str, issue_number: int, marker: str
+) -> Optional[Dict[str, Any]]:
+    with tracing.span("github.find_marker_comment", issue=issue_number):
+        return await asyncio.to_thread(
+            github_utils.find_latest_comment_with_marker, token, repo_full_name, issue_number, marker
+        )
+
+
+async def apply_issue_mutation(token: str, mutation: IssueMutation) -> bool:
+    with tracing.span("github.apply_mutation", issue=mutation.issue_number):
+        return await asyncio.to_thread(mutation.apply, token)
+
+
+async def update_github_issue(
+    token: str,
+    repo_full_name: str,
+    issue_number: int,
+    title=None,
+    body=None,
+    labels=None,
+    expected_updated_at: Optional[str] = None,
+) -> bool:
+    with tracing.span("github.update_issue", issue=issue_number):
+        return await asyncio.to_thread(
+            github_utils.update_github_issue,
+            token,
+            repo_full_name,
+            issue_number,
+            title,
+            body,
+            labels,
+            expected_updated_at,
+        )
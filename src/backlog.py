@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, Set
+from hedging import health_stats
+from openai_utils import initialize_kernel, scheduler_stats, usage_totals
+from github_utils import get_session
+from completion_cache import open_completion_cache
+from duplicates import open_duplicate_index
+from async_github_utils import list_open_issues, list_org_open_issues
+from github_graphql import get_graphql_client
+from last_run import is_unchanged_since_last_run
+from pipeline import enhance_issue
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHECKPOINT = ".issue-enhancer-checkpoint"
+PROGRESS_EVERY = 10
+
+
+def issue_key(repo_full_name: str, issue_number: int) -> str:
+    return f"{repo_full_name}#{issue_number}"
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Return the keys of issues completed by earlier runs of the sweep."""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class SweepProgress:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def issues_per_minute(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.completed * 60 / elapsed if elapsed > 0 else 0.0
+
+    def as_str(self) -> str:
+        return (
+            f"{self.completed} enhanced, {self.failed} failed, {self.skipped} skipped "
+            f"({self.issues_per_minute():.1f} issues/min)"
+        )
+
+
+async def run_backlog_sweep(
+    inputs: Dict[str, Any], concurrency: int = DEFAULT_CONCURRENCY, checkpoint_path: str = DEFAULT_CHECKPOINT
+) -> SweepProgress:
+    """Enhance every open issue in a repository with at most `concurrency` issues in flight.
+
+    When `backlog_org` is set, the open issues of every repository in that organization are
+    streamed in from GitHub GraphQL instead. Completed issues are appended to the checkpoint
+    file, so a rerun skips them.
+    """
+    kernel = await asyncio.to_thread(initialize_kernel, inputs)
+    cache = open_completion_cache(inputs.get("cache_dir"), inputs.get("cache_ttl_hours"), inputs.get("cache_max_mb"))
+    duplicates = open_duplicate_index(inputs.get("cache_dir"), inputs.get("duplicate_threshold"))
+    org = inputs.get("backlog_org")
+    done = load_checkpoint(checkpoint_path)
+    progress = SweepProgress()
+    slots = asyncio.Semaphore(concurrency)
+    tasks: Set[asyncio.Task] = set()
+    if org:
+        issues = list_org_open_issues(inputs["github_token"], org)
+        scope = f"every repository in {org}"
+    else:
+        issues = list_open_issues(inputs["github_token"], inputs["repo_full_name"])
+        scope = inputs["repo_full_name"]
+
+    print(f"🧹 Sweeping open issues in {scope} ({concurrency} in flight, {len(done)} already done)")
+
+    with open(checkpoint_path, "a") as checkpoint:
+
+        async def process(issue: Dict[str, Any], repo_full_name: str, key: str) -> None:
+            try:
+                if inputs.get("skip_unchanged") and await is_unchanged_since_last_run(
+                    inputs["github_token"], repo_full_name, issue
+                ):
+                    progress.skipped += 1
+                    return
+                await enhance_issue(kernel, {**inputs, "repo_full_name": repo_full_name}, issue, cache, duplicates)
+            except Exception as e:
+                progress.failed += 1
+                print(f"❌ Issue {key} failed: {e}", file=sys.stderr)
+            else:
+                checkpoint.write(key + "\n")
+                checkpoint.flush()
+                progress.completed += 1
+                if progress.completed % PROGRESS_EVERY == 0:
+                    print(f"📈 {progress.as_str()}")
+            finally:
+                slots.release()
+
+        while True:
+            # Only page further through the listing once a slot is free.
+            await slots.acquire()
+            issue = await anext(issues, None)
+            if issue is None:
+                slots.release()
+                break
+            repo_full_name = issue.get("repo_full_name") or inputs["repo_full_name"]
+            key = issue_key(repo_full_name, issue["number"])
+            if key in done:
+                progress.skipped += 1
+                slots.release()
+                continue
+            task = asyncio.create_task(process(issue, repo_full_name, key))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    if duplicates is not None:
+        duplicates.save()
+
+    print(f"💾 Completion cache: {cache.stats_str()}")
+    print(f"🧮 Token usage: {usage_totals.stats_str()}")
+    print(f"🚦 Rate limits: GitHub {get_session(inputs['github_token']).reads.stats_str()}")
+    if org:
+        print(f"🚦 Rate limits: GitHub GraphQL {get_graphql_client(inputs['github_token']).stats_str()}")
+    for service_id, stats in scheduler_stats().items():
+        print(f"🚦 Rate limits: {service_id} {stats}")
+    for service_id, stats in health_stats().items():
+        print(f"🪁 Latency: {service_id} {stats}")
+    return progress
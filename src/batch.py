@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from openai import AsyncAzureOpenAI
+from openai_utils import API_VERSION, Completion, usage_totals
+from async_github_utils import list_open_issues, list_org_open_issues
+from backlog import SweepProgress, issue_key, load_checkpoint
+from last_run import is_unchanged_since_last_run
+from pipeline import compact_for_prompt, post_analysis, post_rewrite_comment
+from prompts import build_validation_message, build_rewrite_message
+from responses import ValidationResponse, RewriteResponse
+from compaction import DEFAULT_TOKEN_BUDGET
+import tracing
+
+DEFAULT_BATCH_DIR = ".issue-enhancer-batch"
+DEFAULT_POLL_SECONDS = 60
+BATCH_ENDPOINT = "/chat/completions"
+COMPLETION_WINDOW = "24h"
+# The Batch API accepts up to 100,000 requests per file; issues beyond this wait for the next run.
+MAX_BATCH_REQUESTS = 50000
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchStage:
+    """One Batch API job: its JSONL request file and the state needed to resume polling it after a restart.
+
+    The state file maps each request's `custom_id` to the issue it was built from, and the posted file
+    lists the `custom_id`s whose results were already posted, so a resumed run does not post them twice.
+    Both are removed once the stage's results have been posted.
+    """
+
+    def __init__(self, batch_dir: str, name: str):
+        self.name = name
+        self.requests_path = os.path.join(batch_dir, f"{name}-requests.jsonl")
+        self.results_path = os.path.join(batch_dir, f"{name}-results.jsonl")
+        self.errors_path = os.path.join(batch_dir, f"{name}-errors.jsonl")
+        self.state_path = os.path.join(batch_dir, f"{name}.json")
+        self.posted_path = os.path.join(batch_dir, f"{name}-posted.txt")
+        self.batch_id: Optional[str] = None
+        self.issues: Dict[str, Dict[str, Any]] = {}
+        self.posted: Set[str] = set()
+
+    def load(self) -> bool:
+        """Load a stage left pending by an earlier run; returns False when there is none."""
+        if not os.path.exists(self.state_path):
+            return False
+        with open(self.state_path) as f:
+            state = json.load(f)
+        self.batch_id = state["batch_id"]
+        self.issues = state["issues"]
+        self.posted = load_checkpoint(self.posted_path)
+        return True
+
+    def mark_posted(self, custom_id: str) -> None:
+        # Appended one line at a time like the checkpoint, so a crash loses at most the post in flight.
+        with open(self.posted_path, "a") as f:
+            f.write(custom_id + "\n")
+        self.posted.add(custom_id)
+
+    def write_requests(self, deployment: str, requests: Dict[str, Tuple[Dict[str, Any], List[Dict[str, str]]]]) -> None:
+        """Write one Batch API request line per issue; `requests` maps a custom_id to its issue and messages."""
+        os.makedirs(os.path.dirname(self.requests_path) or ".", exist_ok=True)
+        with open(self.requests_path, "w") as f:
+            for custom_id, (issue, messages) in requests.items():
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": deployment, "messages": messages},
+                }
+                f.write(json.dumps(line) + "\n")
+                self.issues[custom_id] = issue
+
+    async def submit(self, client: AsyncAzureOpenAI) -> None:
+        with tracing.span("batch.submit", stage=self.name, requests=len(self.issues)):
+            with open(self.requests_path, "rb") as f:
+                uploaded = await client.files.create(file=f, purpose="batch")
+            batch = await client.batches.create(
+                input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW
+            )
+        self.batch_id = batch.id
+        # Saved before anything else so a restart resumes this batch instead of submitting another. The posted
+        # file of an earlier batch goes first, since its custom_ids would otherwise skip this batch's results.
+        if os.path.exists(self.posted_path):
+            os.remove(self.posted_path)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"batch_id": self.batch_id, "issues": self.issues}, f)
+        os.replace(tmp, self.state_path)
+        print(f"📦 Submitted {self.name} batch {self.batch_id} with {len(self.issues)} requests")
+
+    async def wait(self, client: AsyncAzureOpenAI, poll_seconds: float) -> Any:
+        """Poll the batch until it reaches a terminal status and return it."""
+        started = time.monotonic()
+        with tracing.span("batch.wait", stage=self.name) as span:
+            while True:
+                batch = await client.batches.retrieve(self.batch_id)
+                span.add("polls")
+                counts = batch.request_counts
+                done = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+                print(f"⏳ {self.name.capitalize()} batch {self.batch_id}: {batch.status}, {done} requests done")
+                if batch.status in TERMINAL_STATUSES:
+                    print(f"📦 {self.name.capitalize()} batch finished after {time.monotonic() - started:.0f}s")
+                    span.set("status", batch.status)
+                    return batch
+                await asyncio.sleep(poll_seconds)
+
+    async def results(self, client: AsyncAzureOpenAI, batch: Any) -> AsyncIterator[Tuple[str, Optional[str], str]]:
+        """Stream the results file, then the error file, yielding `(custom_id, content, error)` per request.
+
+        Their lines are also kept in `results_path` and `errors_path`. Requests with no line in either
+        are yielded as failed.
+        """
+        seen = set()
+        for file_id, path in ((batch.output_file_id, self.results_path), (batch.error_file_id, self.errors_path)):
+            if not file_id:
+                continue
+            async with client.files.with_streaming_response.content(file_id) as response:
+                with open(path, "w") as saved:
+                    async for line in response.iter_lines():
+                        if not line.strip():
+                            continue
+                        saved.write(line + "\n")
+                        custom_id, content, error = parse_result_line(json.loads(line))
+                        seen.add(custom_id)
+                        yield custom_id, content, error
+        for custom_id in self.issues:
+            if custom_id not in seen:
+                yield custom_id, None, f"no result, the batch ended as {batch.status}"
+
+    def remove(self) -> None:
+        for path in (self.state_path, self.posted_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def parse_result_line(line: Dict[str, Any]) -> Tuple[str, Optional[str], str]:
+    """Return the custom_id, message content and error of one Batch API result line, recording its token usage."""
+    custom_id = line["custom_id"]
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        # Requests the service rejected carry their error in the response body, e.g. a content filter hit.
+        body_error = (response.get("body") or {}).get("error") or {}
+        error = (line.get("error") or {}).get("message") or body_error.get("message") or ""
+        error = f"status {response.get('status_code')}" + (f": {error}" if error else "")
+        return custom_id, None, error
+    body = response["body"]
+    usage = body.get("usage") or {}
+    completion = Completion(
+        body["choices"][0]["message"]["content"] or "",
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+    )
+    usage_totals.add(completion)
+    tracing.add("prompt_tokens", completion.prompt_tokens)
+    tracing.add("completion_tokens", completion.completion_tokens)
+    tracing.add("cached_tokens", completion.cached_tokens)
+    return custom_id, completion.content, ""
+
+
+def build_batch_client(inputs: Dict[str, Any]) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        api_key=inputs["openai_api_key"], azure_endpoint=inputs["azure_endpoint"], api_version=API_VERSION
+    )
+
+
+async def collect_issues(
+    inputs: Dict[str, Any], done: Set[str], progress: SweepProgress, concurrency: int
+) -> Dict[str, Dict[str, Any]]:
+    """List the open issues still to triage, keyed by `owner/repo#number`."""
+    token = inputs["github_token"]
+    org = inputs.get("backlog_org")
+    issues = list_org_open_issues(token, org) if org else list_open_issues(token, inputs["repo_full_name"])
+    slots = asyncio.Semaphore(concurrency)
+    pending: Dict[str, Dict[str, Any]] = {}
+
+    async def check(key: str, issue: Dict[str, Any]) -> None:
+        async with slots:
+            if await is_unchanged_since_last_run(token, issue["repo_full_name"], issue):
+                progress.skipped += 1
+                del pending[key]
+
+    checks = []
+    async for issue in issues:
+        issue.setdefault("repo_full_name", inputs["repo_full_name"])
+        key = issue_key(issue["repo_full_name"], issue["number"])
+        if key in done:
+            progress.skipped += 1
+            continue
+        if len(pending) >= MAX_BATCH_REQUESTS:
+            print(f"🟡 More than {MAX_BATCH_REQUESTS} issues to triage, the rest are left for the next run")
+            break
+        pending[key] = issue
+        if inputs.get("skip_unchanged"):
+            checks.append(check(key, issue))
+    await asyncio.gather(*checks)
+    return pending
+
+
+async def run_batch_triage(
+    inputs: Dict[str, Any], concurrency: int, checkpoint_path: str, batch_dir: str, poll_seconds: float
+) -> SweepProgress:
+    """Triage every open issue through the Azure OpenAI Batch API instead of interactive completions.
+
+    Validation prompts for all issues go out as one batch; rewrites for the issues that are not ready
+    follow as a second batch. Results are posted with at most `concurrency` GitHub writes in flight.
+    A batch still pending when the run ends is resumed from `batch_dir` by the next run, which skips
+    the results that were already posted.
+    """
+    client = build_batch_client(inputs)
+    deployment = inputs.get("azure_batch_deployment") or inputs["azure_deployment"]
+    token_budget = inputs.get("prompt_token_budget", DEFAULT_TOKEN_BUDGET)
+    progress = SweepProgress()
+    slots = asyncio.Semaphore(concurrency)
+    validation_stage = BatchStage(batch_dir, "validation")
+    rewrite_stage = BatchStage(batch_dir, "rewrite")
+
+    with open(checkpoint_path, "a") as checkpoint:
+
+        def complete(key: str) -> None:
+            checkpoint.write(key + "\n")
+            checkpoint.flush()
+            progress.completed += 1
+
+        def fail(key: str, error: str) -> None:
+            progress.failed += 1
+            print(f"❌ Issue {key} failed: {error}", file=sys.stderr)
+
+        async def post_validation(key: str, content: Optional[str], error: str, rewrites: Dict[str, Any]) -> None:
+            issue = validation_stage.issues[key]
+            if content is None:
+                fail(key, error)
+                return
+            validation = ValidationResponse(content)
+            if key not in validation_stage.posted:
+                async with slots:
+                    try:
+                        await post_analysis(inputs, issue["repo_full_name"], issue, validation)
+                    except Exception as e:
+                        fail(key, f"{type(e).__name__}: {e}")
+                        return
+                # Recorded as soon as the comment is up, so a restart cannot post it twice.
+                validation_stage.mark_posted(key)
+                if validation.ready_to_work:
+                    complete(key)
+            elif validation.ready_to_work:
+                progress.skipped += 1
+            # An analysis posted before a restart still needs its rewrite requested.
+            if validation.ready_to_work:
+                return
+            prompt_issue = compact_for_prompt(issue, token_budget)
+            rewrites[key] = (
+                # Kept with the issue so the rewrite can join the analysis in one comment in upsert mode.
+                {**issue, "validation": validation.as_dict()},
+                build_rewrite_message(issue["number"], issue["title"], prompt_issue["body"], validation.completeness),
+            )
+
+        async def post_rewrite(key: str, content: Optional[str], error: str) -> None:
+            issue = rewrite_stage.issues[key]
+            if key in rewrite_stage.posted:
+                progress.skipped += 1
+                return
+            if content is None:
+                fail(key, error)
+                return
+            async with slots:
+                try:
+                    rewrite = RewriteResponse(content)
+                    if inputs.get("upsert_comment"):
+                        validation = ValidationResponse.from_dict(issue["validation"])
+                        # The labels were already added with the analysis.
+                        await post_analysis(
+                            {**inputs, "apply_labels": False}, issue["repo_full_name"], issue, validation, rewrite=rewrite
+                        )
+                    else:
+                        await post_rewrite_comment(inputs, issue["repo_full_name"], issue, rewrite)
+                except Exception as e:
+                    fail(key, str(e))
+                    return
+            rewrite_stage.mark_posted(key)
+            complete(key)
+
+        if not rewrite_stage.load():
+            if not validation_stage.load():
+                done = load_checkpoint(checkpoint_path)
+                issues = await collect_issues(inputs, done, progress, concurrency)
+                if not issues:
+                    print("🟢 No open issues left to triage")
+                    return progress
+                requests = {}
+                for key, issue in issues.items():
+                    prompt_issue = compact_for_prompt(issue, token_budget)
+                    messages = build_validation_message(issue["number"], issue["title"], prompt_issue["body"])
+                    requests[key] = (issue, messages)
+                validation_stage.write_requests(deployment, requests)
+                await validation_stage.submit(client)
+            else:
+                print(f"🔁 Resuming validation batch {validation_stage.batch_id}")
+
+            batch = await validation_stage.wait(client, poll_seconds)
+            rewrites: Dict[str, Any] = {}
+            posts = [
+                asyncio.create_task(post_validation(key, content, error, rewrites))
+                async for key, content, error in validation_stage.results(client, batch)
+            ]
+            await asyncio.gather(*posts)
+            if rewrites:
+                rewrite_stage.write_requests(deployment, rewrites)
+                await rewrite_stage.submit(client)
+            validation_stage.remove()
+        else:
+            print(f"🔁 Resuming rewrite batch {rewrite_stage.batch_id}")
+            # A restart between submitting the rewrites and clearing the validation stage leaves both behind;
+            # the rewrites already cover it, so resuming it later would request them again.
+            validation_stage.remove()
+
+        if rewrite_stage.batch_id is not None:
+            batch = await rewrite_stage.wait(client, poll_seconds)
+            posts = [
+                asyncio.create_task(post_rewrite(key, content, error))
+                async for key, content, error in rewrite_stage.results(client, batch)
+            ]
+            await asyncio.gather(*posts)
+            rewrite_stage.remove()
+
+    print(f"🧮 Token usage: {usage_totals.stats_str()}")
+    return progress
@@ -0,0 +1,454 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from mock_servers import BOT_LOGIN, MAINTAINER_LOGIN, MockAzureOpenAI, MockGitHub, MockSettings, filler
+from responses import RewriteResponse
+from fingerprint import issue_fingerprint, render_fingerprint
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.normpath(os.path.join(SRC_DIR, "..", "benchmarks", "baseline.json"))
+RESULT_PREFIX = "BENCHMARK_RESULT "
+REPO = "bench/issues"
+DEPLOYMENT = "benchmark"
+# Wall time must stay within TIME_TOLERANCE of the baseline plus TIME_SLACK_SECONDS, which absorbs
+# jitter on scenarios that only take a few milliseconds.
+TIME_TOLERANCE = 0.5
+TIME_SLACK_SECONDS = 0.25
+MEMORY_TOLERANCE = 0.25
+LOG_BODY_BYTES = 4 * 1024 * 1024
+THREAD_COMMENTS = 10000
+BACKLOG_ISSUES = 50
+RETRIGGERED_COMMENTS = 200
+# The primary of the hedged scenario answers well after the first hedge, which fires after
+# hedging.INITIAL_HEDGE_DELAY_SECONDS, so the secondary should win every completion.
+HEDGED_PRIMARY_LATENCY_MS = 30000
+ACCEPTANCE_CRITERIA = (
+    "Acceptance Criteria:\n"
+    "- Logging in with valid credentials opens the dashboard\n"
+    "- Invalid credentials show an error\n"
+)
+REWRITE = {
+    "title": "Make the login button submit the form",
+    "description": "Users cannot sign in, which blocks every other workflow.",
+    "acceptance_criteria": ["Clicking the login button submits the form", "An automated UI test covers the login flow"],
+    "not_applicable": False,
+}
+
+# (kind, corpus) pairs; each runs in a fresh process, the way the action runs once per event.
+SCENARIOS = [
+    ("parse", "tiny"),
+    ("parse", "ready"),
+    ("parse", "log"),
+    ("parse", "sections"),
+    ("new_issue", "tiny"),
+    ("new_issue", "ready"),
+    ("new_issue", "log"),
+    ("new_issue", "thread"),
+    ("new_issue_streamed", "tiny"),
+    ("new_issue_combined", "tiny"),
+    ("new_issue_hedged", "tiny"),
+    ("new_issue", "retriggered"),
+    ("new_issue", "unchanged"),
+    ("new_issue_upsert", "tiny"),
+    ("new_issue_upsert", "retriggered"),
+    ("apply_comment", "tiny"),
+    ("apply_comment", "log"),
+    ("apply_comment", "thread"),
+    ("apply_comment", "sections"),
+    ("batch", "backlog"),
+]
+# Handler in main.py and extra inputs for each scenario kind.
+HANDLERS = {
+    "new_issue": ("handle_new_issue", {}),
+    "new_issue_streamed": ("handle_new_issue", {"INPUT_STREAM_VALIDATION": "true"}),
+    "new_issue_combined": ("handle_new_issue", {"INPUT_COMBINED_ANALYSIS": "true"}),
+    "new_issue_upsert": ("handle_new_issue", {"INPUT_UPSERT_COMMENT": "true"}),
+    "new_issue_hedged": ("handle_new_issue", {}),
+    "apply_comment": ("handle_apply_comment", {}),
+    "batch": ("handle_batch_triage", {"INPUT_BATCH_POLL_SECONDS": "0"}),
+}
+
+
+def log_body(size: int) -> str:
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = f"2024-01-01T00:00:{i % 60:02d}Z ERROR worker-{i % 8} request {i} failed: connection reset by peer\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "The nightly job crashes. Full log:\n\n```\n" + "".join(lines) + "```\n"
+
+
+def sections_body(size: int) -> str:
+    """A body whose Description and Acceptance Criteria sections sit among megabytes of log output."""
+    log = log_body(size // 2)
+    return (
+        f"Description:\nThe nightly job crashes.\n\n{log}\n"
+        f"Acceptance Criteria:\n- The job finishes\n- No errors are logged\n\n{log}"
+    )
+
+
+def build_corpus(name: str) -> List[Dict[str, Any]]:
+    """Synthetic issues for one corpus; every issue ends with the bot's "apply changes" rewrite comment."""
+    if name == "tiny":
+        issues = [{"number": 1, "title": "Login broken", "body": "The login button does nothing.", "comments": []}]
+    elif name == "ready":
+        body = "Users need to sign in before they can see their projects.\n\n" + ACCEPTANCE_CRITERIA
+        issues = [{"number": 2, "title": "Add a login form", "body": body, "comments": ["+1"] * 3}]
+    elif name == "log":
+        comments = [f"Same here, run {i} failed too." for i in range(20)]
+        issues = [{"number": 3, "title": "Nightly job crashes", "body": log_body(LOG_BODY_BYTES), "comments": comments}]
+    elif name == "sections":
+        issues = [{"number": 5, "title": "Nightly job crashes", "body": sections_body(LOG_BODY_BYTES), "comments": []}]
+    elif name == "retriggered":
+        # Analyzed before the body was edited, with discussion since. The last comment quotes the current
+        # fingerprint, which must not pass for the bot's own.
+        earlier = render_fingerprint(issue_fingerprint("Login broken", "The login button does nothing."))
+        body = "The login button does nothing in Safari."
+        comments = [{"body": f"Earlier analysis.\n{earlier}", "user": BOT_LOGIN}]
+        comments += [f"Comment {i}: any update?" for i in range(RETRIGGERED_COMMENTS)]
+        comments.append(f"Quoting the bot: {render_fingerprint(issue_fingerprint('Login broken', body))}")
+        issues = [{"number": 6, "title": "Login broken", "body": body, "comments": comments}]
+    elif name == "unchanged":
+        # Analyzed by a run that finished, and not edited since, so the run stops at the fingerprint check.
+        fingerprint = render_fingerprint(issue_fingerprint("Login broken", "The login button does nothing."))
+        comments = [{"body": f"Earlier analysis.\n{fingerprint}", "user": BOT_LOGIN}]
+        issues = [{"number": 7, "title": "Login broken", "body": "The login button does nothing.", "comments": comments}]
+    elif name == "thread":
+        comments = [f"Comment {i}: still seeing this on my machine." for i in range(THREAD_COMMENTS - 1)]
+        issues = [{"number": 4, "title": "Flaky sync", "body": filler(1000), "comments": comments}]
+    elif name == "backlog":
+        issues = [
+            {
+                "number": 100 + i,
+                "title": f"Backlog item {i}",
+                "body": filler(1000) + ("\n\n" + ACCEPTANCE_CRITERIA if i % 2 else ""),
+                "comments": ["+1"] * 2,
+            }
+            for i in range(BACKLOG_ISSUES)
+        ]
+    else:
+        raise ValueError(f"Unknown corpus {name}")
+    for issue in issues:
+        rewrite = {"body": RewriteResponse.from_dict(REWRITE).as_markdown_str(), "user": BOT_LOGIN}
+        issue["comments"] = issue["comments"] + [rewrite]
+    return issues
+
+
+def run_parsers(corpus: str) -> None:
+    """Parse validation and rewrite answers that quote the corpus body, whole and streamed, and patch the body."""
+    from responses import ValidationResponse
+    from sections import replace_sections
+
+    body = build_corpus(corpus)[0]["body"]
+    validation_text = (
+        "Summary: Synthetic analysis.\n"
+        "Completeness:\n - Title: Yes\n - Description: Yes\n - Acceptance Criteria: No\n"
+        "Importance: Keeps the benchmark realistic.\n"
+        f"Acceptance Criteria Evaluation: The body quotes:\n{body}\n"
+        "Labels: bug\n"
+        "Ready to Work: False\n"
+    )
+    ValidationResponse(validation_text)
+    streamed = ValidationResponse()
+    for i in range(0, len(validation_text), 64):
+        streamed.feed(validation_text[i : i + 64])
+    streamed.close()
+    rewrite = RewriteResponse(f"Title: New title\nDescription: {body}\nAcceptance Criteria:\n- One\nNot Applicable: False\n")
+    RewriteResponse.from_comment(rewrite.as_markdown_str())
+    criteria = "\n".join(f"- {item}" for item in REWRITE["acceptance_criteria"])
+    replace_sections(body, {"description": REWRITE["description"], "acceptance_criteria": criteria})
+
+
+def run_child(kind: str, corpus: str, forbidden_modules: List[str]) -> None:
+    """Run one scenario in this process and print its measurements as the last line of output.
+
+    Any of `forbidden_modules` still loaded once the scenario ran is reported with them.
+    """
+    started = time.perf_counter()
+    failed = False
+    try:
+        if kind == "parse":
+            run_parsers(corpus)
+        else:
+            import main
+            import tracing
+
+            tracing.configure(os.getenv("INPUT_METRICS_FILE"))
+            try:
+                with tracing.span("run", mode=kind):
+                    asyncio.run(getattr(main, HANDLERS[kind][0])())
+            finally:
+                tracing.export()
+    except SystemExit as e:
+        failed = bool(e.code)
+    wall = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux.
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    loaded = [module for module in forbidden_modules if module in sys.modules]
+    result = {"wall_s": wall, "peak_rss_mb": peak_mb, "failed": failed, "forbidden_modules": loaded}
+    hedging = sys.modules.get("hedging")
+    if hedging is not None:
+        result["hedging"] = {
+            name: {"hedges": health.hedges, "wins": health.wins, "cancelled": health.cancelled}
+            for name, health in ((name, hedging.get_health(name)) for name in hedging.health_stats())
+        }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def scenario_env(
+    kind: str, corpus: List[Dict[str, Any]], github: MockGitHub, azure: MockAzureOpenAI, workdir: str
+) -> Dict[str, str]:
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("INPUT_", "GITHUB_")) and key not in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY")
+    }
+    env.update(
+        {
+            "GITHUB_API_URL": github.url,
+            "GITHUB_REPOSITORY": REPO,
+            "INPUT_GITHUB_TOKEN": "benchmark-github-token",
+            "INPUT_OPENAI_API_KEY": "benchmark-openai-key",
+            "INPUT_AZURE_OPENAI_ENDPOINT": azure.url + "/",
+            "INPUT_AZURE_OPENAI_DEPLOYMENT": DEPLOYMENT,
+            "INPUT_ISSUE_ID": str(corpus[0]["number"]),
+            **HANDLERS.get(kind, (None, {}))[1],
+        }
+    )
+    if kind == "apply_comment":
+        env["GITHUB_COMMENT_ID"] = str(github.last_comment_id(corpus[0]["number"]))
+    if kind == "batch":
+        env["INPUT_BATCH_DIR"] = os.path.join(workdir, "batch")
+        env["INPUT_BACKLOG_CHECKPOINT"] = os.path.join(workdir, "checkpoint")
+    return env
+
+
+def check_hedged(hedging: Dict[str, Dict[str, int]]) -> Optional[str]:
+    """Describe what went wrong unless the secondary won every call and each slow primary call was cancelled."""
+    wins = sum(health["wins"] for name, health in hedging.items() if name.endswith("-secondary"))
+    cancelled = sum(health["cancelled"] for name, health in hedging.items() if not name.endswith("-secondary"))
+    if not wins or wins != cancelled:
+        return f"expected the secondary to win every completion and the primary's calls to be cancelled, got {hedging}"
+    return None
+
+
+def run_scenario(
+    kind: str,
+    corpus_name: str,
+    github: MockGitHub,
+    azure: MockAzureOpenAI,
+    verbose: bool,
+    metrics_file: Optional[str] = None,
+    forbidden_modules: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Run one scenario in a child process against freshly loaded stand-in servers.
+
+    With `metrics_file` the child is traced and writes its per-stage metrics there. The scenario fails
+    when it loaded any of `forbidden_modules`. The hedged scenario puts a slow primary in front of
+    `azure`, which serves as the secondary endpoint.
+    """
+    corpus = build_corpus(corpus_name)
+    if kind == "apply_comment":
+        # A maintainer's plain reply below the bot's rewrite, the usual way a rewrite is applied.
+        corpus[0]["comments"].append({"body": "apply changes", "user": MAINTAINER_LOGIN})
+    github.load(corpus)
+    github.reset_calls()
+    azure.reset_calls()
+    primary = None
+    if kind == "new_issue_hedged":
+        primary = MockAzureOpenAI(
+            MockSettings(HEDGED_PRIMARY_LATENCY_MS, azure.settings.error_rate, azure.settings.completion_chars)
+        ).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = scenario_env(kind, corpus, github, primary or azure, workdir)
+        if primary is not None:
+            env["INPUT_AZURE_OPENAI_SECONDARY_ENDPOINT"] = azure.url + "/"
+        if metrics_file:
+            env["INPUT_METRICS_FILE"] = metrics_file
+        started = time.perf_counter()
+        child = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                kind,
+                corpus_name,
+                "--forbid-modules",
+                ",".join(forbidden_modules or []),
+            ],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        process_s = time.perf_counter() - started
+    if primary is not None:
+        # The cancelled calls are still sleeping on the primary; they only fail to write their answer.
+        primary.stop()
+    lines = child.stdout.splitlines()
+    if verbose:
+        print("\n".join(line for line in lines if not line.startswith(RESULT_PREFIX)))
+    results = [json.loads(line[len(RESULT_PREFIX) :]) for line in lines if line.startswith(RESULT_PREFIX)]
+    if child.returncode or not results or results[-1]["failed"]:
+        print(child.stdout[-2000:] + child.stderr[-2000:], file=sys.stderr)
+        raise RuntimeError(f"Scenario {kind}/{corpus_name} failed")
+    if results[-1]["forbidden_modules"]:
+        raise RuntimeError(f"Scenario {kind}/{corpus_name} loaded {', '.join(results[-1]['forbidden_modules'])}")
+    calls = {f"github {route}": n for route, n in github.calls.items()}
+    if primary is None:
+        calls.update({f"azure {route}": n for route, n in azure.calls.items()})
+    else:
+        problem = check_hedged(results[-1].get("hedging", {}))
+        if problem:
+            raise RuntimeError(f"Scenario {kind}/{corpus_name}: {problem}")
+        calls.update({f"azure primary {route}": n for route, n in primary.calls.items()})
+        calls.update({f"azure secondary {route}": n for route, n in azure.calls.items()})
+    return {
+        "wall_s": round(results[-1]["wall_s"], 4),
+        "process_s": round(process_s, 4),
+        "peak_rss_mb": round(results[-1]["peak_rss_mb"], 1),
+        "calls": dict(sorted(calls.items())),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], checks: List[str], time_tolerance: float
+) -> List[str]:
+    """Return a description of every regression against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"🆕 {name} is not in the baseline")
+            continue
+        if "calls" in checks:
+            for route, count in result["calls"].items():
+                # Throttled answers are injected by --error-rate, not made by the code under test.
+                if not route.endswith("throttled") and count > base["calls"].get(route, 0):
+                    regressions.append(f"{name}: {route} made {count} calls, baseline {base['calls'].get(route, 0)}")
+        if "time" in checks and result["wall_s"] > base["wall_s"] * (1 + time_tolerance) + TIME_SLACK_SECONDS:
+            regressions.append(f"{name}: took {result['wall_s']:.3f}s, baseline {base['wall_s']:.3f}s")
+        if "memory" in checks and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{name}: peaked at {result['peak_rss_mb']:.0f} MB, baseline {base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def format_report(results: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f"{'scenario':<26}{'wall s':>9}{'process s':>11}{'peak MB':>9}  calls"]
+    for name, result in results.items():
+        calls = ", ".join(f"{route} {n}" for route, n in result["calls"].items()) or "-"
+        lines.append(
+            f"{name:<26}{result['wall_s']:>9.3f}{result['process_s']:>11.3f}{result['peak_rss_mb']:>9.1f}  {calls}"
+        )
+    return "\n".join(lines)
+
+
+def split_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def run_benchmarks(args: argparse.Namespace) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    github_settings = MockSettings(args.github_latency_ms, args.error_rate)
+    azure_settings = MockSettings(args.azure_latency_ms, args.error_rate, args.completion_chars)
+    github = MockGitHub(github_settings, REPO).start()
+    azure = MockAzureOpenAI(azure_settings).start()
+    results = {}
+    try:
+        for kind, corpus in SCENARIOS:
+            name = f"{kind}/{corpus}"
+            if args.scenarios and not any(name.startswith(prefix) for prefix in args.scenarios):
+                continue
+            print(f"⏱ Running {name}", flush=True)
+            metrics_file = None
+            if args.metrics_dir:
+                os.makedirs(args.metrics_dir, exist_ok=True)
+                metrics_file = os.path.abspath(os.path.join(args.metrics_dir, f"{kind}-{corpus}.json"))
+            results[name] = run_scenario(
+                kind, corpus, github, azure, args.verbose, metrics_file, split_list(args.forbid_modules)
+            )
+    finally:
+        github.stop()
+        azure.stop()
+    settings = {"github": github_settings.as_dict(), "azure": azure_settings.as_dict()}
+    return results, settings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the handlers and response parsers against local stand-in GitHub and Azure OpenAI servers."
+    )
+    parser.add_argument(
+        "scenarios", nargs="*", help="Scenario name prefixes to run, e.g. new_issue or parse/log (default all)"
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument(
+        "--check",
+        default="calls,time,memory",
+        help="Comma-separated measurements compared with the baseline: calls, time, memory",
+    )
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--github-latency-ms", type=float, default=20.0)
+    parser.add_argument("--azure-latency-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--completion-chars", type=int, default=2000, help="Approximate size of every completion")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of each scenario")
+    parser.add_argument(
+        "--metrics-dir", help="Trace each scenario and write its per-stage metrics file to this directory"
+    )
+    parser.add_argument(
+        "--forbid-modules",
+        default="",
+        help="Comma-separated modules the scenarios must not load, e.g. semantic_kernel,numpy for apply_comment",
+    )
+    parser.add_argument("--child", nargs=2, metavar=("KIND", "CORPUS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(*args.child, split_list(args.forbid_modules))
+        return 0
+
+    results, settings = run_benchmarks(args)
+    print(format_report(results))
+    report = {"settings": settings, "scenarios": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"💾 Wrote baseline {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"🟡 No baseline at {args.baseline}, run with --update-baseline to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    checks = split_list(args.check)
+    if baseline["settings"] != settings and ("time" in checks or "memory" in checks):
+        print("🟡 The baseline was recorded with different server settings, only call counts are compared")
+        checks = [check for check in checks if check == "calls"]
+    regressions = compare(results, baseline, checks, args.time_tolerance)
+    for regression in regressions:
+        print(f"::error::Benchmark regression: {regression}")
+    if regressions:
+        return 1
+    print(f"✅ No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
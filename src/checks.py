@@ -0,0 +1,80 @@
+import argparse
+import sys
+from typing import Callable, Dict, List
+
+# Behaviour checks that need no network and no LLM stack; CI runs them in the built image.
+CHECKS: Dict[str, Callable[[], None]] = {}
+
+
+def check(fn: Callable[[], None]) -> Callable[[], None]:
+    CHECKS[fn.__name__[len("check_") :]] = fn
+    return fn
+
+
+@check
+def check_compaction_leaves_small_bodies_alone() -> None:
+    from compaction import compact_issue_body
+
+    fence = "\n".join(f"    step_{i}()" for i in range(30))
+    body = (
+        "Exports time out.\n\n"
+        f"```python\n{fence}\n```\n\n"
+        "Acceptance Criteria:\n"
+        "- Exporting 10 rows finishes within a second\n"
+        "- Exporting 100 rows finishes within a second\n"
+        "- Exporting 1000 rows finishes within a second\n"
+    )
+    result = compact_issue_body(body, 8000)
+    assert result.text == body, f"an under-budget body was changed:\n{result.text}"
+
+
+@check
+def check_compaction_keeps_near_identical_criteria() -> None:
+    from compaction import compact_issue_body, estimate_tokens
+
+    criteria = "".join(f"- Exporting {rows} rows finishes within a second\n" for rows in (10, 100, 1000))
+    log = "".join(f"2024-01-01T00:00:{i % 60:02d}Z ERROR export {i} timed out\n" for i in range(2000))
+    body = f"Description:\nExports time out.\n\n```\n{log}```\n\nAcceptance Criteria:\n{criteria}"
+    result = compact_issue_body(body, 1000)
+    assert estimate_tokens(body) > 1000, "the body should be over the budget"
+    assert criteria in result.text, f"the acceptance criteria were rewritten:\n{result.text[-500:]}"
+    assert "similar line repeated" in result.text, "the log outside the sections was not collapsed"
+
+
+@check
+def check_scheduler_ignores_a_healthy_quota() -> None:
+    import time
+    from rate_limits import RateLimitScheduler
+
+    scheduler = RateLimitScheduler("check", lambda error: None, 20.0, 50, 1, 1)
+    reset_at = time.time() + 3000
+    scheduler.observe(4000, reset_at, 5000)
+    assert scheduler.bucket.rate == 20.0, f"a healthy quota slowed calls to {scheduler.bucket.rate}/s"
+    scheduler.observe(300, reset_at, 5000)
+    assert scheduler.bucket.rate < 1.0, f"a low quota left calls at {scheduler.bucket.rate}/s"
+    scheduler.observe(5000, time.time() + 3600, 5000)
+    assert scheduler.bucket.rate == 20.0, f"a reset quota left calls at {scheduler.bucket.rate}/s"
+    scheduler.observe(500, reset_at)
+    assert scheduler.bucket.rate == 20.0, "a healthy quota without a reported limit slowed calls"
+
+
+def run(names: List[str]) -> int:
+    failures = 0
+    for name, fn in CHECKS.items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        try:
+            fn()
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {name}: {e}", file=sys.stderr)
+        else:
+            print(f"✅ {name}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the behaviour checks.")
+    parser.add_argument("names", nargs="*", help="Check name prefixes to run, e.g. compaction (default all)")
+    args = parser.parse_args()
+    sys.exit(1 if run(args.names) else 0)
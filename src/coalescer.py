@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+DEFAULT_QUIET_SECONDS = 5.0
+
+
+class IssueCoalescer:
+    """Debounces bursts of events per issue and serializes the work for each issue.
+
+    A job waits for `quiet_seconds` without newer events of the same kind for the same
+    issue; a newer event cancels the pending job (counted in `merged`) and restarts the
+    wait with the latest payload. Jobs for one issue run one at a time, and at most
+    `concurrency` jobs run at once overall.
+    """
+
+    def __init__(
+        self,
+        run_job: Callable[[Dict[str, Any]], Awaitable[None]],
+        quiet_seconds: float = DEFAULT_QUIET_SECONDS,
+        concurrency: int = 4,
+    ):
+        self.run_job = run_job
+        self.quiet_seconds = quiet_seconds
+        self.merged = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._pending: Dict[Tuple[str, int, str], asyncio.Task] = {}
+        # Jobs that hold their issue's lock and wait for a worker slot.
+        self._waiting = 0
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+
+    @property
+    def depth(self) -> int:
+        """Jobs accepted but not running yet, including those waiting for a worker."""
+        return len(self._pending) + self._waiting
+
+    def is_pending(self, job: Dict[str, Any]) -> bool:
+        return self._key(job) in self._pending
+
+    @staticmethod
+    def _key(job: Dict[str, Any]) -> Tuple[str, int, str]:
+        return job["repo_full_name"], job["issue_number"], job["kind"]
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        """Schedule a job, superseding any pending job of the same kind for the same issue."""
+        key = self._key(job)
+        previous = self._pending.get(key)
+        if previous is not None:
+            previous.cancel()
+            self.merged += 1
+        self._pending[key] = asyncio.create_task(self._run(key, job))
+
+    async def _run(self, key: Tuple[str, int, str], job: Dict[str, Any]) -> None:
+        issue_key = key[:2]
+        lock = self._locks.setdefault(issue_key, asyncio.Lock())
+        try:
+            await asyncio.sleep(self.quiet_seconds)
+            async with lock:
+                # Once the issue lock is held the job is committed; newer events queue behind it.
+                del self._pending[key]
+                self._waiting += 1
+                try:
+                    await self._slots.acquire()
+                finally:
+                    self._waiting -= 1
+                try:
+                    await self.run_job(job)
+                finally:
+                    self._slots.release()
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+            if not lock.locked() and not any(pending[:2] == issue_key for pending in self._pending):
+                self._locks.pop(issue_key, None)
@@ -0,0 +1,151 @@
+import re
+from typing import List, Optional, Tuple
+from sections import index_sections
+
+DEFAULT_TOKEN_BUDGET = 8000
+CHARS_PER_TOKEN = 4
+MIN_REPEATS = 3
+FENCE_KEEP_LINES = 10
+
+_DATA_URI = re.compile(r"data:[\w.+-]+/[\w.+-]+(?:;[\w=.+-]+)*;base64,[A-Za-z0-9+/=]+")
+_DIGITS = re.compile(r"\d+")
+_FENCE = ("```", "~~~")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough to size a prompt."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class CompactionResult:
+    def __init__(self, text: str, original_tokens: int):
+        self.text = text
+        self.original_tokens = original_tokens
+        self.tokens = estimate_tokens(text)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.tokens
+
+    def as_str(self) -> str:
+        return f"{self.original_tokens} → {self.tokens} tokens ({self.saved_tokens} saved)"
+
+
+def _collapse_repeats(lines: List[str]) -> List[str]:
+    # Log lines that differ only in timestamps or counters count as repeats.
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        j = i + 1
+        if line.strip() and not line.lstrip().startswith(_FENCE):
+            shape = _DIGITS.sub("0", line)
+            while j < len(lines) and _DIGITS.sub("0", lines[j]) == shape:
+                j += 1
+        if j - i >= MIN_REPEATS:
+            out.append(line)
+            out.append(f"… [similar line repeated {j - i - 1} more times]")
+        else:
+            out.extend(lines[i:j])
+        i = j
+    return out
+
+
+def _excerpt_fences(lines: List[str]) -> List[str]:
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        out.append(line)
+        i += 1
+        if not line.lstrip().startswith(_FENCE):
+            continue
+        fence = line.lstrip()[:3]
+        end = i
+        while end < len(lines) and not lines[end].lstrip().startswith(fence):
+            end += 1
+        block = lines[i:end]
+        if len(block) > 2 * FENCE_KEEP_LINES + 1:
+            block = (
+                block[:FENCE_KEEP_LINES]
+                + [f"… [{len(block) - 2 * FENCE_KEEP_LINES} lines elided] …"]
+                + block[-FENCE_KEEP_LINES:]
+            )
+        out.extend(block)
+        i = end
+    return out
+
+
+def _truncate_middle(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    marker = f"\n… [{len(text) - max_chars} characters elided to fit the prompt budget] …\n"
+    keep = max(0, max_chars - len(marker))
+    head = keep // 2
+    return text[:head] + marker + text[len(text) - (keep - head):]
+
+
+def _protected_spans(text: str) -> List[Tuple[int, int]]:
+    spans: List[Tuple[int, int]] = []
+    for section in sorted(index_sections(text).values(), key=lambda s: s.header_start):
+        if spans and section.header_start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], section.end))
+        else:
+            spans.append((section.header_start, section.end))
+    return spans
+
+
+def _split_protected(text: str) -> List[Tuple[str, bool]]:
+    """Split the text into `(piece, keep)` pairs; `keep` marks the Description and Acceptance Criteria sections."""
+    pieces: List[Tuple[str, bool]] = []
+    position = 0
+    for start, end in _protected_spans(text):
+        pieces.append((text[position:start], False))
+        pieces.append((text[start:end], True))
+        position = end
+    pieces.append((text[position:], False))
+    return pieces
+
+
+def _shorten_lines(text: str) -> str:
+    """Collapse repeated lines and excerpt long code fences outside the Description and Acceptance Criteria sections."""
+    return "".join(
+        piece if keep else "\n".join(_excerpt_fences(_collapse_repeats(piece.split("\n"))))
+        for piece, keep in _split_protected(text)
+    )
+
+
+def _fit_budget(text: str, token_budget: int) -> str:
+    """Shorten everything outside the Description and Acceptance Criteria sections to fit the budget."""
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    pieces = _split_protected(text)
+
+    # Share what the kept sections leave over evenly, so short passages stay whole and only
+    # the long ones are cut.
+    allowance = max(0, max_chars - sum(len(piece) for piece, keep in pieces if keep))
+    free = sorted((len(piece), index) for index, (piece, keep) in enumerate(pieces) if not keep)
+    limits = {}
+    for position, (length, index) in enumerate(free):
+        limits[index] = min(length, allowance // (len(free) - position))
+        allowance -= limits[index]
+    return "".join(
+        piece if keep else _truncate_middle(piece, limits[index]) for index, (piece, keep) in enumerate(pieces)
+    )
+
+
+def compact_issue_body(body: Optional[str], token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET) -> CompactionResult:
+    """Shrink an issue body for a prompt, leaving it untouched when it already fits `token_budget`.
+
+    Otherwise data URIs are dropped, and outside the Description and Acceptance Criteria sections,
+    which are always kept whole, runs of repeated log lines are collapsed, long code fences are cut
+    to head and tail excerpts, and the rest is trimmed to the budget.
+    """
+    body = body or ""
+    original_tokens = estimate_tokens(body)
+    if not token_budget or original_tokens <= token_budget:
+        return CompactionResult(body, original_tokens)
+    text = _shorten_lines(_DATA_URI.sub("[data URI removed]", body))
+    return CompactionResult(_fit_budget(text, token_budget), original_tokens)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+CACHE_FILE = "completions.sqlite3"
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 50
+
+
+def completion_key(messages: List[Dict[str, str]], deployment: str, api_version: str, **options: Any) -> str:
+    """Fingerprint everything that determines a completion: messages, deployment, API version and settings."""
+    blob = json.dumps(
+        {"messages": messages, "deployment": deployment, "api_version": api_version, "options": options},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Cache interface for completions. The base class never stores anything."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        pass
+
+    def stats_str(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses"
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """Completion cache stored in a local SQLite file, with TTL and least-recently-used size eviction."""
+
+    def __init__(self, path: str, ttl_hours: float = DEFAULT_TTL_HOURS, max_mb: float = DEFAULT_MAX_MB):
+        super().__init__()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+            stale.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", stale)
+
+
+def open_completion_cache(cache_dir: Optional[str], ttl_hours=None, max_mb=None) -> CompletionCache:
+    """Open the on-disk cache in `cache_dir`, or a no-op cache when no directory is configured."""
+    if not cache_dir:
+        return CompletionCache()
+    try:
+        return SQLiteCompletionCache(
+            os.path.join(cache_dir, CACHE_FILE),
+            ttl_hours=float(ttl_hours or DEFAULT_TTL_HOURS),
+            max_mb=float(max_mb or DEFAULT_MAX_MB),
+        )
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error opening completion cache, continuing without it: {type(e).__name__}: {e}")
+        return CompletionCache()
@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+import numpy as np
+from compaction import compact_issue_body
+
+INDEX_FILE = "duplicates.npz"
+DEFAULT_THRESHOLD = 0.85
+NUM_HASHES = 128
+SHINGLE_SIZE = 3
+SAVE_INTERVAL_SECONDS = 30
+_PRIME = (1 << 31) - 1
+_WORDS = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+
+# Fixed permutations, so signatures stay comparable across runs.
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64)
+
+
+def minhash_signature(title: str, body: Optional[str]) -> Optional["np.ndarray"]:
+    """MinHash of the issue's word 3-grams, with numbers masked so repeated crash reports line up.
+
+    Returns None when the issue has no words at all.
+    """
+    text = f"{title or ''}\n{compact_issue_body(body).text}".lower()
+    words = _WORDS.findall(_DIGITS.sub("0", text))
+    if not words:
+        return None
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class DuplicateMatch:
+    def __init__(self, key: str, similarity: float, entry: Dict[str, Any]):
+        self.key = key
+        self.similarity = similarity
+        self.validation: Dict[str, Any] = entry["validation"]
+
+    def reference(self, repo_full_name: str) -> str:
+        """How to mention the duplicate from an issue in `repo_full_name`; GitHub links both forms."""
+        repo, number = self.key.rsplit("#", 1)
+        return f"#{number}" if repo == repo_full_name else self.key
+
+    def as_markdown_note(self, repo_full_name: str) -> str:
+        return (
+            f"🔁 This issue looks like a near-duplicate of {self.reference(repo_full_name)} "
+            f"({self.similarity:.0%} similar), so its analysis was reused.\n"
+        )
+
+
+class DuplicateIndex:
+    """MinHash signatures of analyzed issues with their stored validations, kept in one `.npz` file.
+
+    Lookups compare a query signature against every stored one in a single vectorized pass.
+    """
+
+    def __init__(self, path: str, threshold: float = DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.keys: List[str] = []
+        self.entries: List[bytes] = []
+        self._rows: Dict[str, int] = {}
+        self._signatures = np.zeros((0, NUM_HASHES), dtype=np.uint32)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _load(self) -> None:
+        with np.load(self.path) as data:
+            self._signatures = data["signatures"].copy()
+            self.keys = [str(key) for key in data["keys"]]
+            offsets = data["offsets"]
+            blob = data["entries"].tobytes()
+        self.entries = [blob[offsets[i] : offsets[i + 1]] for i in range(len(self.keys))]
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def find(self, repo_full_name: str, issue: Dict[str, Any]) -> Optional[DuplicateMatch]:
+        """Return the most similar other issue whose estimated Jaccard similarity reaches the threshold."""
+        signature = minhash_signature(issue["title"], issue["body"])
+        if signature is None or not self.keys:
+            return None
+        n = len(self.keys)
+        scores = (self._signatures[:n] == signature).mean(axis=1)
+        own = self._rows.get(f"{repo_full_name}#{issue['number']}")
+        if own is not None:
+            scores[own] = -1
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        return DuplicateMatch(self.keys[best], float(scores[best]), json.loads(self.entries[best]))
+
+    def add(self, repo_full_name: str, issue: Dict[str, Any], validation: Dict[str, Any]) -> None:
+        """Store an issue's validation; a re-analyzed issue replaces its earlier entry.
+
+        Rewrites are not stored: they quote the issue's own details, which the masked signature ignores.
+        """
+        signature = minhash_signature(issue["title"], issue["body"])
+        if signature is None:
+            return
+        key = f"{repo_full_name}#{issue['number']}"
+        entry = json.dumps({"validation": validation}).encode("utf-8")
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self._signatures):
+                grown = np.zeros((max(64, 2 * row), NUM_HASHES), dtype=np.uint32)
+                grown[:row] = self._signatures
+                self._signatures = grown
+            self.keys.append(key)
+            self.entries.append(entry)
+            self._rows[key] = row
+        else:
+            self.entries[row] = entry
+        self._signatures[row] = signature
+        self._dirty = True
+        if time.monotonic() - self._saved_at > SAVE_INTERVAL_SECONDS:
+            self.save()
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        offsets = np.zeros(len(self.entries) + 1, dtype=np.int64)
+        np.cumsum([len(entry) for entry in self.entries], out=offsets[1:])
+        tmp = self.path + ".tmp.npz"
+        np.savez(
+            tmp,
+            signatures=self._signatures[: len(self.keys)],
+            keys=np.array(self.keys, dtype=str),
+            offsets=offsets,
+            entries=np.frombuffer(b"".join(self.entries), dtype=np.uint8),
+        )
+        os.replace(tmp, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+
+def open_duplicate_index(cache_dir: Optional[str], threshold=None) -> Optional[DuplicateIndex]:
+    """Open the index stored next to the completion cache.
+
+    Returns None when no cache directory is set or the threshold is 0, which disables the lookup.
+    """
+    threshold = float(threshold) if threshold else DEFAULT_THRESHOLD
+    if not cache_dir or threshold <= 0:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        return DuplicateIndex(os.path.join(cache_dir, INDEX_FILE), threshold)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error opening duplicate index, continuing without it: {type(e).__name__}: {e}")
+        return None
@@ -0,0 +1,94 @@
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+from github_utils import get_github_issue, get_github_comment
+import tracing
+
+ISSUE_FIELDS = ("id", "number", "title", "body", "state", "labels", "created_at", "updated_at")
+COMMENT_FIELDS = ("id", "body", "user", "created_at", "updated_at")
+
+
+def load_event_payload(path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the triggering event JSON that GitHub Actions writes to GITHUB_EVENT_PATH."""
+    path = path or os.getenv("GITHUB_EVENT_PATH")
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+        return payload if isinstance(payload, dict) else {}
+    except (OSError, ValueError) as e:
+        print(f"Error reading event payload: {type(e).__name__}: {e}")
+        return {}
+
+
+def _timestamp(value: str) -> str:
+    # Match the isoformat() strings produced by the API path.
+    return datetime.fromisoformat(value).isoformat()
+
+
+def issue_from_payload(payload: Dict[str, Any], issue_number: int) -> Optional[Dict[str, Any]]:
+    """Build the issue dict from the event payload, or None if it lacks any field."""
+    issue = payload.get("issue")
+    if not isinstance(issue, dict) or issue.get("number") != issue_number:
+        return None
+    if any(field not in issue for field in ISSUE_FIELDS):
+        return None
+    assignee = issue.get("assignee")
+    return {
+        "id": issue["id"],
+        "number": issue["number"],
+        "title": issue["title"],
+        "body": issue["body"],
+        "state": issue["state"],
+        "labels": [label["name"] for label in issue["labels"]],
+        "assignee": assignee["login"] if assignee else None,
+        "created_at": _timestamp(issue["created_at"]),
+        "updated_at": _timestamp(issue["updated_at"]),
+    }
+
+
+def comment_from_payload(payload: Dict[str, Any], comment_id: int) -> Optional[Dict[str, Any]]:
+    """Build the comment dict from the event payload, or None if it lacks any field."""
+    comment = payload.get("comment")
+    if not isinstance(comment, dict) or comment.get("id") != comment_id:
+        return None
+    if any(field not in comment for field in COMMENT_FIELDS):
+        return None
+    user = comment["user"]
+    return {
+        "id": comment["id"],
+        "body": comment["body"],
+        "user": user["login"] if user else None,
+        "created_at": _timestamp(comment["created_at"]),
+        "updated_at": _timestamp(comment["updated_at"]),
+    }
+
+
+def get_issue_data(
+    token: str, repo_full_name: str, issue_number: int, payload: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Read the issue from the event payload, falling back to the API."""
+    with tracing.span("github.fetch_issue", issue=issue_number) as span:
+        if payload.get("repository", {}).get("full_name") == repo_full_name:
+            issue = issue_from_payload(payload, issue_number)
+            if issue is not None:
+                print(f"⚡ Using issue #{issue_number} from the event payload")
+                span.set("from_payload", True)
+                return issue
+        return get_github_issue(token, repo_full_name, issue_number)
+
+
+def get_comment_data(
+    token: str, repo_full_name: str, issue_number: int, comment_id: int, payload: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Read the comment from the event payload, falling back to a direct API lookup."""
+    with tracing.span("github.fetch_comment", issue=issue_number) as span:
+        if payload.get("repository", {}).get("full_name") == repo_full_name:
+            comment = comment_from_payload(payload, comment_id)
+            if comment is not None:
+                print(f"⚡ Using comment {comment_id} from the event payload")
+                span.set("from_payload", True)
+                return comment
+        return get_github_comment(token, repo_full_name, issue_number, comment_id)
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional
+
+FINGERPRINT_MARKER = "issue-enhancer:fingerprint"
+
+_MARKER_PATTERN = re.compile(r"<!-- issue-enhancer:fingerprint (\{.*?\}) -->")
+_ACCEPTANCE_PATTERN = re.compile(r"Acceptance Criteria:\s*\n(.*?)(?:\n\n|\Z)", re.IGNORECASE | re.DOTALL)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _digest(text: str) -> str:
+    normalized = _WHITESPACE.sub(" ", text).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def issue_fingerprint(title: str, body: Optional[str]) -> Dict[str, str]:
+    """Hash the title, the acceptance criteria and the rest of the body, ignoring case and whitespace."""
+    body = body or ""
+    match = _ACCEPTANCE_PATTERN.search(body)
+    criteria = match.group(1) if match else ""
+    rest = body[: match.start()] + body[match.end():] if match else body
+    return {
+        "title": _digest(title or ""),
+        "body": _digest(rest),
+        "acceptance_criteria": _digest(criteria),
+    }
+
+
+def render_fingerprint(fingerprint: Dict[str, str], rewrite_due: bool = False) -> str:
+    """Render the fingerprint as a hidden HTML comment to embed in the bot's comment.
+
+    `rewrite_due` marks an analysis whose rewrite is still to be posted, so a run that stops before
+    posting it is not mistaken for a finished one.
+    """
+    data = {**fingerprint, "rewrite_due": True} if rewrite_due else fingerprint
+    return f"<!-- {FINGERPRINT_MARKER} {json.dumps(data, sort_keys=True, separators=(',', ':'))} -->"
+
+
+def parse_fingerprint(comment_body: str) -> Optional[Dict[str, str]]:
+    match = _MARKER_PATTERN.search(comment_body or "")
+    if not match:
+        return None
+    try:
+        fingerprint = json.loads(match.group(1))
+    except ValueError:
+        return None
+    return fingerprint if isinstance(fingerprint, dict) else None
+
+
+def changed_sections(previous: Dict[str, str], current: Dict[str, str]) -> List[str]:
+    return [section for section in current if previous.get(section) != current[section]]
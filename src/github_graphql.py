@@ -0,0 +1,222 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+import requests
+from github_utils import RETRY_STATUSES
+from rate_limits import RateLimitScheduler, RetrySignal, lower_headers, retry_after_seconds
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+# Bodies can be up to 64 KB each, so issue pages are kept smaller than GitHub's maximum of 100
+# to stay clear of GraphQL timeouts. Either size costs one point per page.
+ISSUE_PAGE_SIZE = 50
+REPO_PAGE_SIZE = 100
+MAX_LABELS = 20
+REQUEST_TIMEOUT_SECONDS = 60
+# GraphQL has its own hourly point budget; `observe` slows the pace as it runs low.
+GRAPHQL_RATE = 10.0
+GRAPHQL_BURST = 20
+GRAPHQL_CONCURRENCY = 4
+
+REPOSITORIES_QUERY = """
+query($org: String!, $first: Int!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: $first, after: $cursor, orderBy: {field: NAME, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { nameWithOwner isArchived issues(states: OPEN) { totalCount } }
+    }
+  }
+  rateLimit { cost limit remaining resetAt }
+}
+"""
+
+# Issues are paged in creation order, which does not shift when issues are edited mid-sweep.
+ISSUES_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $labels: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    issues(states: OPEN, first: $first, after: $cursor, orderBy: {field: CREATED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId number title body state createdAt updatedAt
+        assignees(first: 1) { nodes { login } }
+        labels(first: $labels) { nodes { name } }
+      }
+    }
+  }
+  rateLimit { cost limit remaining resetAt }
+}
+"""
+
+
+class GraphQLError(Exception):
+    def __init__(
+        self,
+        message: str,
+        status: int,
+        headers: Optional[Dict[str, str]] = None,
+        errors: Optional[List[Dict[str, Any]]] = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+        self.errors = errors or []
+
+    @property
+    def rate_limited(self) -> bool:
+        if any(error.get("type") == "RATE_LIMITED" for error in self.errors):
+            return True
+        if self.status == 429:
+            return True
+        # A 403 without rate-limit headers or wording is a permissions problem.
+        headers = lower_headers(self.headers)
+        return self.status == 403 and (
+            "retry-after" in headers or headers.get("x-ratelimit-remaining") == "0" or "rate limit" in str(self).lower()
+        )
+
+
+def graphql_retry_signal(error: BaseException) -> RetrySignal:
+    """Classify a GraphQL or connection error for the scheduler."""
+    if isinstance(error, GraphQLError):
+        headers = lower_headers(error.headers)
+        retry_after = retry_after_seconds(headers)
+        if error.rate_limited:
+            if retry_after is None and headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+                retry_after = max(0.0, float(headers["x-ratelimit-reset"]) - time.time())
+            return True, retry_after
+        if error.status in RETRY_STATUSES:
+            return False, retry_after
+        return None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return False, None
+    return None
+
+
+def _timestamp(value: str) -> str:
+    # Match the isoformat() strings produced by the REST path.
+    return datetime.fromisoformat(value).isoformat()
+
+
+def _issue_as_dict(repo_full_name: str, node: Dict[str, Any]) -> Dict[str, Any]:
+    assignees = node["assignees"]["nodes"]
+    return {
+        "id": node["databaseId"],
+        "number": node["number"],
+        "title": node["title"],
+        "body": node["body"],
+        "state": node["state"].lower(),
+        "labels": [label["name"] for label in node["labels"]["nodes"]],
+        "assignee": assignees[0]["login"] if assignees else None,
+        "created_at": _timestamp(node["createdAt"]),
+        "updated_at": _timestamp(node["updatedAt"]),
+        "repo_full_name": repo_full_name,
+    }
+
+
+class GraphQLClient:
+    """Runs GitHub GraphQL queries through a scheduler and tallies the rate-limit cost of every page."""
+
+    def __init__(self, token: str, url: Optional[str] = None):
+        self.url = url or os.getenv("GITHUB_GRAPHQL_URL") or GRAPHQL_URL
+        self.http = requests.Session()
+        self.http.headers["Authorization"] = f"bearer {token}"
+        self.scheduler = RateLimitScheduler(
+            "GitHub GraphQL", graphql_retry_signal, GRAPHQL_RATE, GRAPHQL_BURST, GRAPHQL_CONCURRENCY, GRAPHQL_CONCURRENCY
+        )
+        self.pages = 0
+        self.cost = 0
+        self.remaining: Optional[int] = None
+
+    def _post(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.http.post(
+            self.url, json={"query": query, "variables": variables}, timeout=REQUEST_TIMEOUT_SECONDS
+        )
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        errors = payload.get("errors") or []
+        if response.status_code != 200 or errors:
+            message = "; ".join(error.get("message", "") for error in errors) or payload.get("message") or response.reason
+            raise GraphQLError(f"{response.status_code} {message}", response.status_code, dict(response.headers), errors)
+        return payload["data"]
+
+    def query(self, query: str, variables: Dict[str, Any], page: str) -> Dict[str, Any]:
+        """Run one query, reporting what the page cost against the hourly GraphQL budget."""
+        data = self.scheduler.call(self._post, query, variables)
+        rate = data.get("rateLimit") or {}
+        self.pages += 1
+        if rate:
+            self.cost += rate["cost"]
+            self.remaining = rate["remaining"]
+            self.scheduler.observe(
+                rate["remaining"], datetime.fromisoformat(rate["resetAt"]).timestamp(), rate.get("limit")
+            )
+            print(f"📄 GraphQL {page}: cost {rate['cost']}, {rate['remaining']} points left")
+        return data
+
+    def stats_str(self) -> str:
+        remaining = "unknown" if self.remaining is None else self.remaining
+        return f"{self.pages} pages, cost {self.cost}, {remaining} points left, {self.scheduler.stats_str()}"
+
+
+_clients: Dict[str, GraphQLClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_graphql_client(token: str) -> GraphQLClient:
+    """Return the process-wide GraphQL client for a token, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = GraphQLClient(token)
+        return client
+
+
+def list_org_repositories(token: str, org: str) -> Iterator[str]:
+    """Yield the full name of every unarchived repository in an organization that has open issues."""
+    client = get_graphql_client(token)
+    cursor = None
+    while True:
+        data = client.query(REPOSITORIES_QUERY, {"org": org, "first": REPO_PAGE_SIZE, "cursor": cursor}, f"{org} repositories")
+        if data["organization"] is None:
+            raise GraphQLError(f"Organization {org} was not found", 404)
+        repositories = data["organization"]["repositories"]
+        for repo in repositories["nodes"]:
+            if not repo["isArchived"] and repo["issues"]["totalCount"]:
+                yield repo["nameWithOwner"]
+        if not repositories["pageInfo"]["hasNextPage"]:
+            return
+        cursor = repositories["pageInfo"]["endCursor"]
+
+
+def list_repo_open_issues(token: str, repo_full_name: str) -> Iterator[Dict[str, Any]]:
+    """Yield every open issue in a repository, ISSUE_PAGE_SIZE issues per query."""
+    client = get_graphql_client(token)
+    owner, name = repo_full_name.split("/", 1)
+    variables = {"owner": owner, "name": name, "first": ISSUE_PAGE_SIZE, "labels": MAX_LABELS, "cursor": None}
+    page = 1
+    while True:
+        data = client.query(ISSUES_QUERY, variables, f"{repo_full_name} issues page {page}")
+        if data["repository"] is None:
+            raise GraphQLError(f"Repository {repo_full_name} was not found", 404)
+        issues = data["repository"]["issues"]
+        for node in issues["nodes"]:
+            yield _issue_as_dict(repo_full_name, node)
+        if not issues["pageInfo"]["hasNextPage"]:
+            return
+        variables["cursor"] = issues["pageInfo"]["endCursor"]
+        page += 1
+
+
+def list_org_open_issues(token: str, org: str) -> Iterator[Dict[str, Any]]:
+    """Yield the open issues of every repository in an organization, one repository at a time.
+
+    Each issue carries its `repo_full_name`. A repository that cannot be read is reported and skipped.
+    """
+    for repo_full_name in list_org_repositories(token, org):
+        try:
+            yield from list_repo_open_issues(token, repo_full_name)
+        except (GraphQLError, requests.RequestException) as e:
+            print(f"❌ Could not list issues in {repo_full_name}: {e}", file=sys.stderr)
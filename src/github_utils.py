@@ -1,81 +1,505 @@
-from github import Github
-from typing import Any, Dict, Optional
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+import requests
+from github import Auth, Consts, Github, GithubException
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from rate_limits import RateLimitScheduler, RetrySignal, lower_headers, retry_after_seconds
+
+DEFAULT_POOL_SIZE = 10
+MAX_CACHED_ISSUES = 1024
+# Reads are paced at READ_RATE until the X-RateLimit headers show the hourly quota running low;
+# content-creating writes follow GitHub's secondary limit of roughly 80 per minute.
+READ_RATE = 20.0
+READ_BURST = 50
+WRITE_RATE = 80 / 60
+WRITE_BURST = 10
+RETRY_STATUSES = (500, 502, 503, 504)
+# Installation tokens, such as a workflow's GITHUB_TOKEN, cannot read /user; their comments are posted by this user.
+DEFAULT_BOT_LOGIN = "github-actions[bot]"
+# Collaborator permission levels that can push; the API reports maintainers as "write".
+WRITE_PERMISSIONS = {"admin", "write"}
+
+
+def github_retry_signal(error: BaseException) -> RetrySignal:
+    """Classify a PyGithub or connection error for the scheduler."""
+    if isinstance(error, GithubException):
+        headers = lower_headers(error.headers)
+        retry_after = retry_after_seconds(headers)
+        if error.status in (403, 429):
+            if retry_after is None and headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+                retry_after = max(0.0, float(headers["x-ratelimit-reset"]) - time.time())
+            # A 403 without rate-limit headers or wording is a permissions problem and is not retried.
+            if error.status == 429 or retry_after is not None or "rate limit" in str(error.data).lower():
+                return True, retry_after
+            return None
+        if error.status in RETRY_STATUSES:
+            return False, retry_after
+        return None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return False, None
+    return None
+
+
+def _github_write_retry_signal(error: BaseException) -> RetrySignal:
+    # A write that failed with a 5xx may still have landed, so only throttled writes are retried.
+    signal = github_retry_signal(error)
+    return signal if signal is not None and signal[0] else None
+
+
+class GitHubSession:
+    """A pooled GitHub client that caches repository and issue handles for the life of the process."""
+
+    def __init__(self, token: str, pool_size: int = DEFAULT_POOL_SIZE):
+        # Retries and pacing are left to the schedulers, which see every throttling signal;
+        # PyGithub's own pacing would add a fixed sleep before every request on top of them.
+        # GITHUB_API_URL is set by Actions on GitHub Enterprise Server and points at stand-in servers in benchmarks.
+        self.github = Github(
+            base_url=os.getenv("GITHUB_API_URL") or Consts.DEFAULT_BASE_URL,
+            auth=Auth.Token(token),
+            pool_size=pool_size,
+            retry=None,
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+        )
+        # Handles built from this client make no request until used, e.g. a comment that is only edited.
+        self.lazy_github = self.github.withLazy(True)
+        self.reads = RateLimitScheduler("GitHub", github_retry_signal, READ_RATE, READ_BURST, pool_size, pool_size)
+        self.writes = RateLimitScheduler(
+            "GitHub writes", _github_write_retry_signal, WRITE_RATE, WRITE_BURST, pool_size, pool_size
+        )
+        self._observe_quota = True
+        self._login: Optional[str] = None
+        self._login_lock = threading.Lock()
+        self._repos: Dict[str, Any] = {}
+        self._issues: "OrderedDict[Tuple[str, int], Any]" = OrderedDict()
+        # Per issue, the newest comment found for each marker, or None when the thread has none. Kept
+        # for one job on the issue: a long-lived process calls forget_marked_comments when a job starts.
+        self._marked_comments: "OrderedDict[Tuple[str, int], Dict[str, Optional[Dict[str, Any]]]]" = OrderedDict()
+        # One lock per repository or issue being fetched, so concurrent lookups of the same one make one request.
+        self._fetch_locks: Dict[Any, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a GitHub read through the scheduler."""
+        result = self.reads.call(fn, *args, **kwargs)
+        self._observe()
+        return result
+
+    def write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a GitHub write through the scheduler."""
+        result = self.writes.call(fn, *args, **kwargs)
+        self._observe()
+        return result
+
+    def _observe(self) -> None:
+        # PyGithub records X-RateLimit-Remaining/Reset from every response it receives.
+        if not self._observe_quota:
+            return
+        try:
+            remaining, limit = self.github.rate_limiting
+            reset_at = self.github.rate_limiting_resettime
+        except Exception:
+            # e.g. GitHub Enterprise Server with rate limiting disabled
+            self._observe_quota = False
+            return
+        self.reads.observe(remaining, reset_at, limit)
+
+    def login(self) -> str:
+        """The login this token's comments are posted as, looked up once.
+
+        Installation tokens cannot read /user, so `INPUT_BOT_LOGIN` names their bot user instead.
+        """
+        # Concurrent workers wait for the first lookup instead of each making their own.
+        with self._login_lock:
+            if self._login is None:
+                try:
+                    self._login = self.call(lambda: self.github.get_user().login)
+                except GithubException as e:
+                    if e.status != 403:
+                        raise
+                    self._login = os.getenv("INPUT_BOT_LOGIN") or DEFAULT_BOT_LOGIN
+            return self._login
+
+    def _fetch_lock(self, key: Any) -> threading.Lock:
+        with self._lock:
+            return self._fetch_locks.setdefault(key, threading.Lock())
+
+    def _forget_fetch_lock(self, key: Any) -> None:
+        # Later lookups find the cached handle first, so the lock is only needed while the request is in flight.
+        with self._lock:
+            self._fetch_locks.pop(key, None)
+
+    def get_repo(self, repo_full_name: str):
+        with self._lock:
+            repo = self._repos.get(repo_full_name)
+        if repo is not None:
+            return repo
+        with self._fetch_lock(repo_full_name):
+            with self._lock:
+                repo = self._repos.get(repo_full_name)
+            if repo is None:
+                repo = self.call(self.github.get_repo, repo_full_name)
+                with self._lock:
+                    self._repos[repo_full_name] = repo
+        self._forget_fetch_lock(repo_full_name)
+        return repo
+
+    def _cached_issue(self, key: Tuple[str, int]):
+        with self._lock:
+            issue = self._issues.get(key)
+            if issue is not None:
+                self._issues.move_to_end(key)
+            return issue
+
+    def get_issue(self, repo_full_name: str, issue_number: int):
+        key = (repo_full_name, issue_number)
+        issue = self._cached_issue(key)
+        if issue is not None:
+            return issue
+        with self._fetch_lock(key):
+            issue = self._cached_issue(key)
+            if issue is None:
+                issue = self.call(self.get_repo(repo_full_name).get_issue, issue_number)
+                self.cache_issue(repo_full_name, issue)
+        self._forget_fetch_lock(key)
+        return issue
+
+    def cache_issue(self, repo_full_name: str, issue) -> None:
+        """Remember an issue handle obtained elsewhere, e.g. from a listing."""
+        with self._lock:
+            self._issues[(repo_full_name, issue.number)] = issue
+            self._issues.move_to_end((repo_full_name, issue.number))
+            while len(self._issues) > MAX_CACHED_ISSUES:
+                self._issues.popitem(last=False)
+
+    def cached_marked_comment(
+        self, repo_full_name: str, issue_number: int, marker: str
+    ) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return `(found, comment)` for a marker lookup this process already made."""
+        with self._lock:
+            markers = self._marked_comments.get((repo_full_name, issue_number))
+            if markers is None or marker not in markers:
+                return False, None
+            self._marked_comments.move_to_end((repo_full_name, issue_number))
+            return True, markers[marker]
+
+    def remember_marked_comment(
+        self, repo_full_name: str, issue_number: int, marker: str, comment: Optional[Dict[str, Any]]
+    ) -> None:
+        key = (repo_full_name, issue_number)
+        with self._lock:
+            self._marked_comments.setdefault(key, {})[marker] = comment
+            self._marked_comments.move_to_end(key)
+            while len(self._marked_comments) > MAX_CACHED_ISSUES:
+                self._marked_comments.popitem(last=False)
+
+    def forget_marked_comments(self, repo_full_name: str, issue_number: int) -> None:
+        """Drop the issue's marker lookups, which others may have outdated by editing or deleting comments."""
+        with self._lock:
+            self._marked_comments.pop((repo_full_name, issue_number), None)
+
+    def comment_written(self, repo_full_name: str, issue_number: int, comment: Dict[str, Any]) -> None:
+        """Point cached marker lookups at a comment this process just created or edited, if it carries them."""
+        body = comment["body"] or ""
+        with self._lock:
+            markers = self._marked_comments.get((repo_full_name, issue_number), {})
+            for marker in list(markers):
+                cached = markers[marker]
+                if marker in body:
+                    markers[marker] = comment
+                elif cached is not None and cached["id"] == comment["id"]:
+                    # The edit removed the marker, so the next lookup has to scan again.
+                    del markers[marker]
+
+
+_sessions: Dict[str, GitHubSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(token: str) -> GitHubSession:
+    """Return the process-wide session for a token, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(token)
+        if session is None:
+            session = _sessions[token] = GitHubSession(token)
+        return session
+
+
+def _issue_as_dict(issue) -> Dict[str, Any]:
+    return {
+        "id": issue.id,
+        "number": issue.number,
+        "title": issue.title,
+        "body": issue.body,
+        "state": issue.state,
+        "labels": [label.name for label in issue.labels],
+        "assignee": issue.assignee.login if issue.assignee else None,
+        "created_at": issue.created_at.isoformat(),
+        "updated_at": issue.updated_at.isoformat(),
+    }
+
 
 def get_github_issue(
     token: str, repo_full_name: str, issue_id: int
 ) -> Optional[Dict[str, Any]]:
     """Fetch a GitHub issue by its ID."""
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_full_name)
-        issue = repo.get_issue(issue_id)
-        return {
-            "id": issue.id,
-            "number": issue.number,
-            "title": issue.title,
-            "body": issue.body,
-            "state": issue.state,
-            "labels": [label.name for label in issue.labels],
-            "assignee": issue.assignee.login if issue.assignee else None,
-            "created_at": issue.created_at.isoformat(),
-            "updated_at": issue.updated_at.isoformat(),
-        }
+        issue = get_session(token).get_issue(repo_full_name, issue_id)
+        return _issue_as_dict(issue)
     except Exception as e:
         print(f"Error fetching GitHub issue: {type(e).__name__}: {e}")
         return None
 
 
+def list_open_issues(token: str, repo_full_name: str) -> Iterator[Dict[str, Any]]:
+    """Yield every open issue in a repository, page by page, skipping pull requests."""
+    session = get_session(token)
+    issues = session.get_repo(repo_full_name).get_issues(state="open")
+    page = 0
+    while True:
+        items = session.call(issues.get_page, page)
+        if not items:
+            return
+        for issue in items:
+            if issue.pull_request is None:
+                session.cache_issue(repo_full_name, issue)
+                yield _issue_as_dict(issue)
+        page += 1
+
+
 def create_github_issue_comment(
     token: str, repo_full_name: str, issue_id: int, comment: str
 ) -> None:
-    """Create a comment on a GitHub issue with detailed error reporting."""
+    """Create a comment on a GitHub issue, retrying when throttled. Raises once retries run out."""
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_full_name)
-        issue = repo.get_issue(issue_id)
-        issue.create_comment(comment)
+        session = get_session(token)
+        issue = session.get_issue(repo_full_name, issue_id)
+        created = session.write(issue.create_comment, comment)
+        session.comment_written(repo_full_name, issue_id, _comment_as_dict(created))
     except Exception as e:
         print(f"Error creating GitHub issue comment: {type(e).__name__}: {e}")
+        raise
 
 
 def write_github_output(env_file: Optional[str], key: str, value: str) -> None:
-    """Write a key-value pair to the GitHub Actions environment file."""
+    """Write a key-value pair to the GitHub Actions environment file.
+
+    Multi-line values use the delimiter form, with a delimiter that cannot occur in the value.
+    """
     if env_file:
         try:
             with open(env_file, "a") as f:
-                f.write(f"{key}={value}\n")
+                if "\n" in value:
+                    delimiter = f"ghadelimiter_{uuid.uuid4().hex}"
+                    f.write(f"{key}<<{delimiter}\n{value}\n{delimiter}\n")
+                else:
+                    f.write(f"{key}={value}\n")
         except Exception as e:
             print(f"Error writing to env file: {e}")
     else:
         print(f"{key}={value}")
 
-def get_github_comment(token: str, repo_full_name: str, issue_number: int, comment_id: int):
+def _comment_as_dict(comment) -> Dict[str, Any]:
+    return {
+        "id": comment.id,
+        "body": comment.body,
+        "user": comment.user.login if comment.user else None,
+        "created_at": comment.created_at.isoformat(),
+        "updated_at": comment.updated_at.isoformat(),
+    }
+
+
+def get_github_comment(token: str, repo_full_name: str, issue_number: int, comment_id: int) -> Dict[str, Any]:
+    """Fetch a single issue comment by its ID."""
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_full_name)
-        issue = repo.get_issue(issue_number)
-        comments = issue.get_comments()
-        for comment in comments:
-            if comment.id == comment_id:
-                return comment
-        raise Exception(f"Comment with id {comment_id} not found")
+        session = get_session(token)
+        # Lazy handles make the comment lookup the only request; reading its fields sends it.
+        issue = session.lazy_github.get_repo(repo_full_name).get_issue(issue_number)
+        return session.call(lambda: _comment_as_dict(issue.get_comment(comment_id)))
     except Exception as e:
         print(f"Error fetching GitHub comment: {type(e).__name__}: {e}")
         raise
 
 
-def update_github_issue(token: str, repo_full_name: str, issue_number: int, title=None, body=None, labels=None):
+def has_write_access(token: str, repo_full_name: str, login: Optional[str]) -> bool:
+    """Whether `login` can push to the repository; anyone who is not a collaborator cannot."""
+    if not login:
+        return False
+    session = get_session(token)
+    try:
+        # The lazy repository handle makes the permission lookup the only request.
+        repo = session.lazy_github.get_repo(repo_full_name)
+        permission = session.call(repo.get_collaborator_permission, login)
+    except GithubException as e:
+        if e.status != 404:
+            raise
+        return False
+    return permission in WRITE_PERMISSIONS
+
+
+def find_latest_comment_with_marker(
+    token: str, repo_full_name: str, issue_number: int, marker: str
+) -> Optional[Dict[str, Any]]:
+    """Return the newest comment posted by this token's user whose body contains `marker`, reading pages from the end.
+
+    Comments by anyone else are ignored, so a quoted or planted marker never stands in for the bot's own.
+
+    The result is cached until `forget_marked_comments`, which the webhook server calls at the start of every job,
+    and kept current as this process writes comments, so a repeated lookup within one run or job, e.g. the
+    fingerprint check followed by an upsert, scans the thread only once.
+    """
+
+    def scan(issue, login: str) -> Optional[Dict[str, Any]]:
+        for comment in issue.get_comments().reversed:
+            if marker in (comment.body or "") and comment.user is not None and comment.user.login == login:
+                return _comment_as_dict(comment)
+        return None
+
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_full_name)
-        issue = repo.get_issue(issue_number)
+        session = get_session(token)
+        found, comment = session.cached_marked_comment(repo_full_name, issue_number, marker)
+        if found:
+            return comment
+        # A retried scan starts over with a fresh listing.
+        comment = session.call(scan, session.get_issue(repo_full_name, issue_number), session.login())
+        session.remember_marked_comment(repo_full_name, issue_number, marker, comment)
+        return comment
+    except Exception as e:
+        print(f"Error searching GitHub comments: {type(e).__name__}: {e}")
+        return None
 
+
+def upsert_github_issue_comment(token: str, repo_full_name: str, issue_number: int, marker: str, comment: str) -> str:
+    """Make the newest comment this token posted containing `marker` read `comment`, creating it when there is none.
+
+    Only the bot's own comments are considered, so a quoted marker never leads to editing someone else's comment.
+
+    Returns "created", "updated" or "unchanged"; nothing is written when the body is already identical.
+    Raises once retries run out, like `create_github_issue_comment`.
+    """
+    existing = find_latest_comment_with_marker(token, repo_full_name, issue_number, marker)
+    if existing is not None and existing["body"] == comment:
+        return "unchanged"
+    session = get_session(token)
+    if existing is not None:
+        try:
+            repo = session.lazy_github.get_repo(repo_full_name)
+            # Every handle on the way is lazy, so the edit is the only request.
+            session.write(repo.get_issue(issue_number).get_comment(existing["id"]).edit, comment)
+            session.comment_written(repo_full_name, issue_number, {**existing, "body": comment})
+            return "updated"
+        except GithubException as e:
+            if e.status != 404:
+                print(f"Error editing GitHub issue comment: {type(e).__name__}: {e}")
+                raise
+            print(f"🟡 Comment {existing['id']} on issue #{issue_number} was deleted, posting a new one")
+            session.remember_marked_comment(repo_full_name, issue_number, marker, None)
+    create_github_issue_comment(token, repo_full_name, issue_number, comment)
+    return "created"
+
+
+class IssueConflictError(Exception):
+    """Raised when an issue changed after the caller read it."""
+
+
+class IssueMutation:
+    """Collects pending changes to one issue and applies them with a single edit.
+
+    Pass `expected_updated_at` (an isoformat timestamp) to refuse the write when
+    someone else edited the issue after it was read.
+    """
+
+    def __init__(self, repo_full_name: str, issue_number: int, expected_updated_at: Optional[str] = None):
+        self.repo_full_name = repo_full_name
+        self.issue_number = issue_number
+        self.expected_updated_at = expected_updated_at
+        self.title: Optional[str] = None
+        self.body: Optional[str] = None
+        self.labels: Optional[List[str]] = None
+        self.added_labels: List[str] = []
+
+    def set_title(self, title: str) -> "IssueMutation":
+        self.title = title
+        return self
+
+    def set_body(self, body: str) -> "IssueMutation":
+        self.body = body
+        return self
+
+    def set_labels(self, labels: List[str]) -> "IssueMutation":
+        self.labels = list(labels)
+        return self
+
+    def add_labels(self, labels: List[str]) -> "IssueMutation":
+        """Add labels on top of the issue's current ones when the mutation is applied."""
+        self.added_labels.extend(labels)
+        return self
+
+    def is_empty(self) -> bool:
+        return self.title is None and self.body is None and self.labels is None and not self.added_labels
+
+    def _changes(self, issue) -> Dict[str, Any]:
+        changes: Dict[str, Any] = {}
+        if self.title is not None and self.title != issue.title:
+            changes["title"] = self.title
+        if self.body is not None and self.body != issue.body:
+            changes["body"] = self.body
+
+        current = [label.name for label in issue.labels]
+        labels = list(self.labels) if self.labels is not None else list(current)
+        known = {label.lower() for label in labels}
+        for label in self.added_labels:
+            if label.lower() not in known:
+                labels.append(label)
+                known.add(label.lower())
+        if labels != current:
+            changes["labels"] = labels
+        return changes
+
+    def apply(self, token: str) -> bool:
+        """Send every pending change in one PATCH. Returns False when nothing changed."""
+        if self.is_empty():
+            return False
+        session = get_session(token)
+        issue = session.get_issue(self.repo_full_name, self.issue_number)
+        if self.expected_updated_at is not None:
+            # Conditional GET: answered from the ETag with a cheap 304 when nothing changed.
+            session.call(issue.update)
+            if issue.updated_at != datetime.fromisoformat(self.expected_updated_at):
+                raise IssueConflictError(
+                    f"Issue #{self.issue_number} was modified at {issue.updated_at.isoformat()}, "
+                    f"after it was read at {self.expected_updated_at}"
+                )
+        changes = self._changes(issue)
+        if not changes:
+            return False
+        session.write(issue.edit, **changes)
+        return True
+
+
+def update_github_issue(
+    token: str,
+    repo_full_name: str,
+    issue_number: int,
+    title=None,
+    body=None,
+    labels=None,
+    expected_updated_at: Optional[str] = None,
+) -> bool:
+    """Update an issue's title, body and labels in a single request."""
+    try:
+        mutation = IssueMutation(repo_full_name, issue_number, expected_updated_at)
         if title is not None:
-            issue.edit(title=title)
+            mutation.set_title(title)
         if body is not None:
-            issue.edit(body=body)
+            mutation.set_body(body)
         if labels is not None:
-            issue.edit(labels=labels)
+            mutation.set_labels(labels)
+        return mutation.apply(token)
     except Exception as e:
         print(f"Error updating GitHub issue: {type(e).__name__}: {e}")
         raise
@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_PERCENTILE = 95.0
+# Until an endpoint has enough samples its percentile is meaningless, so hedge after a fixed delay.
+MIN_SAMPLES = 20
+INITIAL_HEDGE_DELAY_SECONDS = 10.0
+MIN_HEDGE_DELAY_SECONDS = 0.25
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30.0
+
+# Bucket upper bounds from 10 ms to about 2 minutes, 25% apart.
+_BOUNDS: List[float] = [0.01 * 1.25**i for i in range(43)] + [float("inf")]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(_BOUNDS)
+        self.total = 0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(_BOUNDS, seconds)] += 1
+        self.total += 1
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile, in seconds."""
+        if not self.total:
+            return 0.0
+        rank = self.total * p / 100
+        seen = 0
+        for bound, count in zip(_BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float("inf") else _BOUNDS[-2]
+        return _BOUNDS[-2]
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; once `OPEN_SECONDS` pass, one trial call may close it again.
+
+    `allows()` hands out that trial, so it must only be asked right before making the call, and the
+    call must end in `record_success`, `record_failure` or `record_cancelled`.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= OPEN_SECONDS else "open"
+
+    def allows(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_cancelled(self) -> None:
+        """A call was abandoned without an outcome, e.g. it lost a hedge; the next caller may try instead."""
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.trial_in_flight = False
+        self.failures += 1
+        if self.failures >= FAILURE_THRESHOLD or self.opened_at is not None:
+            # A failed trial in the half-open state reopens the breaker for another period.
+            self.opened_at = time.monotonic()
+
+
+class EndpointHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.breaker = CircuitBreaker()
+        self.hedges = 0
+        self.wins = 0
+        self.cancelled = 0
+
+    def hedge_delay(self, percentile: float) -> float:
+        if self.latency.total < MIN_SAMPLES:
+            return INITIAL_HEDGE_DELAY_SECONDS
+        return max(MIN_HEDGE_DELAY_SECONDS, self.latency.percentile(percentile))
+
+    def stats_str(self) -> str:
+        return (
+            f"p50 {self.latency.percentile(50):.2f}s, p95 {self.latency.percentile(95):.2f}s, "
+            f"p99 {self.latency.percentile(99):.2f}s over {self.latency.total} calls, "
+            f"breaker {self.breaker.state}, {self.hedges} hedged, {self.wins} won as backup, {self.cancelled} cancelled"
+        )
+
+
+_health: Dict[str, EndpointHealth] = {}
+_percentile = DEFAULT_PERCENTILE
+
+
+def configure(percentile=None) -> None:
+    global _percentile
+    _percentile = float(percentile) if percentile else DEFAULT_PERCENTILE
+
+
+def get_health(name: str) -> EndpointHealth:
+    health = _health.get(name)
+    if health is None:
+        health = _health[name] = EndpointHealth(name)
+    return health
+
+
+def health_stats() -> Dict[str, str]:
+    return {name: health.stats_str() for name, health in _health.items()}
+
+
+def pick_endpoint(primary: str, secondary: Optional[str]) -> str:
+    """The primary, unless its breaker is open and the secondary's is not. The picked endpoint is then called."""
+    if secondary is not None and not get_health(primary).breaker.allows() and get_health(secondary).breaker.allows():
+        return secondary
+    return primary
+
+
+async def _timed(name: str, call: Callable[[str], Awaitable[T]]) -> T:
+    health = get_health(name)
+    started = time.monotonic()
+    try:
+        result = await call(name)
+    except asyncio.CancelledError:
+        # A call cancelled because it lost a hedge took at least this long; leaving it out
+        # would skew the percentile towards the fast calls.
+        health.latency.record(time.monotonic() - started)
+        health.cancelled += 1
+        health.breaker.record_cancelled()
+        raise
+    except Exception:
+        health.breaker.record_failure()
+        raise
+    health.latency.record(time.monotonic() - started)
+    health.breaker.record_success()
+    return result
+
+
+async def hedged(primary: str, secondary: Optional[str], call: Callable[[str], Awaitable[T]]) -> T:
+    """Run `call` on the primary endpoint, and also on the secondary once the primary is slower than its percentile.
+
+    The first success wins and the other call is cancelled. A primary that fails outright,
+    or whose breaker is open, fails over to the secondary at once.
+    """
+    if secondary is None:
+        return await _timed(primary, call)
+    first = pick_endpoint(primary, secondary)
+    backup = secondary if first == primary else primary
+
+    tasks: Dict[asyncio.Task, str] = {asyncio.create_task(_timed(first, call)): first}
+    errors: List[BaseException] = []
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=get_health(first).hedge_delay(_percentile))
+        if done and next(iter(done)).exception() is None:
+            return next(iter(tasks)).result()
+        # The backup's breaker is only asked now that it will be called, since asking may take its one trial.
+        if get_health(backup).breaker.allows():
+            if not done:
+                print(f"🪁 {first} is slow, hedging the request on {backup}", file=sys.stderr)
+                get_health(backup).hedges += 1
+            tasks[asyncio.create_task(_timed(backup, call))] = backup
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task] == backup:
+                        get_health(backup).wins += 1
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[0]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
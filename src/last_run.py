@@ -0,0 +1,22 @@
+# The skip check for unchanged issues, kept apart from pipeline.py so that an issue which needs
+# no analysis is turned away before Semantic Kernel and the Azure OpenAI client are imported.
+from typing import Any, Dict
+from async_github_utils import find_latest_comment_with_marker
+from fingerprint import FINGERPRINT_MARKER, changed_sections, issue_fingerprint, parse_fingerprint
+
+
+async def is_unchanged_since_last_run(token: str, repo_full_name: str, issue: Dict[str, Any]) -> bool:
+    """Check whether the issue content matches the fingerprint stored by the bot's last finished run."""
+    comment = await find_latest_comment_with_marker(token, repo_full_name, issue["number"], FINGERPRINT_MARKER)
+    previous = parse_fingerprint(comment["body"]) if comment else None
+    if previous is None:
+        return False
+    if previous.get("rewrite_due"):
+        print(f"🔄 The last run for issue #{issue['number']} did not post its rewrite, analyzing again")
+        return False
+    changed = changed_sections(previous, issue_fingerprint(issue["title"], issue["body"]))
+    if changed:
+        print(f"🔄 Issue #{issue['number']} changed since the last analysis: {', '.join(changed)}")
+        return False
+    print(f"⏭ Issue #{issue['number']} is unchanged since the last analysis, skipping")
+    return True
@@ -1,26 +1,75 @@
 import asyncio
 import os
 import sys
-from openai_utils import run_completion, initialize_kernel
 from validation import validate_inputs
-from github_utils import (
-    get_github_issue,
-    create_github_issue_comment,
-    get_github_comment,
-    update_github_issue,
-)
-from prompts import build_validation_message, build_rewrite_message
-from responses import ValidationResponse, RewriteResponse
+from github_utils import IssueConflictError, write_github_output
+from async_github_utils import apply_issue_mutation
+from event_payload import load_event_payload, get_issue_data, get_comment_data
+from apply import build_apply_mutation, find_rewrite_comment
+from last_run import is_unchanged_since_last_run
+from compaction import DEFAULT_TOKEN_BUDGET
+import tracing
+
+# The LLM stack (openai_utils, pipeline, backlog -> semantic_kernel) is imported
+# inside the handlers that use it, so the apply path and unchanged issues never pay for loading it.
 
 
 def main() -> None:
-    if os.getenv("GITHUB_COMMENT_ID"):
-        handle_apply_comment()
-    else:
-        handle_new_issue()
+    if (os.getenv("INPUT_PROFILE_STARTUP") or "").lower() == "true" and "importtime" not in sys._xoptions:
+        from startup_profile import run_with_import_profile
+
+        sys.exit(run_with_import_profile(os.getenv("INPUT_STARTUP_BUDGET_MS")))
+    asyncio.run(run())
+
+
+async def run() -> None:
+    """Dispatch to the handler for this event; every handler shares this one event loop."""
+    mode = (os.getenv("INPUT_MODE") or "issue").strip().lower()
+    tracing.configure(
+        os.getenv("INPUT_METRICS_FILE"), os.getenv("INPUT_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    )
+    # The server exports per job; every other mode is one traced run.
+    root = tracing.NOOP_SPAN if mode == "server" else tracing.span("run", mode=mode)
+    try:
+        with root:
+            if mode == "backlog":
+                await handle_backlog_sweep()
+            elif mode == "batch":
+                await handle_batch_triage()
+            elif mode == "server":
+                await handle_server()
+            elif os.getenv("GITHUB_COMMENT_ID"):
+                root.set("mode", "apply")
+                await handle_apply_comment()
+            else:
+                await handle_new_issue()
+    finally:
+        tracing.export()
+        for key, value in tracing.outputs().items():
+            write_github_output(os.getenv("GITHUB_OUTPUT"), key, value)
+
+
+def read_pipeline_options() -> dict:
+    """Read the optional inputs shared by every enhancement mode."""
+    return {
+        "azure_validation_deployment": os.getenv("INPUT_AZURE_OPENAI_VALIDATION_DEPLOYMENT"),
+        "azure_secondary_endpoint": os.getenv("INPUT_AZURE_OPENAI_SECONDARY_ENDPOINT"),
+        "azure_secondary_api_key": os.getenv("INPUT_AZURE_OPENAI_SECONDARY_API_KEY"),
+        "hedge_percentile": os.getenv("INPUT_HEDGE_PERCENTILE"),
+        "apply_labels": (os.getenv("INPUT_APPLY_LABELS") or "").lower() == "true",
+        "skip_unchanged": (os.getenv("INPUT_SKIP_UNCHANGED") or "true").lower() == "true",
+        "combined_analysis": (os.getenv("INPUT_COMBINED_ANALYSIS") or "").lower() == "true",
+        "stream_validation": (os.getenv("INPUT_STREAM_VALIDATION") or "").lower() == "true",
+        "upsert_comment": (os.getenv("INPUT_UPSERT_COMMENT") or "").lower() == "true",
+        "cache_dir": os.getenv("INPUT_CACHE_DIR"),
+        "cache_ttl_hours": os.getenv("INPUT_CACHE_TTL_HOURS"),
+        "cache_max_mb": os.getenv("INPUT_CACHE_MAX_MB"),
+        "duplicate_threshold": os.getenv("INPUT_DUPLICATE_THRESHOLD"),
+        "prompt_token_budget": int(os.getenv("INPUT_PROMPT_TOKEN_BUDGET") or DEFAULT_TOKEN_BUDGET),
+    }
 
 
-def handle_new_issue():
+async def handle_new_issue():
     """Handles enhancement when a new issue is created."""
     inputs = {
         "github_token": os.getenv("INPUT_GITHUB_TOKEN"),
@@ -29,103 +78,130 @@ def handle_new_issue():
         "azure_endpoint": os.getenv("INPUT_AZURE_OPENAI_ENDPOINT"),
         "azure_deployment": os.getenv("INPUT_AZURE_OPENAI_DEPLOYMENT"),
         "repo_full_name": os.getenv("GITHUB_REPOSITORY"),
+        **read_pipeline_options(),
     }
+    with tracing.span("inputs.validate"):
+        validate_inputs(inputs)
 
-    issue = get_github_issue(inputs["github_token"], inputs["repo_full_name"], inputs["issue_id"])
-    validate_inputs(inputs)
+    payload = load_event_payload()
+    issue = await asyncio.to_thread(
+        get_issue_data, inputs["github_token"], inputs["repo_full_name"], inputs["issue_id"], payload
+    )
+    # An unchanged issue, the common case for edit events, stops before the LLM stack is even imported.
+    if inputs["skip_unchanged"] and await is_unchanged_since_last_run(
+        inputs["github_token"], inputs["repo_full_name"], issue
+    ):
+        return
 
-    kernel = initialize_kernel(inputs)
+    with tracing.span("imports.llm_stack"):
+        from openai_utils import initialize_kernel, usage_totals
+        from completion_cache import open_completion_cache
+        from duplicates import open_duplicate_index
+        from pipeline import enhance_issue
 
-    # Step 1: Run validation
-    messages = build_validation_message(issue["number"], issue["title"], issue["body"])
+    kernel = await asyncio.to_thread(initialize_kernel, inputs)
+    cache = open_completion_cache(inputs["cache_dir"], inputs["cache_ttl_hours"], inputs["cache_max_mb"])
+    duplicates = open_duplicate_index(inputs["cache_dir"], inputs["duplicate_threshold"])
     try:
-        validation_raw = asyncio.run(run_completion(kernel, messages))
-        validation = ValidationResponse(validation_raw)
-    except Exception as e:
-        print(f"Error during validation: {type(e).__name__}: {e}", file=sys.stderr)
+        validation = await enhance_issue(kernel, inputs, issue, cache, duplicates)
+        write_github_output(os.getenv("GITHUB_OUTPUT"), "enhanced_summary", validation.summary)
+        write_github_output(os.getenv("GITHUB_OUTPUT"), "ready_to_work", str(validation.ready_to_work).lower())
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
         sys.exit(1)
+    finally:
+        if duplicates is not None:
+            duplicates.save()
+        print(f"💾 Completion cache: {cache.stats_str()}")
+        print(f"🧮 Token usage: {usage_totals.stats_str()}")
 
-    create_github_issue_comment(
-        inputs["github_token"],
-        inputs["repo_full_name"],
-        inputs["issue_id"],
-        validation.as_markdown_str(),
-    )
 
-    if validation.ready_to_work:
-        return
+async def handle_backlog_sweep() -> None:
+    """Handles enhancement of every open issue in the repository."""
+    from backlog import run_backlog_sweep, DEFAULT_CONCURRENCY, DEFAULT_CHECKPOINT
 
-    # Step 2: Run rewrite
-    messages = build_rewrite_message(issue["number"], issue["title"], issue["body"], validation.completeness)
-    try:
-        rewrite_raw = asyncio.run(run_completion(kernel, messages))
-        rewrite = RewriteResponse(rewrite_raw)
-    except Exception as e:
-        print(f"Error during rewrite: {type(e).__name__}: {e}", file=sys.stderr)
-        sys.exit(1)
+    inputs = {
+        "github_token": os.getenv("INPUT_GITHUB_TOKEN"),
+        "openai_api_key": os.getenv("INPUT_OPENAI_API_KEY"),
+        "azure_endpoint": os.getenv("INPUT_AZURE_OPENAI_ENDPOINT"),
+        "azure_deployment": os.getenv("INPUT_AZURE_OPENAI_DEPLOYMENT"),
+        "repo_full_name": os.getenv("GITHUB_REPOSITORY"),
+        "backlog_org": os.getenv("INPUT_BACKLOG_ORG"),
+        **read_pipeline_options(),
+    }
+    with tracing.span("inputs.validate"):
+        validate_inputs(inputs, require_issue_id=False, require_repo=not inputs["backlog_org"])
 
-    create_github_issue_comment(
-        inputs["github_token"],
-        inputs["repo_full_name"],
-        inputs["issue_id"],
-        rewrite.as_markdown_str(),
-    )
+    concurrency = int(os.getenv("INPUT_BACKLOG_CONCURRENCY") or DEFAULT_CONCURRENCY)
+    checkpoint_path = os.getenv("INPUT_BACKLOG_CHECKPOINT") or DEFAULT_CHECKPOINT
 
+    progress = await run_backlog_sweep(inputs, concurrency, checkpoint_path)
+    print(f"🏁 Backlog sweep finished: {progress.as_str()}")
+    if progress.failed:
+        sys.exit(1)
 
-def update_issue_body_with_rewrite(original_body: str, new_description: str, new_acceptance_criteria: list[str]) -> str:
-    import re
 
-    criteria_text = "\n".join(f"- {item}" for item in new_acceptance_criteria) if new_acceptance_criteria else ""
+async def handle_batch_triage() -> None:
+    """Handles offline triage of every open issue through the Azure OpenAI Batch API."""
+    from backlog import DEFAULT_CONCURRENCY, DEFAULT_CHECKPOINT
+    from batch import run_batch_triage, DEFAULT_BATCH_DIR, DEFAULT_POLL_SECONDS
 
-    description_pattern = re.compile(
-        r"(Description:\s*\n)(.*?)(\n\n|\Z)", re.IGNORECASE | re.DOTALL
-    )
-    acceptance_pattern = re.compile(
-        r"(Acceptance Criteria:\s*\n)(.*?)(\n\n|\Z)", re.IGNORECASE | re.DOTALL
+    inputs = {
+        "github_token": os.getenv("INPUT_GITHUB_TOKEN"),
+        "openai_api_key": os.getenv("INPUT_OPENAI_API_KEY"),
+        "azure_endpoint": os.getenv("INPUT_AZURE_OPENAI_ENDPOINT"),
+        "azure_deployment": os.getenv("INPUT_AZURE_OPENAI_DEPLOYMENT"),
+        "azure_batch_deployment": os.getenv("INPUT_AZURE_OPENAI_BATCH_DEPLOYMENT"),
+        "repo_full_name": os.getenv("GITHUB_REPOSITORY"),
+        "backlog_org": os.getenv("INPUT_BACKLOG_ORG"),
+        **read_pipeline_options(),
+    }
+    with tracing.span("inputs.validate"):
+        validate_inputs(inputs, require_issue_id=False, require_repo=not inputs["backlog_org"])
+
+    progress = await run_batch_triage(
+        inputs,
+        concurrency=int(os.getenv("INPUT_BACKLOG_CONCURRENCY") or DEFAULT_CONCURRENCY),
+        checkpoint_path=os.getenv("INPUT_BACKLOG_CHECKPOINT") or DEFAULT_CHECKPOINT,
+        batch_dir=os.getenv("INPUT_BATCH_DIR") or DEFAULT_BATCH_DIR,
+        poll_seconds=float(os.getenv("INPUT_BATCH_POLL_SECONDS") or DEFAULT_POLL_SECONDS),
     )
+    print(f"🏁 Batch triage finished: {progress.as_str()}")
+    if progress.failed:
+        sys.exit(1)
 
-    if new_description:
-        if description_pattern.search(original_body):
-            original_body = description_pattern.sub(r"\1" + new_description + r"\3", original_body)
-        else:
-            original_body += f"\n\nDescription:\n{new_description}"
-
-    if criteria_text:
-        if acceptance_pattern.search(original_body):
-            original_body = acceptance_pattern.sub(r"\1" + criteria_text + r"\3", original_body)
-        else:
-            original_body += f"\n\nAcceptance Criteria:\n{criteria_text}"
-
-    return original_body
 
-def update_issue_body_with_rewrite(original_body: str, new_description: str, new_acceptance_criteria: list[str]) -> str:
-    import re
+async def handle_server() -> None:
+    """Handles GitHub webhook deliveries with warm workers until the process is stopped."""
+    from server import serve, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+    from coalescer import DEFAULT_QUIET_SECONDS
 
-    criteria_text = "\n".join(f"- {item}" for item in new_acceptance_criteria) if new_acceptance_criteria else ""
+    inputs = {
+        "github_token": os.getenv("INPUT_GITHUB_TOKEN"),
+        "openai_api_key": os.getenv("INPUT_OPENAI_API_KEY"),
+        "azure_endpoint": os.getenv("INPUT_AZURE_OPENAI_ENDPOINT"),
+        "azure_deployment": os.getenv("INPUT_AZURE_OPENAI_DEPLOYMENT"),
+        **read_pipeline_options(),
+    }
+    with tracing.span("inputs.validate"):
+        validate_inputs(inputs, require_issue_id=False, require_repo=False)
+    secret = os.getenv("INPUT_WEBHOOK_SECRET")
+    if not secret:
+        print("Error: Invalid or missing INPUT_WEBHOOK_SECRET.", file=sys.stderr)
+        sys.exit(1)
 
-    description_pattern = re.compile(
-        r"(Description:\s*\n)(.*?)(\n\n|\Z)", re.IGNORECASE | re.DOTALL
-    )
-    acceptance_pattern = re.compile(
-        r"(Acceptance Criteria:\s*\n)(.*?)(\n\n|\Z)", re.IGNORECASE | re.DOTALL
+    await serve(
+        inputs,
+        secret,
+        host=os.getenv("SERVER_HOST") or DEFAULT_HOST,
+        port=int(os.getenv("SERVER_PORT") or DEFAULT_PORT),
+        workers=int(os.getenv("SERVER_WORKERS") or DEFAULT_WORKERS),
+        queue_size=int(os.getenv("SERVER_QUEUE_SIZE") or DEFAULT_QUEUE_SIZE),
+        quiet_seconds=float(os.getenv("SERVER_QUIET_SECONDS") or DEFAULT_QUIET_SECONDS),
     )
 
-    if new_description:
-        if description_pattern.search(original_body):
-            original_body = description_pattern.sub(r"\1" + new_description + r"\3", original_body)
-        else:
-            original_body += f"\n\nDescription:\n{new_description}"
-
-    if criteria_text:
-        if acceptance_pattern.search(original_body):
-            original_body = acceptance_pattern.sub(r"\1" + criteria_text + r"\3", original_body)
-        else:
-            original_body += f"\n\nAcceptance Criteria:\n{criteria_text}"
 
-    return original_body
-
-
-def handle_apply_comment() -> None:
+async def handle_apply_comment() -> None:
     """Handles applying enhancements on user comment."""
     inputs = {
         "token": os.getenv("INPUT_GITHUB_TOKEN"),
@@ -141,50 +217,29 @@ def handle_apply_comment() -> None:
 
     print(f"🛠 Handling apply comment for issue #{issue_number} and comment {comment_id}")
 
-    # Fetch current issue and comment from GitHub
-    issue = get_github_issue(token, repo_full_name, issue_number)
-    comment = get_github_comment(token, repo_full_name, issue_number, comment_id)
-
-    # Parse rewrite from comment body
-    rewrite = RewriteResponse.from_comment(comment.body)
-
-    # Normalize title check helper
-    def normalize_text(text: str) -> str:
-        return text.lower().strip(" _*")
-
-    # Prepare updated title if valid
-    new_title = None
-    if rewrite.title and normalize_text(rewrite.title) != "no update provided.":
-        new_title = rewrite.title
-        print(f"✅ Will update title to: {new_title}")
-    else:
-        print("🟡 Skipping title update")
-
-    # Update issue body with description and acceptance criteria
-    new_body = issue["body"]
-    new_body = update_issue_body_with_rewrite(
-        original_body=new_body,
-        new_description=rewrite.description if rewrite.description and normalize_text(rewrite.description) != "no update provided." else None,
-        new_acceptance_criteria=rewrite.acceptance_criteria,
+    # Read the issue and comment from the event payload, falling back to GitHub
+    payload = load_event_payload()
+    issue, comment = await asyncio.gather(
+        asyncio.to_thread(get_issue_data, token, repo_full_name, issue_number, payload),
+        asyncio.to_thread(get_comment_data, token, repo_full_name, issue_number, comment_id, payload),
     )
-    print("✅ Issue body updated with new description and acceptance criteria")
+    comment = await find_rewrite_comment(token, repo_full_name, issue_number, comment)
+
+    mutation = build_apply_mutation(repo_full_name, issue, comment)
 
-    # Push update to GitHub
+    # Push every change to GitHub in a single update
     try:
-        update_github_issue(
-            token=token,
-            repo_full_name=repo_full_name,
-            issue_number=issue_number,
-            title=new_title,  # None means no change
-            body=new_body,
-            labels=None,  # No label changes here
-        )
-        print(f"🎉 Successfully applied rewrite updates to issue #{issue_number}")
+        if await apply_issue_mutation(token, mutation):
+            print(f"🎉 Successfully applied rewrite updates to issue #{issue_number}")
+        else:
+            print(f"🟡 Issue #{issue_number} already matches the rewrite, nothing to update")
+    except IssueConflictError as e:
+        print(f"❌ Not applying rewrite, the issue changed concurrently: {e}", file=sys.stderr)
+        sys.exit(1)
     except Exception as e:
         print(f"❌ Failed to update issue: {type(e).__name__}: {e}", file=sys.stderr)
         sys.exit(1)
 
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,512 @@
+import email.parser
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+DEFAULT_PER_PAGE = 30
+# The token's own user, who posts every comment the handlers create, and the human who writes the rest.
+BOT_LOGIN = "issue-enhancer-bot"
+MAINTAINER_LOGIN = "octocat"
+CREATED_AT = "2024-01-01T00:00:00Z"
+STREAM_CHUNK_CHARS = 16
+# Batch requests whose prompt contains this are rejected into the batch's error file.
+FILTERED_PHRASE = "trip the content filter"
+FILLER = "The synthetic benchmark model keeps writing filler text to reach the configured size. "
+
+# (status, headers, body chunks); chunks are flushed one by one so streams arrive incrementally.
+Reply = Tuple[int, Dict[str, str], List[bytes]]
+
+
+def json_reply(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Reply:
+    return status, {"Content-Type": "application/json", **(headers or {})}, [json.dumps(data).encode("utf-8")]
+
+
+def filler(chars: int) -> str:
+    return (FILLER * (chars // len(FILLER) + 1))[:chars] if chars > 0 else ""
+
+
+class MockSettings:
+    """Behaviour shared by the stand-in servers.
+
+    `latency_ms` is added to every response, a deterministic `error_rate` share of requests is
+    answered with a throttling 429, and `completion_chars` pads every completion to roughly that size.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, completion_chars: int = 0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.completion_chars = completion_chars
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"latency_ms": self.latency_ms, "error_rate": self.error_rate, "completion_chars": self.completion_chars}
+
+
+class MockServer:
+    """A stand-in HTTP API on a free loopback port that counts calls per route."""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.calls: Counter = Counter()
+        self._requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self) -> "MockServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self._requests = 0
+
+    def count(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] += 1
+
+    def _throttle(self) -> bool:
+        # Every 1/error_rate-th request is throttled, so the number of errors does not depend on timing.
+        with self._lock:
+            self._requests += 1
+            n = self._requests
+        rate = self.settings.error_rate
+        return rate > 0 and math.floor(n * rate) != math.floor((n - 1) * rate)
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: bytes, headers) -> Reply:
+        raise NotImplementedError
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; Nagle's algorithm would stall each response.
+            disable_nagle_algorithm = True
+
+            def _serve(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlparse(self.path)
+                if server._throttle():
+                    server.count("throttled")
+                    status, headers, chunks = json_reply({"message": "API rate limit exceeded"}, 429, {"Retry-After": "0"})
+                else:
+                    try:
+                        status, headers, chunks = server.handle(method, url.path, parse_qs(url.query), body, self.headers)
+                    except KeyError as e:
+                        status, headers, chunks = json_reply({"message": f"Not Found: {e}"}, 404)
+                # The call is counted before the latency, so a request the client gives up on still counts.
+                time.sleep(server.settings.latency_ms / 1000)
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", str(sum(len(chunk) for chunk in chunks)))
+                    self.end_headers()
+                    for chunk in chunks:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away, e.g. a hedged request that lost and was cancelled.
+                    self.close_connection = True
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_PATCH(self):
+                self._serve("PATCH")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class MockGitHub(MockServer):
+    """Serves the GitHub REST routes the handlers use for one repository, with paginated listings.
+
+    GraphQL queries are answered from recorded pages, see `load_graphql`. The maintainer administers the
+    repository, the bot can write to it, and anyone else can only read it.
+    """
+
+    def __init__(self, settings: MockSettings, repo_full_name: str = "bench/issues"):
+        super().__init__(settings)
+        self.repo_full_name = repo_full_name
+        self.issues: Dict[int, Dict[str, Any]] = {}
+        self.comments: Dict[int, List[Dict[str, Any]]] = {}
+        self.comment_ids: Dict[int, Tuple[int, int]] = {}
+        self.graphql_pages: List[Dict[str, Any]] = []
+        self._next_comment_id = 1
+
+    def load(self, issues: List[Dict[str, Any]]) -> None:
+        """Replace the repository's issues; each has `number`, `title`, `body`, `labels` and `comments`.
+
+        A comment is a body written by the maintainer, or a `{"body": ..., "user": login}` dict.
+        """
+        self.issues, self.comments, self.comment_ids = {}, {}, {}
+        for issue in issues:
+            number = issue["number"]
+            self.issues[number] = {
+                "id": 1000 + number,
+                "number": number,
+                "title": issue["title"],
+                "body": issue["body"],
+                "state": "open",
+                "labels": [{"name": label} for label in issue.get("labels", [])],
+                "assignee": None,
+                "user": {"login": MAINTAINER_LOGIN, "type": "User"},
+                "created_at": CREATED_AT,
+                "updated_at": CREATED_AT,
+                "url": f"{self.url}/repos/{self.repo_full_name}/issues/{number}",
+                "comments_url": f"{self.url}/repos/{self.repo_full_name}/issues/{number}/comments",
+                "html_url": f"https://github.com/{self.repo_full_name}/issues/{number}",
+            }
+            self.comments[number] = []
+            for comment in issue.get("comments", []):
+                if isinstance(comment, str):
+                    comment = {"body": comment}
+                self._add_comment(number, comment["body"], comment.get("user", MAINTAINER_LOGIN))
+
+    def load_graphql(self, pages: List[Dict[str, Any]]) -> None:
+        """Replace the recorded GraphQL pages, each `{"variables": {...}, "response": {...}}`.
+
+        A query gets the page whose variables, including its cursor, all match; any other query is a 404.
+        """
+        self.graphql_pages = pages
+
+    def last_comment_id(self, issue_number: int) -> int:
+        return self.comments[issue_number][-1]["id"]
+
+    def _add_comment(self, issue_number: int, body: str, login: str = BOT_LOGIN) -> Dict[str, Any]:
+        with self._lock:
+            comment_id = self._next_comment_id
+            self._next_comment_id += 1
+        comment = {
+            "id": comment_id,
+            "body": body,
+            "user": {"login": login, "type": "Bot" if login == BOT_LOGIN else "User"},
+            "created_at": CREATED_AT,
+            "updated_at": CREATED_AT,
+            "url": f"{self.url}/repos/{self.repo_full_name}/issues/comments/{comment_id}",
+            "issue_url": self.issues[issue_number]["url"],
+        }
+        with self._lock:
+            self.comment_ids[comment_id] = (issue_number, len(self.comments[issue_number]))
+            self.comments[issue_number].append(comment)
+        return comment
+
+    def _page(self, items: List[Dict[str, Any]], path: str, query: Dict[str, List[str]]) -> Reply:
+        per_page = int(query.get("per_page", [DEFAULT_PER_PAGE])[0])
+        page = int(query.get("page", ["1"])[0])
+        last = max(1, math.ceil(len(items) / per_page))
+        params = {name: values[0] for name, values in query.items()}
+
+        def link(target: int, rel: str) -> str:
+            return f'<{self.url}{path}?{urlencode({**params, "page": target, "per_page": per_page})}>; rel="{rel}"'
+
+        links = []
+        if page > 1:
+            links += [link(page - 1, "prev"), link(1, "first")]
+        if page < last:
+            links += [link(page + 1, "next"), link(last, "last")]
+        headers = {"Link": ", ".join(links)} if links else {}
+        return json_reply(items[(page - 1) * per_page : page * per_page], headers=headers)
+
+    def handle(self, method, path, query, body, headers) -> Reply:
+        if path == "/user" and method == "GET":
+            self.count("GET user")
+            return json_reply({"login": BOT_LOGIN, "type": "Bot", "url": self.url + path})
+        if path == "/graphql" and method == "POST":
+            self.count("POST graphql")
+            variables = json.loads(body).get("variables") or {}
+            for page in self.graphql_pages:
+                if all(variables.get(name) == value for name, value in page["variables"].items()):
+                    return json_reply(page["response"])
+            raise KeyError(f"no recorded page for {variables}")
+        prefix = f"/repos/{self.repo_full_name}"
+        if not path.startswith(prefix):
+            raise KeyError(path)
+        rest = path[len(prefix) :]
+        owner, name = self.repo_full_name.split("/")
+
+        if rest == "" and method == "GET":
+            self.count("GET repo")
+            return json_reply(
+                {"id": 1, "name": name, "full_name": self.repo_full_name, "owner": {"login": owner}, "url": self.url + path}
+            )
+        match = re.fullmatch(r"/collaborators/([^/]+)/permission", rest)
+        if match and method == "GET":
+            self.count("GET permission")
+            login = match.group(1)
+            permission = {MAINTAINER_LOGIN: "admin", BOT_LOGIN: "write"}.get(login, "read")
+            return json_reply({"permission": permission, "user": {"login": login}})
+        if rest == "/issues" and method == "GET":
+            self.count("GET issues")
+            return self._page(list(self.issues.values()), path, query)
+        match = re.fullmatch(r"/issues/comments/(\d+)", rest)
+        if match:
+            issue_number, index = self.comment_ids[int(match.group(1))]
+            comment = self.comments[issue_number][index]
+            if method == "PATCH":
+                self.count("PATCH comment")
+                comment["body"] = json.loads(body)["body"]
+                comment["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            else:
+                self.count("GET comment")
+            return json_reply(comment)
+        match = re.fullmatch(r"/issues/(\d+)(/comments)?", rest)
+        if not match:
+            raise KeyError(path)
+        issue = self.issues[int(match.group(1))]
+        if match.group(2):
+            if method == "POST":
+                self.count("POST comment")
+                return json_reply(self._add_comment(issue["number"], json.loads(body)["body"]), 201)
+            self.count("GET comments")
+            return self._page(self.comments[issue["number"]], path, query)
+        if method == "PATCH":
+            self.count("PATCH issue")
+            changes = json.loads(body)
+            for field in ("title", "body"):
+                if field in changes:
+                    issue[field] = changes[field]
+            if "labels" in changes:
+                issue["labels"] = [{"name": label} for label in changes["labels"]]
+            issue["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            return json_reply(issue)
+        self.count("GET issue")
+        return json_reply(issue)
+
+
+class MockAzureOpenAI(MockServer):
+    """Answers Azure OpenAI chat completions, streamed or not, and the Batch API file and batch routes.
+
+    Answers follow the prompt formats in prompts.py. An issue counts as ready to work when its
+    text contains an "Acceptance Criteria:" section. Batch requests that mention `FILTERED_PHRASE`
+    end up in the batch's error file, the way content filter rejections do.
+    """
+
+    def __init__(self, settings: MockSettings):
+        super().__init__(settings)
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+
+    def completion_content(self, messages: List[Dict[str, str]], json_mode: bool) -> str:
+        system = messages[0]["content"]
+        issue = messages[-1]["content"]
+        ready = "acceptance criteria:" in issue.lower()
+        padding = filler(self.settings.completion_chars)
+        if "Rewrite the GitHub issue" in system:
+            return (
+                "Title: Synthetic rewritten title\n"
+                f"Description: Explains why the work matters. {padding}\n"
+                "Acceptance Criteria:\n"
+                "- The behaviour is covered by an automated test\n"
+                "- The change is documented\n"
+                "Not Applicable: False\n"
+            )
+        if json_mode:
+            rewrite = None
+            if not ready:
+                rewrite = {
+                    "title": "",
+                    "description": "",
+                    "acceptance_criteria": ["The behaviour is covered by an automated test"],
+                    "not_applicable": False,
+                }
+            return json.dumps(
+                {
+                    "summary": f"Synthetic analysis. {padding}",
+                    "completeness": {"title": True, "description": True, "acceptance_criteria": ready},
+                    "importance": "Keeps the benchmark realistic.",
+                    "acceptance_evaluation": "Criteria are testable." if ready else "Criteria are missing.",
+                    "labels": ["enhancement"],
+                    "ready_to_work": ready,
+                    "rewrite": rewrite,
+                }
+            )
+        decision = (
+            "Completeness:\n"
+            " - Title: Yes\n"
+            " - Description: Yes\n"
+            f" - Acceptance Criteria: {'Yes' if ready else 'No'}\n"
+            f"Ready to Work: {ready}\n"
+        )
+        details = (
+            f"Summary: Synthetic analysis. {padding}\n"
+            "Labels: enhancement, benchmark\n"
+            "Importance: Keeps the benchmark realistic.\n"
+            f"Acceptance Criteria Evaluation: {'Criteria are testable.' if ready else 'Criteria are missing.'}\n"
+        )
+        if system.find("Ready to Work:") < system.find("Summary:"):
+            return decision + details
+        return details + decision
+
+    def chat_completion(self, deployment: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        content = self.completion_content(request["messages"], json_mode)
+        prompt_tokens = sum(len(m.get("content") or "") for m in request["messages"]) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop", "logprobs": None}
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+
+    def _stream(self, completion: Dict[str, Any], include_usage: bool) -> Reply:
+        content = completion["choices"][0]["message"]["content"]
+
+        def event(choices: List[Dict[str, Any]], usage: Optional[Dict[str, Any]] = None) -> bytes:
+            chunk = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": choices,
+                "usage": usage,
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        chunks = []
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            delta = {"role": "assistant", "content": content[i : i + STREAM_CHUNK_CHARS]}
+            chunks.append(event([{"index": 0, "delta": delta, "finish_reason": None}]))
+        chunks.append(event([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if include_usage:
+            chunks.append(event([], completion["usage"]))
+        chunks.append(b"data: [DONE]\n\n")
+        return 200, {"Content-Type": "text/event-stream"}, chunks
+
+    def _upload(self, body: bytes, headers) -> Reply:
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+        )
+        content = next(part.get_payload(decode=True) for part in message.get_payload() if part.get_filename())
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = content
+        return json_reply(
+            {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": "requests.jsonl",
+                "purpose": "batch",
+                "status": "processed",
+            }
+        )
+
+    def _create_batch(self, request: Dict[str, Any]) -> Reply:
+        results, errors = [], []
+        for line in self.files[request["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if any(FILTERED_PHRASE in (message.get("content") or "") for message in item["body"]["messages"]):
+                status, lines = 400, errors
+                body = {"error": {"code": "content_filter", "message": "The prompt was filtered"}}
+            else:
+                status, lines = 200, results
+                body = self.chat_completion(item["body"]["model"], item["body"])
+            lines.append(
+                json.dumps(
+                    {
+                        "id": f"response-{len(results) + len(errors) + 1}",
+                        "custom_id": item["custom_id"],
+                        "response": {"status_code": status, "request_id": "benchmark", "body": body},
+                        "error": None,
+                    }
+                )
+            )
+        output_file_id = f"file-{len(self.files) + 1}"
+        self.files[output_file_id] = ("\n".join(results) + "\n").encode("utf-8")
+        error_file_id = None
+        if errors:
+            error_file_id = f"file-{len(self.files) + 1}"
+            self.files[error_file_id] = ("\n".join(errors) + "\n").encode("utf-8")
+        batch_id = f"batch-{len(self.batches) + 1}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "completion_window": request["completion_window"],
+            "input_file_id": request["input_file_id"],
+            "created_at": int(time.time()),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(results) + len(errors), "completed": 0, "failed": 0},
+            "_output_file_id": output_file_id,
+            "_error_file_id": error_file_id,
+            "_failed": len(errors),
+        }
+        return json_reply(self._public(self.batches[batch_id]))
+
+    def _poll_batch(self, batch_id: str) -> Reply:
+        # The first poll sees the batch in progress, later polls see it completed.
+        batch = self.batches[batch_id]
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        else:
+            batch["status"] = "completed"
+            batch["output_file_id"] = batch["_output_file_id"]
+            batch["error_file_id"] = batch["_error_file_id"]
+            batch["request_counts"]["failed"] = batch["_failed"]
+            batch["request_counts"]["completed"] = batch["request_counts"]["total"] - batch["_failed"]
+        return json_reply(self._public(batch))
+
+    @staticmethod
+    def _public(batch: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def handle(self, method, path, query, body, headers) -> Reply:
+        match = re.fullmatch(r"/openai/deployments/([^/]+)/chat/completions", path)
+        if match and method == "POST":
+            request = json.loads(body)
+            completion = self.chat_completion(match.group(1), request)
+            if request.get("stream"):
+                self.count("chat stream")
+                return self._stream(completion, bool((request.get("stream_options") or {}).get("include_usage")))
+            self.count("chat")
+            return json_reply(completion)
+        if path == "/openai/files" and method == "POST":
+            self.count("upload file")
+            return self._upload(body, headers)
+        match = re.fullmatch(r"/openai/files/([^/]+)/content", path)
+        if match and method == "GET":
+            self.count("download file")
+            return 200, {"Content-Type": "application/octet-stream"}, [self.files[match.group(1)]]
+        if path == "/openai/batches" and method == "POST":
+            self.count("create batch")
+            return self._create_batch(json.loads(body))
+        match = re.fullmatch(r"/openai/batches/([^/]+)", path)
+        if match and method == "GET":
+            self.count("get batch")
+            return self._poll_batch(match.group(1))
+        raise KeyError(path)
@@ -1,32 +1,207 @@
 import sys
+import time
+from typing import Dict
+from openai import APIConnectionError, AsyncAzureOpenAI, DefaultAsyncHttpxClient
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from semantic_kernel.contents import ChatHistory
 from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
 from semantic_kernel.functions.kernel_arguments import KernelArguments
+from completion_cache import completion_key
+from hedging import configure as configure_hedging, get_health, hedged, pick_endpoint
+from rate_limits import RateLimitScheduler, RetrySignal, exception_chain, lower_headers, retry_after_seconds
+import tracing
 
 API_VERSION = "2024-12-01-preview"
+MAIN_SERVICE_ID = "azure-openai"
+FAST_SERVICE_ID = "azure-openai-fast"
+SECONDARY_SUFFIX = "-secondary"
+AZURE_RATE = 10.0
+AZURE_BURST = 20
+AZURE_CONCURRENCY = 8
+AZURE_MAX_CONCURRENCY = 32
+# Azure quotas are per minute; remaining tokens are turned into calls with this rough size per call.
+QUOTA_WINDOW_SECONDS = 60
+TOKENS_PER_CALL_ESTIMATE = 2000
+
+_schedulers: Dict[str, RateLimitScheduler] = {}
+
+
+class Completion:
+    """A completion's text with its token usage; `cached_tokens` counts prompt tokens served from the prompt cache."""
+
+    def __init__(
+        self,
+        content: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+        from_cache: bool = False,
+    ):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+        self.from_cache = from_cache
+
+    @classmethod
+    def from_result(cls, result) -> "Completion":
+        usage = getattr(result.inner_content, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            result.content,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+        )
+
+
+class UsageTotals:
+    """Token usage summed over every completion made by this process."""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def add(self, completion: Completion) -> None:
+        self.calls += 1
+        self.prompt_tokens += completion.prompt_tokens
+        self.completion_tokens += completion.completion_tokens
+        self.cached_tokens += completion.cached_tokens
+
+    def stats_str(self) -> str:
+        share = self.cached_tokens * 100 / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (
+            f"{self.calls} calls, {self.prompt_tokens} prompt tokens "
+            f"({self.cached_tokens} from the prompt cache, {share:.0f}%), {self.completion_tokens} completion tokens"
+        )
+
+
+usage_totals = UsageTotals()
+
+
+def azure_retry_signal(error: BaseException) -> RetrySignal:
+    """Classify an error raised through Semantic Kernel by the openai error it wraps."""
+    for cause in exception_chain(error):
+        if isinstance(cause, APIConnectionError):
+            return False, None
+        response = getattr(cause, "response", None)
+        status = getattr(response, "status_code", None)
+        if status is None:
+            continue
+        retry_after = retry_after_seconds(getattr(response, "headers", None))
+        if status == 429:
+            return True, retry_after
+        if status == 408 or status >= 500:
+            return False, retry_after
+        return None
+    return None
+
+
+def get_scheduler(service_id: str) -> RateLimitScheduler:
+    """Return the process-wide scheduler for a chat service; each deployment has its own quota."""
+    scheduler = _schedulers.get(service_id)
+    if scheduler is None:
+        scheduler = _schedulers[service_id] = RateLimitScheduler(
+            f"Azure OpenAI ({service_id})",
+            azure_retry_signal,
+            AZURE_RATE,
+            AZURE_BURST,
+            AZURE_CONCURRENCY,
+            AZURE_MAX_CONCURRENCY,
+        )
+    return scheduler
+
+
+def scheduler_stats() -> Dict[str, str]:
+    return {service_id: scheduler.stats_str() for service_id, scheduler in _schedulers.items()}
+
+
+def _observe_quota(scheduler: RateLimitScheduler, headers) -> None:
+    headers = lower_headers(headers)
+    remaining = []
+    try:
+        if "x-ratelimit-remaining-requests" in headers:
+            remaining.append(int(headers["x-ratelimit-remaining-requests"]))
+        if "x-ratelimit-remaining-tokens" in headers:
+            remaining.append(int(headers["x-ratelimit-remaining-tokens"]) // TOKENS_PER_CALL_ESTIMATE)
+    except ValueError:
+        return
+    if remaining:
+        scheduler.observe(min(remaining), time.time() + QUOTA_WINDOW_SECONDS)
+
+
+def _build_client(api_key: str, endpoint: str, scheduler: RateLimitScheduler) -> AsyncAzureOpenAI:
+    async def on_response(response) -> None:
+        _observe_quota(scheduler, response.headers)
+
+    # The SDK's own retries are off so that every 429 reaches the scheduler.
+    return AsyncAzureOpenAI(
+        api_key=api_key,
+        azure_endpoint=endpoint,
+        api_version=API_VERSION,
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(event_hooks={"response": [on_response]}),
+    )
+
+
+def _chat_service(service_id: str, deployment: str, api_key: str, endpoint: str) -> AzureChatCompletion:
+    # The endpoint is carried by the client, so Semantic Kernel's https-only endpoint check does not apply.
+    return AzureChatCompletion(
+        service_id=service_id,
+        api_key=api_key,
+        deployment_name=deployment,
+        api_version=API_VERSION,
+        async_client=_build_client(api_key, endpoint, get_scheduler(service_id)),
+    )
+
 
 def initialize_kernel(inputs):
+    """Register the main deployment and, when configured, a fast tier for validation and secondary endpoints.
+
+    A secondary endpoint serves the same deployment names from another region and is used to hedge slow calls.
+    """
+    tiers = {MAIN_SERVICE_ID: inputs["azure_deployment"]}
+    if inputs.get("azure_validation_deployment"):
+        tiers[FAST_SERVICE_ID] = inputs["azure_validation_deployment"]
     kernel = Kernel()
     try:
-        kernel.add_service(
-            AzureChatCompletion(
-                service_id="azure-openai",
-                api_key=inputs["openai_api_key"],
-                endpoint=inputs["azure_endpoint"],
-                deployment_name=inputs["azure_deployment"],
-                api_version=API_VERSION
-            )
-        )
-        return kernel
+        with tracing.span("kernel.init", tiers=len(tiers)):
+            for service_id, deployment in tiers.items():
+                kernel.add_service(_chat_service(service_id, deployment, inputs["openai_api_key"], inputs["azure_endpoint"]))
+                if inputs.get("azure_secondary_endpoint"):
+                    kernel.add_service(
+                        _chat_service(
+                            service_id + SECONDARY_SUFFIX,
+                            deployment,
+                            inputs.get("azure_secondary_api_key") or inputs["openai_api_key"],
+                            inputs["azure_secondary_endpoint"],
+                        )
+                    )
+            configure_hedging(inputs.get("hedge_percentile"))
+            return kernel
     except Exception as e:
         print(f"Error initializing AzureChatCompletion: {e}", file=sys.stderr)
         sys.exit(1)
 
 
-async def run_completion(kernel, messages):
-    chat_service = kernel.get_service("azure-openai")
+def secondary_service_id(kernel, service_id: str):
+    secondary = service_id + SECONDARY_SUFFIX
+    return secondary if secondary in kernel.services else None
+
+
+def validation_service_id(kernel) -> str:
+    """The service validation runs on: the fast tier when one is registered, otherwise the main deployment."""
+    return FAST_SERVICE_ID if FAST_SERVICE_ID in kernel.services else MAIN_SERVICE_ID
+
+
+def deployment_name(kernel, service_id: str) -> str:
+    return kernel.get_service(service_id).ai_model_id
+
+
+def _build_history(messages) -> ChatHistory:
     history = ChatHistory()
     for msg in messages:
         role = msg.get("role")
@@ -35,11 +210,105 @@ async def run_completion(kernel, messages):
             history.add_system_message(content)
         elif role == "user":
             history.add_user_message(content)
-    settings = AzureChatPromptExecutionSettings()
-    result = await chat_service.get_chat_message_content(
-        chat_history=history,
-        settings=settings,
-        kernel=kernel,
-        kernel_arguments=KernelArguments()
-    )
-    return result.content
+        elif role == "assistant":
+            history.add_assistant_message(content)
+    return history
+
+
+def _record_usage(span, completion: Completion) -> None:
+    usage_totals.add(completion)
+    span.set("prompt_tokens", completion.prompt_tokens)
+    span.set("completion_tokens", completion.completion_tokens)
+    span.set("cached_tokens", completion.cached_tokens)
+
+
+async def run_completion(kernel, messages, cache=None, json_mode=False, service_id=MAIN_SERVICE_ID) -> Completion:
+    """Run one chat completion and return its text with the token usage reported by Azure OpenAI.
+
+    A hit in the local completion cache is returned with `from_cache` set and no token usage.
+    """
+    chat_service = kernel.get_service(service_id)
+    options = {"json_mode": True} if json_mode else {}
+    with tracing.span("azure.completion", service_id=service_id, deployment=chat_service.ai_model_id) as span:
+        key = None
+        if cache is not None:
+            key = completion_key(messages, chat_service.ai_model_id, API_VERSION, **options)
+            cached = cache.get(key)
+            if cached is not None:
+                span.set("from_cache", True)
+                return Completion(cached, from_cache=True)
+
+        async def complete(endpoint_service_id: str):
+            settings = AzureChatPromptExecutionSettings()
+            if json_mode:
+                settings.response_format = {"type": "json_object"}
+            return await get_scheduler(endpoint_service_id).call_async(
+                kernel.get_service(endpoint_service_id).get_chat_message_content,
+                chat_history=_build_history(messages),
+                settings=settings,
+                kernel=kernel,
+                kernel_arguments=KernelArguments()
+            )
+
+        result = await hedged(service_id, secondary_service_id(kernel, service_id), complete)
+        completion = Completion.from_result(result)
+        _record_usage(span, completion)
+    if cache is not None and completion.content:
+        cache.put(key, completion.content)
+    return completion
+
+
+async def stream_completion(kernel, messages, cache=None, service_id=MAIN_SERVICE_ID):
+    """Yield the completion text in chunks as it is generated. A cache hit is yielded as one chunk.
+
+    Streams are not hedged, but go to the secondary endpoint while the primary's circuit breaker is open,
+    and their latency and failures count towards that breaker like any other call.
+    """
+    chat_service = kernel.get_service(service_id)
+    key = None
+    if cache is not None:
+        key = completion_key(messages, chat_service.ai_model_id, API_VERSION)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    completion = Completion("")
+    endpoint_service_id = pick_endpoint(service_id, secondary_service_id(kernel, service_id))
+    health = get_health(endpoint_service_id)
+    started = time.monotonic()
+    # Not entered as the current span: a generator suspends between chunks, so the caller's spans stay current.
+    span = tracing.span("azure.stream_completion", service_id=endpoint_service_id, deployment=chat_service.ai_model_id)
+    try:
+        async for chunk in get_scheduler(endpoint_service_id).stream_async(
+            kernel.get_service(endpoint_service_id).get_streaming_chat_message_content,
+            chat_history=_build_history(messages),
+            settings=AzureChatPromptExecutionSettings(),
+            kernel=kernel,
+            kernel_arguments=KernelArguments()
+        ):
+            if chunk is None:
+                continue
+            # Usage arrives on the final chunk when the service reports it for streams.
+            if getattr(chunk.inner_content, "usage", None) is not None:
+                completion = Completion.from_result(chunk)
+            if chunk.content:
+                if not parts:
+                    span.set("first_chunk_ms", round(span.duration_ms, 1))
+                parts.append(chunk.content)
+                yield chunk.content
+    except BaseException as e:
+        # GeneratorExit and cancellation mean the caller stopped reading, not that the stream failed.
+        if isinstance(e, Exception):
+            health.breaker.record_failure()
+        else:
+            health.breaker.record_cancelled()
+        span.end(e if isinstance(e, Exception) else None)
+        raise
+    health.latency.record(time.monotonic() - started)
+    health.breaker.record_success()
+    _record_usage(span, completion)
+    span.end()
+    if cache is not None and parts:
+        cache.put(key, "".join(parts))
@@ -0,0 +1,245 @@
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+from openai_utils import run_completion, stream_completion, validation_service_id, deployment_name, MAIN_SERVICE_ID
+from github_utils import IssueMutation
+from async_github_utils import (
+    create_github_issue_comment,
+    apply_issue_mutation,
+    upsert_github_issue_comment,
+)
+from compaction import compact_issue_body, DEFAULT_TOKEN_BUDGET
+from fingerprint import FINGERPRINT_MARKER, issue_fingerprint, render_fingerprint
+from prompts import build_validation_message, build_rewrite_message, build_analysis_message, build_repair_message
+from responses import ValidationResponse, RewriteResponse, parse_analysis_response
+import tracing
+
+
+def compact_for_prompt(issue: Dict[str, Any], token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """Return a copy of the issue whose body is compacted for use in prompts."""
+    result = compact_issue_body(issue["body"], token_budget)
+    if result.saved_tokens > 0:
+        print(f"✂️ Compacted issue #{issue['number']} body: {result.as_str()}")
+    return {**issue, "body": result.text}
+
+
+async def post_comment(token: str, repo_full_name: str, issue_number: int, comment: str) -> None:
+    try:
+        await create_github_issue_comment(token, repo_full_name, issue_number, comment)
+    except Exception as e:
+        raise RuntimeError(f"Error posting comment: {type(e).__name__}: {e}") from e
+
+
+async def post_rewrite_comment(
+    inputs: Dict[str, Any], repo_full_name: str, issue: Dict[str, Any], rewrite: RewriteResponse
+) -> None:
+    """Post the rewrite comment; its fingerprint marks the run as finished."""
+    fingerprint = render_fingerprint(issue_fingerprint(issue["title"], issue["body"]))
+    comment = rewrite.as_markdown_str() + "\n" + fingerprint
+    await post_comment(inputs["github_token"], repo_full_name, issue["number"], comment)
+
+
+async def upsert_comment(token: str, repo_full_name: str, issue_number: int, comment: str) -> None:
+    """Write the bot's comment, found by its fingerprint marker, leaving it untouched when nothing changed."""
+    try:
+        result = await upsert_github_issue_comment(token, repo_full_name, issue_number, FINGERPRINT_MARKER, comment)
+    except Exception as e:
+        raise RuntimeError(f"Error posting comment: {type(e).__name__}: {e}") from e
+    if result == "unchanged":
+        print(f"⏭ Comment on issue #{issue_number} is already up to date")
+
+
+async def post_analysis(
+    inputs: Dict[str, Any],
+    repo_full_name: str,
+    issue: Dict[str, Any],
+    validation: ValidationResponse,
+    note: str = "",
+    rewrite: Optional[RewriteResponse] = None,
+) -> None:
+    """Post the analysis comment with the issue fingerprint and, with `apply_labels`, add the suggested labels.
+
+    With `upsert_comment` the bot's one comment on the issue is edited in place instead, and also carries `rewrite`.
+    The fingerprint notes when a rewrite is still due, so the run only counts as finished once it is posted.
+    """
+    token = inputs["github_token"]
+    rewrite_due = not validation.ready_to_work and rewrite is None
+    fingerprint = render_fingerprint(issue_fingerprint(issue["title"], issue["body"]), rewrite_due)
+    comment = note + validation.as_markdown_str()
+    if rewrite is not None:
+        comment += "\n---\n\n" + rewrite.as_markdown_str()
+    comment += "\n" + fingerprint
+    if inputs.get("upsert_comment"):
+        writes = [upsert_comment(token, repo_full_name, issue["number"], comment)]
+    else:
+        writes = [post_comment(token, repo_full_name, issue["number"], comment)]
+    if inputs.get("apply_labels") and validation.labels:
+        mutation = IssueMutation(repo_full_name, issue["number"]).add_labels(validation.labels)
+        writes.append(apply_issue_mutation(token, mutation))
+    results = await asyncio.gather(*writes)
+    if len(results) > 1 and results[1]:
+        print(f"🏷 Added suggested labels to issue #{issue['number']}: {', '.join(validation.labels)}")
+
+
+def log_route(kernel, issue: Dict[str, Any], step: str, service_id: str, reason: str) -> None:
+    print(f"🧭 {step} for issue #{issue['number']} → {service_id} ({deployment_name(kernel, service_id)}): {reason}")
+
+
+async def run_validation(kernel, issue: Dict[str, Any], cache=None) -> ValidationResponse:
+    """Validate on the fast tier when one is configured.
+
+    Escalates to the main deployment when the fast answer is missing a completeness item or the Ready to Work line.
+    """
+    messages = build_validation_message(issue["number"], issue["title"], issue["body"])
+    service_id = validation_service_id(kernel)
+    log_route(kernel, issue, "Validation", service_id, "first pass")
+    completion = await run_completion(kernel, messages, cache, service_id=service_id)
+    with tracing.span("parse.validation"):
+        validation = ValidationResponse(completion.content)
+    if service_id != MAIN_SERVICE_ID and not validation.decision_ready:
+        log_route(kernel, issue, "Validation", MAIN_SERVICE_ID, "escalated, the fast answer did not parse")
+        completion = await run_completion(kernel, messages, cache)
+        with tracing.span("parse.validation"):
+            validation = ValidationResponse(completion.content)
+    return validation
+
+
+async def run_combined_analysis(
+    kernel, issue: Dict[str, Any], cache=None
+) -> Tuple[ValidationResponse, Optional[RewriteResponse]]:
+    """Get the validation and the rewrite from one JSON completion, with a single repair retry."""
+    messages = build_analysis_message(issue["number"], issue["title"], issue["body"])
+    log_route(kernel, issue, "Combined analysis", MAIN_SERVICE_ID, "includes the rewrite")
+    raw = (await run_completion(kernel, messages, cache, json_mode=True)).content
+    try:
+        with tracing.span("parse.analysis"):
+            return parse_analysis_response(raw)
+    except ValueError as e:
+        print(f"🔁 Analysis for issue #{issue['number']} did not match the schema ({e}), asking for a repair")
+        messages = messages + [{"role": "assistant", "content": raw}, build_repair_message(str(e))]
+        raw = (await run_completion(kernel, messages, cache, json_mode=True)).content
+        with tracing.span("parse.analysis", repaired=True):
+            return parse_analysis_response(raw)
+
+
+async def run_rewrite(kernel, issue: Dict[str, Any], completeness: Dict[str, bool], cache=None) -> RewriteResponse:
+    messages = build_rewrite_message(issue["number"], issue["title"], issue["body"], completeness)
+    log_route(kernel, issue, "Rewrite", MAIN_SERVICE_ID, "rewrites always use the main deployment")
+    try:
+        completion = await run_completion(kernel, messages, cache)
+        with tracing.span("parse.rewrite"):
+            return RewriteResponse(completion.content)
+    except Exception as e:
+        raise RuntimeError(f"Error during rewrite: {type(e).__name__}: {e}") from e
+
+
+async def run_streaming_validation(
+    kernel, issue: Dict[str, Any], cache=None
+) -> Tuple[ValidationResponse, Optional["asyncio.Task[RewriteResponse]"]]:
+    """Stream the validation and start the rewrite as soon as the readiness decision is parsed.
+
+    Returns the validation and, for issues that are not ready, the rewrite task already in flight.
+    """
+    messages = build_validation_message(issue["number"], issue["title"], issue["body"], decision_first=True)
+    service_id = validation_service_id(kernel)
+    log_route(kernel, issue, "Validation", service_id, "first pass, streamed")
+    validation = ValidationResponse()
+    rewrite_task = None
+    try:
+        # Parsing is fed chunk by chunk, so this stage also covers the stream it waits on.
+        with tracing.span("stream.validation"):
+            async for chunk in stream_completion(kernel, messages, cache, service_id=service_id):
+                validation.feed(chunk)
+                if rewrite_task is None and validation.decision_ready and not validation.ready_to_work:
+                    print(f"⚡ Issue #{issue['number']} is not ready, starting the rewrite while the analysis streams")
+                    rewrite_task = asyncio.create_task(run_rewrite(kernel, issue, dict(validation.completeness), cache))
+            validation.close()
+    except BaseException:
+        if rewrite_task is not None:
+            rewrite_task.cancel()
+        raise
+    if service_id != MAIN_SERVICE_ID and not validation.decision_ready:
+        # No decision was parsed, so no rewrite was started either.
+        log_route(kernel, issue, "Validation", MAIN_SERVICE_ID, "escalated, the fast answer did not parse")
+        completion = await run_completion(kernel, messages, cache)
+        with tracing.span("parse.validation"):
+            validation = ValidationResponse(completion.content)
+    return validation, rewrite_task
+
+
+async def enhance_issue(
+    kernel, inputs: Dict[str, Any], issue: Dict[str, Any], cache=None, duplicates=None
+) -> ValidationResponse:
+    """Validate an issue, post the analysis and, if it is not ready, post a rewrite.
+
+    The rewrite completion runs while the analysis is being posted, and GitHub calls run
+    in worker threads so several issues can share one event loop. With a `duplicates` index,
+    a near-duplicate of an already analyzed issue reuses that validation without calling the model.
+    With `upsert_comment`, both are written to the bot's one comment once the rewrite is in.
+    Raises RuntimeError when a completion fails or cannot be parsed, or a comment cannot be posted.
+    """
+    with tracing.span("pipeline.enhance_issue", repo=inputs["repo_full_name"], issue=issue["number"]) as span:
+        repo_full_name = inputs["repo_full_name"]
+        rewrite = None
+        rewrite_task = None
+        note = ""
+        match = None
+        if duplicates is not None:
+            match = duplicates.find(repo_full_name, issue)
+        # Prompts see the compacted body; the fingerprint is still taken from the original.
+        prompt_issue = compact_for_prompt(issue, inputs.get("prompt_token_budget", DEFAULT_TOKEN_BUDGET))
+
+        # Step 1: Run validation, together with the rewrite in combined mode
+        try:
+            if match is not None:
+                print(f"🔁 Issue #{issue['number']} matches {match.key} ({match.similarity:.0%}), reusing its analysis")
+                validation = ValidationResponse.from_dict(match.validation)
+                note = match.as_markdown_note(repo_full_name) + "\n"
+            elif inputs.get("combined_analysis"):
+                validation, rewrite = await run_combined_analysis(kernel, prompt_issue, cache)
+            elif inputs.get("stream_validation"):
+                validation, rewrite_task = await run_streaming_validation(kernel, prompt_issue, cache)
+            else:
+                validation = await run_validation(kernel, prompt_issue, cache)
+        except Exception as e:
+            raise RuntimeError(f"Error during validation: {type(e).__name__}: {e}") from e
+        span.set("ready_to_work", validation.ready_to_work)
+        if match is not None:
+            span.set("duplicate_of", match.key)
+
+        def remember() -> None:
+            if duplicates is not None and match is None:
+                duplicates.add(repo_full_name, issue, validation.as_dict())
+
+        try:
+            # Get the rewrite generating before the analysis is posted, so both overlap.
+            if not validation.ready_to_work and rewrite is None and rewrite_task is None:
+                # A reused analysis still needs a rewrite of this issue's own text: the duplicate's rewrite
+                # would quote its versions and line numbers, which the similarity check ignores.
+                rewrite_task = asyncio.create_task(run_rewrite(kernel, prompt_issue, validation.completeness, cache))
+
+            if inputs.get("upsert_comment"):
+                # One comment carries both sections, so it is written once the rewrite is in.
+                if rewrite_task is not None:
+                    rewrite = await rewrite_task
+                remember()
+                await post_analysis(
+                    inputs, repo_full_name, issue, validation, note, None if validation.ready_to_work else rewrite
+                )
+                return validation
+
+            await post_analysis(inputs, repo_full_name, issue, validation, note)
+
+            if validation.ready_to_work:
+                remember()
+                return validation
+
+            # Step 2: Wait for the rewrite, unless the combined analysis already returned one
+            if rewrite_task is not None:
+                rewrite = await rewrite_task
+            remember()
+        finally:
+            if rewrite_task is not None and not rewrite_task.done():
+                rewrite_task.cancel()
+
+        await post_rewrite_comment(inputs, repo_full_name, issue, rewrite)
+        return validation
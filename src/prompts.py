@@ -1,50 +1,118 @@
+import json
 from typing import Dict
 
 SYSTEM_PROMPT = "You are a helpful assistant that analyzes GitHub issues using natural language."
 
-def build_validation_message(issue_id: str, issue_title: str, issue_body: str) -> list:
-    prompt = (
-        f"Given the following GitHub issue:\n"
+REVIEW_INSTRUCTIONS = (
+    "Review the GitHub issue in the user message as a potential user story for engineering work. In your response:\n"
+    "1. Provide an AI-enhanced summary or insight about the story.\n"
+    "2. Confirm whether the following elements are present. **Only respond with 'Yes' or 'No' for each item:**\n"
+    "   - A title\n"
+    "   - A description\n"
+    "   - Acceptance criteria\n"
+    "3. Evaluate the clarity and completeness of the description. Does it explain why the story matters (e.g. business value, customer need, technical dependency)?\n"
+    "4. Analyze the acceptance criteria. Are they clear, specific, and testable via automated testing?\n"
+    "   - If you believe the acceptance criteria are not automatable, provide a warning with suggestions for making them testable.\n"
+    "5. Suggest up to 3 relevant GitHub labels (such as 'bug', 'good first issue', 'enhancement', etc.) as a comma-separated list.\n"
+    "6. Based on your analysis, provide a final Boolean judgment of whether this story is ready to be worked. Assume 'ready' means: all required elements are present, purpose is clear, and acceptance criteria are testable.\n\n"
+)
+
+ANALYSIS_SCHEMA = {
+    "summary": "<your insight>",
+    "completeness": {"title": True, "description": True, "acceptance_criteria": False},
+    "importance": "<brief assessment of why the story matters>",
+    "acceptance_evaluation": "<analysis + any testability warning>",
+    "labels": ["<label>"],
+    "ready_to_work": False,
+    "rewrite": {
+        "title": "<rewritten title, or empty string if the title is present>",
+        "description": "<expanded explanation, or empty string if the description is present>",
+        "acceptance_criteria": ["<criterion one>", "<criterion two>"],
+        "not_applicable": False,
+    },
+}
+
+VALIDATION_FORMAT = (
+    "Summary: <your insight>\n"
+    "Completeness:\n"
+    " - Title: Yes\n"
+    " - Description: Yes\n"
+    " - Acceptance Criteria: No\n"
+    "Importance: <Brief assessment of why the story matters>\n"
+    "Acceptance Criteria Evaluation: <Analysis + any testability warning>\n"
+    "Labels: <comma-separated label list>\n"
+    "Ready to Work: <True/False>"
+)
+
+# Same fields with the decision first, so a streamed response can be acted on
+# before the long evaluation text has been generated.
+DECISION_FIRST_FORMAT = (
+    "Completeness:\n"
+    " - Title: Yes\n"
+    " - Description: Yes\n"
+    " - Acceptance Criteria: No\n"
+    "Ready to Work: <True/False>\n"
+    "Summary: <your insight>\n"
+    "Labels: <comma-separated label list>\n"
+    "Importance: <Brief assessment of why the story matters>\n"
+    "Acceptance Criteria Evaluation: <Analysis + any testability warning>"
+)
+
+
+# Every prompt is laid out as a fixed system message (role, instructions and output format)
+# followed by the issue itself, so the long shared prefix is identical across issues and can
+# be served from the provider's prompt cache.
+REWRITE_INSTRUCTIONS = (
+    "Rewrite the GitHub issue in the user message, which appears incomplete and is not yet ready to be worked, "
+    "into a well-formed user story for engineering. The user message lists which elements to write and the exact "
+    "format to answer in.\n"
+    "If you are unable to confidently generate any missing core elements, return:\n"
+    "   Not Applicable: True\n"
+)
+
+ANALYSIS_INSTRUCTIONS = (
+    "7. If the story is not ready to be worked, rewrite it into a well-formed user story: propose an improved title "
+    "only if the title is missing, a meaningful description explaining why the work matters only if the description "
+    "is missing, and specific, testable acceptance criteria only if they are missing. Use an empty string or empty "
+    "list for elements that are already present. If you cannot confidently generate the missing elements, set "
+    "\"not_applicable\" to true. If the story is ready, set \"rewrite\" to null.\n\n"
+    "Respond with a single JSON object and nothing else, using exactly these keys:\n"
+    f"{json.dumps(ANALYSIS_SCHEMA, indent=2)}"
+)
+
+
+def _validation_system_prompt(decision_first: bool) -> str:
+    return (
+        SYSTEM_PROMPT
+        + "\n\n"
+        + REVIEW_INSTRUCTIONS
+        + "Format your response like this (do not include explanations in the 'Completeness' section):\n"
+        + (DECISION_FIRST_FORMAT if decision_first else VALIDATION_FORMAT)
+    )
+
+
+VALIDATION_SYSTEM_PROMPT = _validation_system_prompt(decision_first=False)
+DECISION_FIRST_SYSTEM_PROMPT = _validation_system_prompt(decision_first=True)
+REWRITE_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n\n" + REWRITE_INSTRUCTIONS
+ANALYSIS_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n\n" + REVIEW_INSTRUCTIONS + ANALYSIS_INSTRUCTIONS
+
+
+def format_issue(issue_id: str, issue_title: str, issue_body: str) -> str:
+    return (
+        "GitHub issue:\n"
         f"ID: {issue_id}\n"
         f"Title: {issue_title}\n"
-        f"Body: {issue_body}\n\n"
-        "Review this issue as a potential user story for engineering work. In your response:\n"
-        "1. Provide an AI-enhanced summary or insight about the story.\n"
-        "2. Confirm whether the following elements are present. **Only respond with 'Yes' or 'No' for each item:**\n"
-        "   - A title\n"
-        "   - A description\n"
-        "   - Acceptance criteria\n"
-        "3. Evaluate the clarity and completeness of the description. Does it explain why the story matters (e.g. business value, customer need, technical dependency)?\n"
-        "4. Analyze the acceptance criteria. Are they clear, specific, and testable via automated testing?\n"
-        "   - If you believe the acceptance criteria are not automatable, provide a warning with suggestions for making them testable.\n"
-        "5. Suggest up to 3 relevant GitHub labels (such as 'bug', 'good first issue', 'enhancement', etc.) as a comma-separated list.\n"
-        "6. Based on your analysis, provide a final Boolean judgment of whether this story is ready to be worked. Assume 'ready' means: all required elements are present, purpose is clear, and acceptance criteria are testable.\n\n"
-        "Format your response like this (do not include explanations in the 'Completeness' section):\n"
-        "Summary: <your insight>\n"
-        "Completeness:\n"
-        " - Title: Yes\n"
-        " - Description: Yes\n"
-        " - Acceptance Criteria: No\n"
-        "Importance: <Brief assessment of why the story matters>\n"
-        "Acceptance Criteria Evaluation: <Analysis + any testability warning>\n"
-        "Labels: <comma-separated label list>\n"
-        "Ready to Work: <True/False>"
+        f"Body: {issue_body}"
     )
 
+
+def build_validation_message(issue_id: str, issue_title: str, issue_body: str, decision_first: bool = False) -> list:
     return [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": prompt},
+        {"role": "system", "content": DECISION_FIRST_SYSTEM_PROMPT if decision_first else VALIDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": format_issue(issue_id, issue_title, issue_body)},
     ]
 
 def build_rewrite_message(issue_id: str, issue_title: str, issue_body: str, incomplete_parts: Dict[str, bool]) -> list:
-    prompt = (
-        f"The following GitHub issue appears incomplete and is not yet ready to be worked:\n"
-        f"ID: {issue_id}\n"
-        f"Title: {issue_title}\n"
-        f"Body: {issue_body}\n\n"
-        "As an AI assistant, help rewrite this issue into a well-formed user story for engineering.\n"
-    )
-
     # Conditional instructions based on what’s missing
     sections = []
     if not incomplete_parts.get("title", True):
@@ -55,15 +123,11 @@ def build_rewrite_message(issue_id: str, issue_title: str, issue_body: str, inco
         sections.append("3. Provide specific and testable **acceptance criteria**.")
 
     if sections:
-        prompt += "\n".join(sections) + "\n"
+        prompt = "\n".join(sections) + "\n"
     else:
-        prompt += "All core elements are sufficiently present. No rewrite necessary.\n"
+        prompt = "All core elements are sufficiently present. No rewrite necessary.\n"
 
-    prompt += (
-        "\nIf you are unable to confidently generate any missing core elements, return:\n"
-        "   Not Applicable: True\n\n"
-        "Format your response like this:\n"
-    )
+    prompt += "\nFormat your response like this:\n"
 
     # Format section based on missing fields
     if not incomplete_parts.get("title", True):
@@ -78,9 +142,28 @@ def build_rewrite_message(issue_id: str, issue_title: str, issue_body: str, inco
             "- <etc...>\n"
         )
 
-    prompt += "Not Applicable: <True/False>"
+    prompt += "Not Applicable: <True/False>\n\n"
 
     return [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": prompt},
+        {"role": "system", "content": REWRITE_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt + format_issue(issue_id, issue_title, issue_body)},
     ]
+
+
+def build_analysis_message(issue_id: str, issue_title: str, issue_body: str) -> list:
+    """Build a single prompt that returns the validation and, when needed, the rewrite as JSON."""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": format_issue(issue_id, issue_title, issue_body)},
+    ]
+
+
+def build_repair_message(error: str) -> Dict[str, str]:
+    """Build the follow-up user message asking the model to fix a malformed JSON analysis."""
+    return {
+        "role": "user",
+        "content": (
+            f"Your previous reply could not be used: {error}\n"
+            "Reply again with only the corrected JSON object, using exactly the keys requested."
+        ),
+    }
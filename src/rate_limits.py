@@ -0,0 +1,273 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Iterator, Mapping, Optional, Tuple
+import tracing
+
+DEFAULT_MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+MAX_RETRY_AFTER_SECONDS = 900.0
+SLOT_POLL_SECONDS = 0.05
+# Calls run at the full rate until the reported quota drops below this share of its limit, or below
+# LOW_WATER_CALLS when the server does not report the limit; only then is the rest spread until the reset.
+LOW_WATER_FRACTION = 0.1
+LOW_WATER_CALLS = 100
+
+# A classifier maps an exception to None (not retryable) or to (throttled, retry_after_seconds).
+# Throttled errors shrink concurrency; other retryable errors (5xx, dropped connections) only back off.
+RetrySignal = Optional[Tuple[bool, Optional[float]]]
+
+
+def lower_headers(headers: Optional[Mapping[str, Any]]) -> dict:
+    return {str(name).lower(): value for name, value in (headers or {}).items()}
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, Any]]) -> Optional[float]:
+    """Read `retry-after-ms` or `retry-after` (seconds or an HTTP date) from response headers."""
+    headers = lower_headers(headers)
+    try:
+        if "retry-after-ms" in headers:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        if "retry-after" in headers:
+            value = str(headers["retry-after"])
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def exception_chain(error: BaseException) -> Iterator[BaseException]:
+    """Yield an exception and everything it was raised from, so wrapped SDK errors can be inspected."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+class TokenBucket:
+    """Allows `rate` calls per second with bursts of up to `capacity`.
+
+    Tokens may go negative: `reserve` takes a token immediately and returns how long
+    the caller has to wait for it, so sync and async callers share one bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def reserve(self, cost: float = 1.0) -> float:
+        with self._lock:
+            self._refill()
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for at least `seconds`, e.g. after a Retry-After."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on calls in flight: +1 after a full window of successes, halved when throttled."""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class RateLimitScheduler:
+    """Paces calls to one rate-limited resource and retries throttled or transient failures.
+
+    Calls draw from a token bucket, run under an AIMD concurrency limit and are retried
+    with jittered exponential backoff, honouring the server's Retry-After when it sends one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        classify: Callable[[BaseException], RetrySignal],
+        rate: float,
+        burst: float,
+        concurrency: int,
+        max_concurrency: int,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.name = name
+        self.classify = classify
+        self.default_rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveConcurrency(concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.retries = 0
+        self.throttled = 0
+
+    def retry_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Return how long to wait before retrying `error`, or None when it should be raised."""
+        signal = self.classify(error)
+        if signal is None or attempt >= self.max_retries:
+            return None
+        throttled, retry_after = signal
+        if retry_after is not None and retry_after > MAX_RETRY_AFTER_SECONDS:
+            return None
+        self.retries += 1
+        tracing.add("retries")
+        delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2**attempt))
+        if throttled:
+            self.throttled += 1
+            self.limiter.on_throttle()
+        if retry_after is not None:
+            # The paused bucket holds back this retry and every other caller; only add jitter here.
+            self.bucket.pause(retry_after)
+            delay = random.uniform(0, BASE_BACKOFF_SECONDS)
+        print(
+            f"⏳ {self.name} {'throttled' if throttled else 'failed'} ({type(error).__name__}), "
+            f"retrying in {delay + (retry_after or 0):.1f}s (attempt {attempt + 1} of {self.max_retries})",
+            file=sys.stderr,
+        )
+        return delay
+
+    def _reserve(self) -> float:
+        """Take a token for one attempt and return how long to wait for it; both are recorded on the current span.
+
+        An attempt is counted as one scheduled call, however many HTTP requests it ends up making: a paged
+        listing makes several, and a call that only builds a lazy handle makes none.
+        """
+        wait = self.bucket.reserve()
+        tracing.add("scheduled_calls")
+        if wait:
+            tracing.add("throttle_wait_ms", wait * 1000)
+        return wait
+
+    def observe(self, remaining: Optional[int], reset_at: Optional[float], limit: Optional[int] = None) -> None:
+        """Once the quota reported by the server runs low, spread what is left over the time until it resets."""
+        if remaining is None or reset_at is None:
+            return
+        low_water = limit * LOW_WATER_FRACTION if limit else LOW_WATER_CALLS
+        seconds_left = reset_at - time.time()
+        if remaining > low_water or seconds_left <= 0:
+            self.bucket.set_rate(self.default_rate)
+        else:
+            self.bucket.set_rate(min(self.default_rate, max(remaining, 1) / seconds_left))
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                time.sleep(self._reserve())
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async()
+            try:
+                await asyncio.sleep(self._reserve())
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def stream_async(self, fn: Callable[..., AsyncIterator[Any]], *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        """Iterate a streamed response; it is only retried while nothing has been yielded yet."""
+        attempt = 0
+        while True:
+            yielded = False
+            await self.limiter.acquire_async()
+            try:
+                await asyncio.sleep(self._reserve())
+                async for item in fn(*args, **kwargs):
+                    yielded = True
+                    yield item
+            except Exception as e:
+                delay = None if yielded else self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                self.limiter.on_success()
+                return
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats_str(self) -> str:
+        return (
+            f"{self.retries} retries, {self.throttled} throttled, "
+            f"concurrency {int(self.limiter.limit)}, {self.bucket.rate:.2f} calls/s"
+        )
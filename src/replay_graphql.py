@@ -0,0 +1,72 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import List
+from github_graphql import GraphQLError, get_graphql_client, list_org_open_issues
+from mock_servers import MockGitHub, MockSettings
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.normpath(os.path.join(SRC_DIR, "..", "fixtures", "graphql"))
+EXPECTED_FILE = "expected.json"
+TOKEN = "replay-github-token"
+
+
+def replay(fixtures_dir: str) -> List[str]:
+    """Sweep an organization's open issues against the stand-in GitHub server, answering from recorded pages.
+
+    Every `*.json` file in `fixtures_dir` is a page of the form {"variables": {...}, "response": {...}}, served only
+    to a query with the same variables, cursor included. `expected.json` names the organization and the
+    repositories, issues, page count and rateLimit cost the sweep must come to. Returns every mismatch.
+    """
+    with open(os.path.join(fixtures_dir, EXPECTED_FILE)) as f:
+        expected = json.load(f)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.json"))):
+        if os.path.basename(path) != EXPECTED_FILE:
+            with open(path) as f:
+                pages.append(json.load(f))
+
+    github = MockGitHub(MockSettings()).start()
+    github.load_graphql(pages)
+    # The client reads its URL when it is first created.
+    os.environ["GITHUB_GRAPHQL_URL"] = github.url + "/graphql"
+    mismatches = []
+    issues = []
+    try:
+        issues = list(list_org_open_issues(TOKEN, expected["org"]))
+    except GraphQLError as e:
+        mismatches.append(f"the sweep failed: {e}")
+    finally:
+        github.stop()
+
+    client = get_graphql_client(TOKEN)
+    repositories = list(dict.fromkeys(issue["repo_full_name"] for issue in issues))
+    actual = {
+        "repositories": repositories,
+        "issues": [f"{issue['repo_full_name']}#{issue['number']}" for issue in issues],
+        # Queries for pages that were not recorded, e.g. a skipped repository or a wrong cursor, count here too.
+        "pages": github.calls["POST graphql"],
+        "cost": client.cost,
+        "remaining": client.remaining,
+    }
+    for name, value in actual.items():
+        if value != expected[name]:
+            mismatches.append(f"{name}: got {value}, expected {expected[name]}")
+    print(f"📄 {len(pages)} recorded pages, {len(issues)} issues, GraphQL {client.stats_str()}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the GraphQL organization sweep against recorded pages served by the stand-in GitHub server."
+    )
+    parser.add_argument("fixtures", nargs="?", default=DEFAULT_FIXTURES, help="Directory of recorded pages")
+    args = parser.parse_args()
+    mismatches = replay(args.fixtures)
+    for mismatch in mismatches:
+        print(f"❌ {mismatch}", file=sys.stderr)
+    if not mismatches:
+        print("✅ The sweep matched the recorded pages")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_URL = "http://127.0.0.1:8080/"
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.normpath(os.path.join(SRC_DIR, "..", "fixtures", "webhooks"))
+IN_PROCESS_SECRET = "replay-webhook-secret"
+IN_PROCESS_QUIET_SECONDS = 1.0
+IN_PROCESS_TIMEOUT_SECONDS = 60.0
+
+
+def sign(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def deliver(url: str, secret: str, recorded: Dict[str, Any]) -> Tuple[int, str]:
+    """POST one recorded delivery, signed with `secret`, and return the reply's status and body."""
+    body = json.dumps(recorded["payload"]).encode("utf-8")
+    request = urllib.request.Request(
+        url,
+        data=body,
+        method="POST",
+        headers={
+            "Content-Type": "application/json",
+            "X-GitHub-Event": recorded["event"],
+            "X-Hub-Signature-256": sign(secret, body),
+        },
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+
+def replay(url: str, secret: str, paths: List[str]) -> int:
+    """Re-send recorded deliveries, each a JSON file of {"event": ..., "payload": {...}}, to a running server.
+
+    A delivery may also name the status it `expect`s in the reply, "queued" or "ignored".
+    Returns the number of deliveries that were not accepted or got another status than expected.
+    """
+    failures = 0
+    for path in paths:
+        with open(path) as f:
+            recorded = json.load(f)
+        started = time.monotonic()
+        status, reply = deliver(url, secret, recorded)
+        elapsed = (time.monotonic() - started) * 1000
+        print(f"{status} {elapsed:6.1f} ms  {path}: {reply}")
+        expected = recorded.get("expect")
+        if status >= 300 or (expected and json.loads(reply).get("status") != expected):
+            failures += 1
+    return failures
+
+
+def replay_in_process(paths: List[str]) -> List[str]:
+    """Replay the deliveries twice against a server started on a free port, backed by stand-in servers.
+
+    The stand-in GitHub server holds the repository and issue the deliveries name. The second round
+    arrives within the quiet window, so each queued job must be merged with its repeat. A delivery
+    signed with the wrong secret must be refused. Returns every mismatch, including failed jobs.
+    """
+    from main import read_pipeline_options
+    from mock_servers import MockAzureOpenAI, MockGitHub, MockSettings
+    from server import EnhancerServer, make_handler
+
+    deliveries = []
+    for path in paths:
+        with open(path) as f:
+            deliveries.append(json.load(f))
+    issue = next(d["payload"]["issue"] for d in deliveries if "issue" in d["payload"])
+    github = MockGitHub(MockSettings(), deliveries[0]["payload"]["repository"]["full_name"]).start()
+    github.load([{"number": issue["number"], "title": issue["title"], "body": issue["body"], "comments": []}])
+    azure = MockAzureOpenAI(MockSettings()).start()
+    # The GitHub client reads its URL when it is first created.
+    os.environ["GITHUB_API_URL"] = github.url
+    inputs = {
+        "github_token": "replay-github-token",
+        "openai_api_key": "replay-openai-key",
+        "azure_endpoint": azure.url + "/",
+        "azure_deployment": "replay",
+        **read_pipeline_options(),
+    }
+    queued = sum(1 for d in deliveries if d.get("expect") == "queued")
+    mismatches = []
+
+    async def run() -> Dict[str, Any]:
+        server = EnhancerServer(inputs, quiet_seconds=IN_PROCESS_QUIET_SECONDS)
+        await server.start()
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(server, IN_PROCESS_SECRET))
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{httpd.server_address[1]}/"
+        try:
+            for _ in range(2):
+                failures = await asyncio.to_thread(replay, url, IN_PROCESS_SECRET, paths)
+                if failures:
+                    mismatches.append(f"{failures} deliveries were not answered as expected")
+            status, reply = await asyncio.to_thread(deliver, url, "not-the-secret", deliveries[0])
+            if status != 401:
+                mismatches.append(f"a delivery with a bad signature got {status} {reply}")
+            deadline = time.monotonic() + IN_PROCESS_TIMEOUT_SECONDS
+            while server.metrics["processed"] + server.metrics["failed"] < queued:
+                if time.monotonic() > deadline:
+                    mismatches.append(f"the jobs did not finish within {IN_PROCESS_TIMEOUT_SECONDS:g}s")
+                    break
+                await asyncio.sleep(0.1)
+            return server.snapshot()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    try:
+        snapshot = asyncio.run(run())
+    finally:
+        github.stop()
+        azure.stop()
+    expected = {"accepted": 2 * queued, "merged": queued, "processed": queued, "failed": 0}
+    for name, value in expected.items():
+        if snapshot[name] != value:
+            mismatches.append(f"{name}: got {snapshot[name]}, expected {value}")
+    if not github.calls["POST comment"]:
+        mismatches.append(f"no comment was posted on issue #{issue['number']}")
+    print(f"📊 Server metrics: {json.dumps({name: snapshot[name] for name in ('received', *expected)})}")
+    print(f"📊 GitHub calls: {dict(github.calls)}, Azure OpenAI calls: {dict(azure.calls)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded GitHub webhook deliveries against the webhook server.")
+    parser.add_argument("paths", nargs="*", help="Recorded delivery files (default fixtures/webhooks/*.json)")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--secret", default=os.getenv("INPUT_WEBHOOK_SECRET"))
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Start the server on a free port against stand-in GitHub and Azure OpenAI servers instead of using --url",
+    )
+    args = parser.parse_args()
+    paths = args.paths or sorted(glob.glob(os.path.join(DEFAULT_FIXTURES, "*.json")))
+    if args.in_process:
+        mismatches = replay_in_process(paths)
+        for mismatch in mismatches:
+            print(f"❌ {mismatch}", file=sys.stderr)
+        if not mismatches:
+            print("✅ The server handled the recorded deliveries")
+        sys.exit(1 if mismatches else 0)
+    sys.exit(1 if replay(args.url, args.secret or "", paths) else 0)
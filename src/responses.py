@@ -1,57 +1,116 @@
-from typing import Dict, Any, List
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+# Rewrite comments end with the rewrite as hidden JSON, so applying it needs no markdown parsing.
+REWRITE_STATE_MARKER = "issue-enhancer:rewrite"
+REWRITE_STATE_VERSION = 1
+_REWRITE_STATE_PREFIX = f"<!-- {REWRITE_STATE_MARKER} "
+_REWRITE_STATE_SUFFIX = " -->"
+
+
+def without_rewrite_state(comment_body: str) -> str:
+    """Remove every embedded rewrite state, leaving only the markdown a reader sees."""
+    while True:
+        start = comment_body.find(_REWRITE_STATE_PREFIX)
+        end = comment_body.find(_REWRITE_STATE_SUFFIX, start) if start != -1 else -1
+        if end == -1:
+            return comment_body
+        comment_body = comment_body[:start] + comment_body[end + len(_REWRITE_STATE_SUFFIX) :]
+
 
 class ValidationResponse:
-    def __init__(self, response: str):
-        self.response = response
+    def __init__(self, response: str = ""):
+        self.response = ""
         self.summary: str = ""
         self.labels: List[str] = []
         self.completeness: Dict[str, bool] = {}
         self.importance: str = ""
         self.acceptance_evaluation: str = ""
         self.ready_to_work: bool = False
+        self.ready_to_work_found: bool = False
+
+        self._chunks: List[str] = []
+        self._pending = ""
+        self._evaluation: List[str] = []
+        self._parsing_evaluation = False
 
         # Parse response during initialization
-        buffer = ""
-        parsing_evaluation = False
+        self.feed(response)
+        self.close()
 
-        for line in self.response.splitlines():
-            lower = line.lower().strip()
-            
-            if lower.startswith("summary:"):
-                self.summary = line[len("summary:") :].strip()
-            elif lower.startswith("labels:"):
-                self.labels = [
-                    l.strip() for l in line[len("labels:") :].split(",") if l.strip()
-                ]
-            elif lower.startswith("- title:"):
-                self.completeness["title"] = line.split(":")[1].strip().lower() == "yes"
-            elif lower.startswith("- description:"):
-                self.completeness["description"] = (
-                    line.split(":")[1].strip().lower() == "yes"
-                )
-            elif lower.startswith("- acceptance criteria:"):
-                self.completeness["acceptance_criteria"] = (
-                    line.split(":")[1].strip().lower() == "yes"
-                )
-            elif lower.startswith("importance:"):
-                self.importance = line[len("importance:") :].strip()
-            elif lower.startswith("acceptance criteria evaluation:"):
-                parsing_evaluation = True
-                buffer = line[len("acceptance criteria evaluation:") :].strip()
-            elif lower.startswith("ready to work:"):
-                self.ready_to_work = (
-                    line[len("ready to work:") :].strip().lower() == "true"
-                )
-            elif parsing_evaluation:
-                if lower.startswith("labels:") or lower.startswith("ready to work:"):
-                    parsing_evaluation = False
-                else:
-                    buffer += "\n" + line.strip()
-
-        # finalize buffered content
-        if buffer:
-            self.acceptance_evaluation = buffer.strip()
-            
+    @property
+    def decision_ready(self) -> bool:
+        """True once every completeness item and the Ready to Work line have been parsed."""
+        return self.ready_to_work_found and all(
+            key in self.completeness for key in ("title", "description", "acceptance_criteria")
+        )
+
+    def feed(self, text: str) -> None:
+        """Parse streamed text incrementally; complete lines update the fields right away.
+
+        `response` and the multi-line `acceptance_evaluation` are filled in by close().
+        """
+        if text:
+            self._chunks.append(text)
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._parse_line(line.rstrip("\r"))
+
+    def close(self) -> None:
+        """Parse any trailing partial line once the response is complete and assemble the full text."""
+        if self._pending:
+            self._parse_line(self._pending.rstrip("\r"))
+            self._pending = ""
+        # Text is joined once here rather than on every chunk or line, which was quadratic for long quoted logs.
+        if self._chunks:
+            self.response = "".join(self._chunks)
+        if self._evaluation:
+            self.acceptance_evaluation = "\n".join(self._evaluation).strip()
+
+    def _parse_line(self, line: str) -> None:
+        lower = line.lower().strip()
+
+        if lower.startswith("summary:"):
+            self.summary = line[len("summary:") :].strip()
+        elif lower.startswith("labels:"):
+            self.labels = [
+                l.strip() for l in line[len("labels:") :].split(",") if l.strip()
+            ]
+        elif lower.startswith("- title:"):
+            self.completeness["title"] = line.split(":")[1].strip().lower() == "yes"
+        elif lower.startswith("- description:"):
+            self.completeness["description"] = (
+                line.split(":")[1].strip().lower() == "yes"
+            )
+        elif lower.startswith("- acceptance criteria:"):
+            self.completeness["acceptance_criteria"] = (
+                line.split(":")[1].strip().lower() == "yes"
+            )
+        elif lower.startswith("importance:"):
+            self.importance = line[len("importance:") :].strip()
+        elif lower.startswith("acceptance criteria evaluation:"):
+            self._parsing_evaluation = True
+            self._evaluation = [line[len("acceptance criteria evaluation:") :].strip()]
+        elif lower.startswith("ready to work:"):
+            self.ready_to_work = (
+                line[len("ready to work:") :].strip().lower() == "true"
+            )
+            self.ready_to_work_found = True
+        elif self._parsing_evaluation:
+            self._evaluation.append(line.strip())
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ValidationResponse":
+        """Create a ValidationResponse from an already-parsed analysis object."""
+        instance = cls(response="")
+        instance.summary = data.get("summary", "")
+        instance.labels = list(data.get("labels", []))
+        instance.completeness = dict(data.get("completeness", {}))
+        instance.importance = data.get("importance", "")
+        instance.acceptance_evaluation = data.get("acceptance_evaluation", "")
+        instance.ready_to_work = bool(data.get("ready_to_work", False))
+        return instance
 
     def as_dict(self) -> Dict[str, Any]:
         return {
@@ -106,6 +165,16 @@ class RewriteResponse:
                     line[len("not applicable:"):].strip().lower() == "true"
                 )
                 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RewriteResponse":
+        """Create a RewriteResponse from an already-parsed rewrite object."""
+        instance = cls(response="")
+        instance.title = data.get("title", "")
+        instance.description = data.get("description", "")
+        instance.acceptance_criteria = list(data.get("acceptance_criteria", []))
+        instance.not_applicable = bool(data.get("not_applicable", False))
+        return instance
+
     def normalize_text(text: str) -> str:
         # Lowercase, strip whitespace and markdown-like underscores or asterisks
         return text.lower().strip(" _*")
@@ -129,6 +198,7 @@ class RewriteResponse:
             return (
                 "❌ **AI Rewrite Not Applicable**\n\n"
                 "The AI has determined that this issue is not suitable for rewriting.\n"
+                f"{self.as_state_str()}\n"
             )
 
         return (
@@ -139,11 +209,49 @@ class RewriteResponse:
             f"{section_list(self.acceptance_criteria)}\n"
             
             "\n Reply \"apply changes\" to apply these updates.\n"
+            f"{self.as_state_str()}\n"
         )
-        
+
+    def as_state_str(self) -> str:
+        """Render the rewrite as a hidden, versioned HTML comment to embed in the bot's comment."""
+        state = json.dumps({"v": REWRITE_STATE_VERSION, **self.as_dict()}, ensure_ascii=False, separators=(",", ":"))
+        # "<" and ">" only occur inside JSON strings, so escaping them keeps "-->" from closing the comment.
+        state = state.replace("<", "\\u003c").replace(">", "\\u003e")
+        return f"{_REWRITE_STATE_PREFIX}{state}{_REWRITE_STATE_SUFFIX}"
+
+    @classmethod
+    def from_state(cls, comment_body: str) -> Optional["RewriteResponse"]:
+        """Read the rewrite embedded by `as_state_str`, or None when the comment has no readable state.
+
+        The last marker wins, since the bot appends it after any text quoted from the issue.
+        """
+        comment_body = comment_body or ""
+        start = comment_body.rfind(_REWRITE_STATE_PREFIX)
+        if start == -1:
+            return None
+        start += len(_REWRITE_STATE_PREFIX)
+        end = comment_body.find(_REWRITE_STATE_SUFFIX, start)
+        if end == -1:
+            return None
+        try:
+            state = json.loads(comment_body[start:end])
+        except ValueError:
+            return None
+        if not isinstance(state, dict) or state.get("v") != REWRITE_STATE_VERSION:
+            print(f"🟡 Unsupported rewrite state version {state.get('v') if isinstance(state, dict) else None}")
+            return None
+        return cls.from_dict(state)
+
     @classmethod
     def from_comment(cls, comment_body: str) -> "RewriteResponse":
-        """Create a RewriteResponse from a GitHub comment, skipping 'No update provided' fields, with logs."""
+        """Create a RewriteResponse from a GitHub comment, skipping 'No update provided' fields, with logs.
+
+        The embedded state is used when present; the markdown is only parsed for comments posted without it.
+        """
+        rewrite = cls.from_state(comment_body)
+        if rewrite is not None:
+            print("⚡ Using the rewrite state embedded in the comment")
+            return rewrite
         title = ""
         description = ""
         acceptance_criteria: List[str] = []
@@ -195,3 +303,62 @@ class RewriteResponse:
             print("❌ Rewrite marked as not applicable.")
 
         return instance
+
+
+def _check_fields(data: Any, fields: Dict[str, type], where: str) -> None:
+    if not isinstance(data, dict):
+        raise ValueError(f"{where} must be a JSON object")
+    for field, expected in fields.items():
+        if field not in data:
+            raise ValueError(f"{where} is missing \"{field}\"")
+        if not isinstance(data[field], expected):
+            raise ValueError(f"{where}.{field} must be of type {expected.__name__}")
+
+
+def parse_analysis_response(response: str) -> Tuple[ValidationResponse, Optional[RewriteResponse]]:
+    """Parse and schema-check the JSON returned by the combined analyze-and-rewrite prompt.
+
+    Raises ValueError describing the first problem found, so it can be sent back for repair.
+    """
+    try:
+        data = json.loads(response)
+    except ValueError as e:
+        raise ValueError(f"response is not valid JSON ({e})") from e
+
+    _check_fields(
+        data,
+        {
+            "summary": str,
+            "completeness": dict,
+            "importance": str,
+            "acceptance_evaluation": str,
+            "labels": list,
+            "ready_to_work": bool,
+        },
+        "analysis",
+    )
+    _check_fields(
+        data["completeness"],
+        {"title": bool, "description": bool, "acceptance_criteria": bool},
+        "completeness",
+    )
+    if not all(isinstance(label, str) for label in data["labels"]):
+        raise ValueError("labels must be a list of strings")
+
+    validation = ValidationResponse.from_dict(data)
+    validation.response = response
+
+    rewrite_data = data.get("rewrite")
+    if validation.ready_to_work or rewrite_data is None:
+        return validation, None
+
+    _check_fields(
+        rewrite_data,
+        {"title": str, "description": str, "acceptance_criteria": list, "not_applicable": bool},
+        "rewrite",
+    )
+    if not all(isinstance(item, str) for item in rewrite_data["acceptance_criteria"]):
+        raise ValueError("rewrite.acceptance_criteria must be a list of strings")
+    rewrite = RewriteResponse.from_dict(rewrite_data)
+    rewrite.response = json.dumps(rewrite_data)
+    return validation, rewrite
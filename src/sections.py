@@ -0,0 +1,70 @@
+import re
+from typing import Dict, NamedTuple
+
+# Section headers written by the rewrite and by issue templates, e.g. "Description:" on its own line.
+SECTION_NAMES = ("Description", "Acceptance Criteria")
+
+_HEADER_PATTERN = re.compile(
+    r"^[ \t]*(" + "|".join(re.escape(name) for name in SECTION_NAMES) + r"):[ \t]*\r?$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class Section(NamedTuple):
+    name: str
+    header_start: int
+    start: int
+    end: int
+
+
+def section_key(name: str) -> str:
+    """Map a header such as "Acceptance Criteria" to its key, "acceptance_criteria"."""
+    return name.strip().lower().replace(" ", "_")
+
+
+def index_sections(body: str) -> Dict[str, Section]:
+    """Locate each known section in one pass over the body; the first header of each kind wins.
+
+    A section's content starts on the line after its header and runs to the next blank line
+    or the end of the body, so `body[section.start:section.end]` is its text.
+    """
+    sections: Dict[str, Section] = {}
+    for match in _HEADER_PATTERN.finditer(body):
+        key = section_key(match.group(1))
+        if key in sections:
+            continue
+        start = min(match.end() + 1, len(body))
+        end = body.find("\n\n", start)
+        sections[key] = Section(key, match.start(), start, len(body) if end == -1 else end)
+    return sections
+
+
+def replace_sections(body: str, contents: Dict[str, str]) -> str:
+    """Replace the content of the sections in `contents`, keyed like "acceptance_criteria", in one pass.
+
+    Sections the body lacks are appended under their header. A section followed by another header
+    without a blank line in between ends at that header, so replacing it never swallows the next one.
+    """
+    sections = sorted(index_sections(body).values(), key=lambda s: s.header_start)
+    parts = []
+    position = 0
+    for i, section in enumerate(sections):
+        if section.name not in contents:
+            continue
+        end = section.end
+        if i + 1 < len(sections):
+            # The next header starts a line, so the newline before it is kept.
+            end = min(end, sections[i + 1].header_start - 1)
+        parts.append(body[position : section.start])
+        if section.start == len(body) and not body.endswith("\n"):
+            # A header on the last line has no newline after it yet.
+            parts.append("\n")
+        parts.append(contents[section.name])
+        position = max(end, section.start)
+    parts.append(body[position:])
+    found = {section.name for section in sections}
+    for name in SECTION_NAMES:
+        key = section_key(name)
+        if key in contents and key not in found:
+            parts.append(f"\n\n{name}:\n{contents[key]}")
+    return "".join(parts)
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from hedging import health_stats
+from openai_utils import initialize_kernel, scheduler_stats, usage_totals
+from completion_cache import open_completion_cache
+from duplicates import open_duplicate_index
+from github_utils import IssueConflictError, get_session
+from async_github_utils import apply_issue_mutation
+from event_payload import get_issue_data, get_comment_data
+from apply import build_apply_mutation, find_rewrite_comment
+from last_run import is_unchanged_since_last_run
+from pipeline import enhance_issue
+from coalescer import IssueCoalescer, DEFAULT_QUIET_SECONDS
+from fingerprint import FINGERPRINT_MARKER
+from responses import REWRITE_STATE_MARKER
+import tracing
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+APPLY_TRIGGER = "apply changes"
+ISSUE_ACTIONS = ("opened", "edited", "reopened")
+RETRY_AFTER_SECONDS = 30
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """Check the X-Hub-Signature-256 header GitHub sends with every webhook delivery."""
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def job_from_event(event: str, payload: Dict[str, Any], own_login: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Map a webhook delivery to an enhancement job, or None when the event needs no work.
+
+    Deliveries caused by a bot, including this server's own comments and edits as `own_login`, are ignored,
+    so the bot never triggers itself.
+    """
+    repository = payload.get("repository") or {}
+    issue = payload.get("issue") or {}
+    if not repository.get("full_name") or "number" not in issue or "pull_request" in issue:
+        return None
+    sender = payload.get("sender") or {}
+    if sender.get("type") == "Bot" or (own_login is not None and sender.get("login") == own_login):
+        return None
+
+    job = {
+        "repo_full_name": repository["full_name"],
+        "issue_number": issue["number"],
+        "payload": payload,
+        "received_at": time.monotonic(),
+    }
+    if event == "issues" and payload.get("action") in ISSUE_ACTIONS:
+        return {**job, "kind": "issue"}
+    comment = payload.get("comment") or {}
+    body = comment.get("body") or ""
+    if event == "issue_comment" and payload.get("action") == "created" and APPLY_TRIGGER in body:
+        # A comment carrying the bot's markers is the bot's own rewrite or a copy of it, not a request to apply one.
+        if REWRITE_STATE_MARKER in body or FINGERPRINT_MARKER in body:
+            return None
+        return {**job, "kind": "apply", "comment_id": comment["id"]}
+    return None
+
+
+class EnhancerServer:
+    """Runs webhook jobs on a pool of workers that share one warm kernel, cache and GitHub session.
+
+    Bursts of events for the same issue are coalesced, and work for each issue is serialized.
+    """
+
+    def __init__(
+        self,
+        inputs: Dict[str, Any],
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        quiet_seconds: float = DEFAULT_QUIET_SECONDS,
+    ):
+        self.inputs = inputs
+        self.workers = workers
+        self.queue_size = queue_size
+        self.quiet_seconds = quiet_seconds
+        self.metrics = {"received": 0, "accepted": 0, "ignored": 0, "rejected": 0, "processed": 0, "failed": 0}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.coalescer: Optional[IssueCoalescer] = None
+        self.kernel = None
+        self.cache = None
+        self.duplicates = None
+        self.login: Optional[str] = None
+        self._metrics_lock = threading.Lock()
+
+    def count(self, metric: str) -> None:
+        with self._metrics_lock:
+            self.metrics[metric] += 1
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.coalescer = IssueCoalescer(self._process, self.quiet_seconds, self.workers)
+        self.kernel = await asyncio.to_thread(initialize_kernel, self.inputs)
+        self.login = await asyncio.to_thread(get_session(self.inputs["github_token"]).login)
+        self.cache = open_completion_cache(
+            self.inputs.get("cache_dir"), self.inputs.get("cache_ttl_hours"), self.inputs.get("cache_max_mb")
+        )
+        self.duplicates = open_duplicate_index(self.inputs.get("cache_dir"), self.inputs.get("duplicate_threshold"))
+
+    def submit(self, job: Dict[str, Any]) -> bool:
+        """Queue a job from an HTTP thread. Returns False when the queue is full."""
+        return asyncio.run_coroutine_threadsafe(self._enqueue(job), self.loop).result()
+
+    async def _enqueue(self, job: Dict[str, Any]) -> bool:
+        # A job that supersedes a pending one does not grow the queue, so it is always accepted.
+        if self.coalescer.depth >= self.queue_size and not self.coalescer.is_pending(job):
+            self.count("rejected")
+            return False
+        self.coalescer.submit(job)
+        self.count("accepted")
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        return {
+            **metrics,
+            "merged": self.coalescer.merged if self.coalescer else 0,
+            "queue_depth": self.coalescer.depth if self.coalescer else 0,
+            "queue_capacity": self.queue_size,
+            "workers": self.workers,
+            "cache": self.cache.stats_str() if self.cache else None,
+            "token_usage": usage_totals.stats_str(),
+            "rate_limits": {
+                "github": get_session(self.inputs["github_token"]).reads.stats_str(),
+                **scheduler_stats(),
+            },
+            "latency": health_stats(),
+        }
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        try:
+            with tracing.span("server.job", kind=job["kind"], repo=job["repo_full_name"], issue=job["issue_number"]):
+                await self.run_job(job)
+            self.count("processed")
+            print(
+                f"✅ {job['kind']} job for {job['repo_full_name']}#{job['issue_number']} done in "
+                f"{(time.monotonic() - job['received_at']) * 1000:.0f} ms"
+            )
+        except Exception as e:
+            self.count("failed")
+            print(
+                f"❌ {job['kind']} job for {job['repo_full_name']}#{job['issue_number']} failed: "
+                f"{type(e).__name__}: {e}",
+                file=sys.stderr,
+            )
+        finally:
+            await asyncio.to_thread(tracing.export)
+
+    async def run_job(self, job: Dict[str, Any]) -> None:
+        token = self.inputs["github_token"]
+        repo_full_name = job["repo_full_name"]
+        issue_number = job["issue_number"]
+        payload = job["payload"]
+        # Comments may have been edited or deleted since an earlier job; jobs for one issue never overlap,
+        # so this job's lookups start afresh without racing another's.
+        get_session(token).forget_marked_comments(repo_full_name, issue_number)
+
+        if job["kind"] == "issue":
+            issue = await asyncio.to_thread(get_issue_data, token, repo_full_name, issue_number, payload)
+            if self.inputs.get("skip_unchanged") and await is_unchanged_since_last_run(token, repo_full_name, issue):
+                return
+            await enhance_issue(
+                self.kernel, {**self.inputs, "repo_full_name": repo_full_name}, issue, self.cache, self.duplicates
+            )
+            return
+
+        issue, comment = await asyncio.gather(
+            asyncio.to_thread(get_issue_data, token, repo_full_name, issue_number, payload),
+            asyncio.to_thread(get_comment_data, token, repo_full_name, issue_number, job["comment_id"], payload),
+        )
+        comment = await find_rewrite_comment(token, repo_full_name, issue_number, comment)
+        mutation = build_apply_mutation(repo_full_name, issue, comment)
+        try:
+            await apply_issue_mutation(token, mutation)
+        except IssueConflictError as e:
+            print(f"🟡 Not applying rewrite, the issue changed concurrently: {e}")
+
+
+def make_handler(server: EnhancerServer, secret: str):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path == "/metrics":
+                self._reply(200, server.snapshot())
+            elif self.path == "/healthz":
+                self._reply(200, {"status": "ok"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            server.count("received")
+            if not verify_signature(secret, body, self.headers.get("X-Hub-Signature-256")):
+                self._reply(401, {"error": "invalid signature"})
+                return
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self._reply(400, {"error": "invalid JSON"})
+                return
+
+            job = job_from_event(self.headers.get("X-GitHub-Event", ""), payload, server.login)
+            if job is None:
+                server.count("ignored")
+                self._reply(200, {"status": "ignored"})
+            elif server.submit(job):
+                self._reply(202, {"status": "queued", "queue_depth": server.coalescer.depth})
+            else:
+                self._reply(503, {"error": "queue full"}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return WebhookHandler
+
+
+async def serve(
+    inputs: Dict[str, Any],
+    secret: str,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    workers: int = DEFAULT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    quiet_seconds: float = DEFAULT_QUIET_SECONDS,
+) -> None:
+    """Accept GitHub webhook deliveries until interrupted; jobs run on the calling event loop."""
+    server = EnhancerServer(inputs, workers, queue_size, quiet_seconds)
+    await server.start()
+    httpd = ThreadingHTTPServer((host, port), make_handler(server, secret))
+    print(
+        f"🌐 Listening for webhooks on {host}:{port} "
+        f"({workers} workers, queue of {queue_size}, {quiet_seconds:g}s quiet window)"
+    )
+    try:
+        await asyncio.to_thread(httpd.serve_forever)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        if server.duplicates is not None:
+            server.duplicates.save()
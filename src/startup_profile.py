@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+from typing import List, Optional, Tuple
+
+IMPORT_TIME_PREFIX = "import time:"
+TOP_MODULES = 15
+
+
+def parse_import_time(line: str) -> Optional[Tuple[str, int, int, int]]:
+    """Parse a `-X importtime` line into (module, self_us, cumulative_us, depth)."""
+    if not line.startswith(IMPORT_TIME_PREFIX):
+        return None
+    fields = line[len(IMPORT_TIME_PREFIX):].split("|")
+    if len(fields) != 3 or not fields[0].strip().isdigit():
+        return None  # the header line
+    name = fields[2].rstrip()
+    depth = (len(name) - len(name.lstrip())) // 2
+    return name.strip(), int(fields[0]), int(fields[1]), depth
+
+
+def format_report(records: List[Tuple[str, int, int, int]], budget_ms: Optional[float]) -> str:
+    # The interpreter's own startup imports sit at depth 0 too, so the total covers all of them.
+    total_ms = sum(cumulative for _, _, cumulative, depth in records if depth == 0) / 1000
+    lines = [f"⏱ Startup imports: {len(records)} modules in {total_ms:.1f} ms"]
+    for name, self_us, cumulative_us, _ in sorted(records, key=lambda r: r[2], reverse=True)[:TOP_MODULES]:
+        lines.append(f"   {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+    if budget_ms is not None and total_ms > budget_ms:
+        lines.append(f"::warning::Startup imports took {total_ms:.1f} ms, over the {budget_ms:.0f} ms budget")
+    return "\n".join(lines)
+
+
+def run_with_import_profile(budget_ms: Optional[str] = None) -> int:
+    """Re-run this process under `-X importtime` and report the slowest module imports.
+
+    Output from the child passes straight through; only the importtime lines are summarized.
+    Returns the child's exit code.
+    """
+    env = dict(os.environ, INPUT_PROFILE_STARTUP="false")
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", *sys.argv],
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    records = []
+    for line in process.stderr:
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            sys.stderr.write(line)
+            continue
+        record = parse_import_time(line)
+        if record is not None:
+            records.append(record)
+    returncode = process.wait()
+    print(format_report(records, float(budget_ms) if budget_ms else None))
+    return returncode
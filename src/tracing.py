@@ -0,0 +1,294 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import requests
+
+SERVICE_NAME = "issue-enhancer-agent"
+# Only the most recent spans are kept for the metrics file; stage totals cover every span.
+MAX_KEPT_SPANS = 10000
+OTLP_TIMEOUT_SECONDS = 10
+# Numeric span attributes that are summed per stage and over the whole run.
+TOTALED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "cached_tokens", "scheduled_calls", "retries", "throttle_wait_ms")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage. Used as a context manager it becomes the parent of spans started inside it.
+
+    The context is copied into tasks and `asyncio.to_thread` workers, so nesting follows the pipeline.
+    """
+
+    __slots__ = ("tracer", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float = 1) -> None:
+        with self.tracer.lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end_ns = time.time_ns()
+        self.tracer.finish(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        self.end(exc)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for every span while tracing is disabled, so instrumented code pays almost nothing."""
+
+    __slots__ = ()
+    duration_ms = 0.0
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def add(self, key: str, amount: float = 1) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.totals: Dict[str, float] = {}
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.errors += span.error is not None
+        self.total_ms += span.duration_ms
+        self.max_ms = max(self.max_ms, span.duration_ms)
+        for key in TOTALED_ATTRIBUTES:
+            if key in span.attributes:
+                self.totals[key] = self.totals.get(key, 0) + span.attributes[key]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            **{key: round(value, 3) for key, value in self.totals.items()},
+        }
+
+
+class Tracer:
+    """Collects the spans of one process for the JSON metrics file, an OTLP collector and Action outputs."""
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics_file: Optional[str] = None
+        self.otlp_endpoint: Optional[str] = None
+        self.trace_id = os.urandom(16).hex()
+        self.lock = threading.Lock()
+        self.stages: Dict[str, StageStats] = {}
+        self.kept: Deque[Span] = deque(maxlen=MAX_KEPT_SPANS)
+        self.unsent: List[Span] = []
+
+    def configure(self, metrics_file: Optional[str] = None, otlp_endpoint: Optional[str] = None) -> None:
+        self.metrics_file = metrics_file or None
+        self.otlp_endpoint = (otlp_endpoint or "").rstrip("/") or None
+        self.enabled = bool(self.metrics_file or self.otlp_endpoint)
+
+    def span(self, name: str, **attributes: Any):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current.get(), attributes)
+
+    def finish(self, span: Span) -> None:
+        with self.lock:
+            self.stages.setdefault(span.name, StageStats()).add(span)
+            self.kept.append(span)
+            if self.otlp_endpoint:
+                self.unsent.append(span)
+
+    def totals(self) -> Dict[str, float]:
+        """Sum the counted attributes over every span, and the duration over root spans."""
+        with self.lock:
+            totals = {key: 0.0 for key in TOTALED_ATTRIBUTES}
+            for stats in self.stages.values():
+                for key, value in stats.totals.items():
+                    totals[key] += value
+            totals["duration_ms"] = sum(span.duration_ms for span in self.kept if span.parent_id is None)
+        return totals
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            stages = {name: stats.as_dict() for name, stats in sorted(self.stages.items())}
+            spans = [span.as_dict() for span in self.kept]
+        return {"trace_id": self.trace_id, "totals": self.totals(), "stages": stages, "spans": spans}
+
+    def export(self) -> None:
+        """Write the metrics file and send unsent spans to the collector; failures never fail the run."""
+        if not self.enabled:
+            return
+        if self.metrics_file:
+            metrics = self.metrics()
+            try:
+                with open(self.metrics_file, "w") as f:
+                    json.dump(metrics, f, indent=2)
+                print(f"📊 Wrote metrics for {len(metrics['stages'])} stages to {self.metrics_file}")
+            except OSError as e:
+                print(f"Error writing metrics file: {e}", file=sys.stderr)
+        if self.otlp_endpoint:
+            self._send_otlp()
+
+    def outputs(self) -> Dict[str, str]:
+        """Action output values: run totals and the time spent in each stage."""
+        totals = self.totals()
+        with self.lock:
+            stage_durations = {name: round(stats.total_ms, 1) for name, stats in sorted(self.stages.items())}
+        return {
+            **{key: str(round(value)) for key, value in totals.items()},
+            "stage_durations_ms": json.dumps(stage_durations, separators=(",", ":")),
+        }
+
+    def _send_otlp(self) -> None:
+        with self.lock:
+            spans, self.unsent = self.unsent, []
+        if not spans:
+            return
+        try:
+            response = requests.post(
+                f"{self.otlp_endpoint}/v1/traces", json=otlp_payload(self.trace_id, spans), timeout=OTLP_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Error sending spans to {self.otlp_endpoint}: {e}", file=sys.stderr)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def otlp_payload(trace_id: str, spans: List[Span]) -> Dict[str, Any]:
+    """Encode spans as an OTLP/HTTP JSON trace export request."""
+    resource = {"service.name": SERVICE_NAME}
+    for env, key in (("GITHUB_REPOSITORY", "github.repository"), ("GITHUB_RUN_ID", "github.run_id")):
+        if os.getenv(env):
+            resource[key] = os.getenv(env)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes(resource)},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": SERVICE_NAME},
+                        "spans": [
+                            {
+                                "traceId": trace_id,
+                                "spanId": span.span_id,
+                                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                                "name": span.name,
+                                "kind": 1,
+                                "startTimeUnixNano": str(span.start_ns),
+                                "endTimeUnixNano": str(span.end_ns),
+                                "attributes": _otlp_attributes(span.attributes),
+                                # STATUS_CODE_ERROR is 2, STATUS_CODE_UNSET is 0
+                                "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+                            }
+                            for span in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+tracer = Tracer()
+
+
+def configure(metrics_file: Optional[str] = None, otlp_endpoint: Optional[str] = None) -> None:
+    tracer.configure(metrics_file, otlp_endpoint)
+
+
+def span(name: str, **attributes: Any):
+    """Start a span, to be used as a context manager; a shared no-op span while tracing is disabled."""
+    return tracer.span(name, **attributes)
+
+
+def current_span():
+    """The innermost open span of this task or thread, or the no-op span."""
+    return (_current.get() if tracer.enabled else None) or NOOP_SPAN
+
+
+def add(key: str, amount: float = 1) -> None:
+    """Add to a counter on the current span, e.g. retries made by the scheduler."""
+    if tracer.enabled:
+        current = _current.get()
+        if current is not None:
+            current.add(key, amount)
+
+
+def export() -> None:
+    tracer.export()
+
+
+def outputs() -> Dict[str, str]:
+    return tracer.outputs() if tracer.enabled else {}
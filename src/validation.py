@@ -1,16 +1,19 @@
 import sys
 
-def validate_inputs(inputs):
+ENDPOINT_PREFIXES = ("https://", "http://127.0.0.1:", "http://localhost:")
+
+def validate_inputs(inputs, require_issue_id=True, require_repo=True):
     errors = []
     if not inputs.get("github_token") or len(inputs["github_token"].strip()) < 10:
         errors.append("Invalid or missing GitHub token.")
     if not inputs.get("openai_api_key") or len(inputs["openai_api_key"].strip()) < 10:
         errors.append("Invalid or missing OpenAI API key.")
-    if not inputs.get("issue_id") or not str(inputs["issue_id"]).strip().isdigit():
+    if require_issue_id and (not inputs.get("issue_id") or not str(inputs["issue_id"]).strip().isdigit()):
         errors.append("Invalid or missing issue ID (should be a number).")
-    if not inputs.get("repo_full_name") or '/' not in inputs["repo_full_name"]:
+    if require_repo and (not inputs.get("repo_full_name") or '/' not in inputs["repo_full_name"]):
         errors.append("Invalid or missing GITHUB_REPOSITORY (should be in 'owner/repo' format).")
-    if not inputs.get("azure_endpoint") or not inputs["azure_endpoint"].startswith("https://"):
+    # Plain http is only accepted for local stand-in servers, e.g. in benchmarks.
+    if not inputs.get("azure_endpoint") or not inputs["azure_endpoint"].startswith(ENDPOINT_PREFIXES):
         errors.append("Invalid or missing AZURE_OPENAI_ENDPOINT.")
     if not inputs.get("azure_deployment"):
         errors.append("Invalid or missing AZURE_OPENAI_DEPLOYMENT.")